@@ -0,0 +1,217 @@
+"""
+Benchmark of the embedded MQTT broker against an external broker
+
+For every broker and QoS it measures
+    - the round trip latency of a request and its reply, like initialize -> initialize_ack between the base station
+      and a puzzle, with one request at a time
+    - the throughput of a burst of messages from one client to another
+
+The embedded broker (Classes/MqttBroker.py) runs in a separate process, so it does not share the GIL with the
+clients of the benchmark. With --external the broker of the environment variables MQTT_BROKER and MQTT_PORT
+(or the .env file) is measured as well, --external-broker host:port selects another broker.
+
+Usage (from the BaseStation folder):
+    python Benchmarks/BrokerBenchmark.py
+    python Benchmarks/BrokerBenchmark.py --external --round-trips 100 --messages 2000
+    python Benchmarks/BrokerBenchmark.py --external-broker test.mosquitto.org:1883 --protocol 311 --json broker.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+from dotenv import load_dotenv
+
+import paho.mqtt.client as mqtt
+
+baseStationPath = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(baseStationPath))
+
+from Classes.LatencyHistogram import LatencyHistogram
+from Classes.Log import initLogger, WARNING
+
+def runBroker(portQueue, stopEvent):
+    """
+    Main function of the process of the embedded broker
+    """
+    sys.path.insert(0, str(baseStationPath))
+    from Classes.MqttBroker import MqttBroker
+
+    initLogger(None, WARNING)
+    broker = MqttBroker("127.0.0.1", 0)
+    broker.start()
+    portQueue.put(broker.getAddress()[1])
+    stopEvent.wait()
+    portQueue.put(broker.getStatistics())
+    broker.stop()
+
+class BenchmarkClient():
+    """
+    paho client which counts the received messages and passes them to a callback
+    """
+    def __init__(self, host: str, port: int, protocol, name: str):
+        self.client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
+                                  client_id=f"{name}-{uuid.uuid4().hex[:8]}", protocol=protocol)
+        if os.getenv("MQTT_USER", "") != "":
+            self.client.username_pw_set(os.getenv("MQTT_USER"), os.getenv("MQTT_PW", ""))
+        self.connected = threading.Event()
+        self.subscribed = threading.Event()
+        self.onMessage = None
+        self.client.on_connect = lambda client, userdata, flags, code, properties: self.connected.set()
+        self.client.on_subscribe = lambda client, userdata, mid, codes, properties: self.subscribed.set()
+        self.client.on_message = lambda client, userdata, msg: self.onMessage(msg)
+        # Like the MqttConnection of the base station, so the acks do not wait for the delayed TCP ack
+        self.client.on_socket_open = lambda client, userdata, sock: sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.client.connect(host, port, 60)
+        self.client.loop_start()
+        if not self.connected.wait(10):
+            raise Exception(f"Could not connect to {host}:{port}")
+
+    def subscribe(self, topic: str, qos: int):
+        self.subscribed.clear()
+        self.client.subscribe(topic, qos)
+        if not self.subscribed.wait(10):
+            raise Exception(f"Could not subscribe to {topic}")
+
+    def stop(self):
+        self.client.disconnect()
+        self.client.loop_stop()
+
+def measureRoundTrips(host: str, port: int, protocol, qos: int, count: int, timeout: float):
+    """
+    Sends count requests one after another and returns the summary of the round trip latencies in ms
+    """
+    prefix = f"benchmark/{uuid.uuid4().hex[:8]}"
+    requester = BenchmarkClient(host, port, protocol, "requester")
+    responder = BenchmarkClient(host, port, protocol, "responder")
+
+    responder.onMessage = lambda msg: responder.client.publish(f"{prefix}/reply", msg.payload, qos)
+    responder.subscribe(f"{prefix}/request", qos)
+
+    replies = {}
+    replyCondition = threading.Condition()
+    def onReply(msg):
+        with replyCondition:
+            replies[msg.payload] = time.perf_counter()
+            replyCondition.notify()
+    requester.onMessage = onReply
+    requester.subscribe(f"{prefix}/reply", qos)
+
+    latencies = LatencyHistogram()
+    lost = 0
+    for index in range(count):
+        payload = str(index).encode()
+        startTime = time.perf_counter()
+        requester.client.publish(f"{prefix}/request", payload, qos)
+        with replyCondition:
+            if replyCondition.wait_for(lambda: payload in replies, timeout):
+                latencies.record(replies[payload] - startTime)
+            else:
+                lost += 1
+
+    requester.stop()
+    responder.stop()
+    summary = latencies.getSummary()
+    summary["lost"] = lost
+    return summary
+
+def measureThroughput(host: str, port: int, protocol, qos: int, count: int, timeout: float):
+    """
+    Publishes count messages as fast as possible and returns the messages per second until the last one was received
+    """
+    topic = f"benchmark/{uuid.uuid4().hex[:8]}/load"
+    publisher = BenchmarkClient(host, port, protocol, "publisher")
+    subscriber = BenchmarkClient(host, port, protocol, "subscriber")
+
+    received = [0]
+    done = threading.Event()
+    def onMessage(msg):
+        received[0] += 1
+        if received[0] == count:
+            done.set()
+    subscriber.onMessage = onMessage
+    subscriber.subscribe(topic, qos)
+
+    payload = b"0123456789" * 10 # 100 bytes
+    startTime = time.perf_counter()
+    for _ in range(count):
+        publisher.client.publish(topic, payload, qos)
+    done.wait(timeout)
+    duration = time.perf_counter() - startTime
+
+    publisher.stop()
+    subscriber.stop()
+    return {"messages": count, "received": received[0], "durationS": duration, "messagesPerS": received[0] / duration}
+
+def runBenchmark(name: str, host: str, port: int, args):
+    """
+    Runs all measurements against one broker and prints them
+    """
+    protocol = mqtt.MQTTProtocolVersion.MQTTv5 if args.protocol == "5" else mqtt.MQTTProtocolVersion.MQTTv311
+    results = {"host": host, "port": port, "roundTripMs": {}, "throughput": {}}
+    for qos in args.qos:
+        results["roundTripMs"][qos] = measureRoundTrips(host, port, protocol, qos, args.round_trips, args.timeout)
+        results["throughput"][qos] = measureThroughput(host, port, protocol, qos, args.messages, args.timeout)
+
+    print()
+    print(f"{name} ({host}:{port}), MQTT {'5' if args.protocol == '5' else '3.1.1'}")
+    print(f"{'Round trip [ms]':<16} {'count':>8} {'lost':>6} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}")
+    for qos, s in results["roundTripMs"].items():
+        if s["count"] == 0:
+            print(f"{'QoS ' + str(qos):<16} {0:>8} {s['lost']:>6}")
+            continue
+        print(f"{'QoS ' + str(qos):<16} {s['count']:>8} {s['lost']:>6} {s['p50']:>9.2f} {s['p90']:>9.2f} {s['p99']:>9.2f} {s['max']:>9.2f}")
+    print(f"{'Throughput':<16} {'sent':>8} {'lost':>6} {'msg/s':>9}")
+    for qos, s in results["throughput"].items():
+        print(f"{'QoS ' + str(qos):<16} {s['messages']:>8} {s['messages'] - s['received']:>6} {s['messagesPerS']:>9.0f}")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency and throughput of the embedded MQTT broker and an external broker")
+    parser.add_argument("--external", action="store_true", help="Also measure the broker of MQTT_BROKER and MQTT_PORT")
+    parser.add_argument("--external-broker", default=None, help="Also measure this broker, as host:port")
+    parser.add_argument("--round-trips", type=int, default=200, help="Number of requests per QoS")
+    parser.add_argument("--messages", type=int, default=5000, help="Number of messages of the throughput test per QoS")
+    parser.add_argument("--qos", type=int, nargs="+", default=[0, 1, 2], choices=[0, 1, 2], help="QoS levels to measure")
+    parser.add_argument("--protocol", default="5", choices=["5", "311"], help="MQTT version of the clients")
+    parser.add_argument("--timeout", type=float, default=30, help="Seconds to wait for a reply or the last message")
+    parser.add_argument("--json", type=Path, default=None, help="Write the results to this file")
+    args = parser.parse_args()
+
+    initLogger(None, WARNING)
+    load_dotenv()
+
+    context = multiprocessing.get_context("spawn")
+    portQueue = context.Queue()
+    stopEvent = context.Event()
+    brokerProcess = context.Process(target=runBroker, args=(portQueue, stopEvent), daemon=True)
+    brokerProcess.start()
+    port = portQueue.get(timeout=30)
+
+    results = {}
+    try:
+        results["embedded"] = runBenchmark("Embedded broker", "127.0.0.1", port, args)
+    finally:
+        stopEvent.set()
+        results["embedded"] = dict(results.get("embedded", {}), broker=portQueue.get(timeout=30))
+        brokerProcess.join()
+
+    externalBroker = args.external_broker
+    if externalBroker is None and args.external:
+        externalBroker = f"{os.getenv('MQTT_BROKER', 'mqtt.eclipseprojects.io')}:{os.getenv('MQTT_PORT', '1883')}"
+    if externalBroker is not None:
+        host, _, port = externalBroker.rpartition(":")
+        results["external"] = runBenchmark("External broker", host, int(port), args)
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=4)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+Benchmark of the initialization storm, when the base station sends the initialize message to all puzzles at once
+
+A VirtualPuzzleFleet answers every initialize message with initialize_ack, and the InitializeHandshake of the
+base station retries every puzzle until it is acknowledged. For every mode it reports
+    - the time from the start of the handshake until the puzzles were ready
+    - the number of initialize messages including the retries
+    - the number of MQTT packets and bytes the broker received and sent during the storm
+
+The modes are
+    qos2             every message with QoS 2 and one wakeup of the event loop per message, like before the delivery policies
+    policy           QoS and retain flag of the deliveryPolicies in Classes/CommunicationManager.py
+    policy+batching  the delivery policies and the messages of the same tick passed to the event loop at once
+
+The embedded broker (Classes/MqttBroker.py) runs in a separate process, so it does not share the GIL with the
+base station and the fleet.
+
+Usage (from the BaseStation folder):
+    python Benchmarks/InitializeBenchmark.py
+    python Benchmarks/InitializeBenchmark.py --puzzles 1000 --drop-initialize 0.1 --json initialize.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import sys
+import time
+from pathlib import Path
+
+baseStationPath = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(baseStationPath))
+
+from Classes.CommunicationManager import CommunicationManager, deliveryPolicies, initializeMessageAck
+from Classes.InitializeHandshake import InitializeHandshake
+from Classes.Log import initLogger, WARNING
+from Classes.MqttConnection import MqttConnection
+from Classes.VirtualPuzzleFleet import VirtualPuzzleFleet, createVirtualPuzzles, getPercentiles
+
+modes = {
+    "qos2": ({}, False),
+    "policy": (deliveryPolicies, False),
+    "policy+batching": (deliveryPolicies, True),
+}
+
+def runBroker(portQueue, commands):
+    """
+    Main function of the process of the embedded broker, answers "statistics" until it receives "stop"
+    """
+    sys.path.insert(0, str(baseStationPath))
+    from Classes.MqttBroker import MqttBroker
+
+    initLogger(None, WARNING)
+    broker = MqttBroker("127.0.0.1", 0)
+    broker.start()
+    portQueue.put(broker.getAddress()[1])
+    while commands.get() != "stop":
+        portQueue.put(broker.getStatistics())
+    broker.stop()
+
+def waitUntil(condition, timeout: float):
+    """
+    Waits until the condition is true, returns false if the timeout has passed
+    """
+    endTime = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > endTime:
+            return False
+        time.sleep(0.01)
+    return True
+
+def runMode(name: str, args):
+    """
+    Runs one initialization storm against a new broker and returns the results
+    """
+    policies, batching = modes[name]
+
+    context = multiprocessing.get_context("spawn")
+    portQueue = context.Queue()
+    commands = context.Queue()
+    brokerProcess = context.Process(target=runBroker, args=(portQueue, commands), daemon=True)
+    brokerProcess.start()
+    MqttConnection.mqttBroker = "127.0.0.1"
+    MqttConnection.mqttPort = portQueue.get(timeout=30)
+
+    puzzles = createVirtualPuzzles(args.puzzles)
+    puzzlesByTopic = {p.mqttTopicGeneral: p for p in puzzles}
+
+    fleetConnection = MqttConnection()
+    fleetConnection.batchPublishes = batching
+    fleet = VirtualPuzzleFleet(puzzles, fleetConnection, pointsRate=0, solveTime=3600,
+                               dropInitialize=args.drop_initialize, seed=args.seed)
+    fleet.communicationManager.deliveryPolicies = policies
+
+    baseConnection = MqttConnection()
+    baseConnection.batchPublishes = batching
+    com = CommunicationManager(connection=baseConnection)
+    com.deliveryPolicies = policies
+    handshake = InitializeHandshake(com.publish, puzzles)
+
+    def onMessage(topic, payload):
+        if payload == initializeMessageAck and topic in puzzlesByTopic:
+            handshake.acknowledge(puzzlesByTopic[topic])
+    com.onMessage = onMessage
+
+    fleet.start()
+    com.start()
+    for puzzle in puzzles:
+        com.subscribe(puzzle.mqttTopicGeneral)
+    if not waitUntil(lambda: fleetConnection.isConnected and baseConnection.isConnected, 10):
+        raise Exception("Could not connect to the embedded broker")
+    time.sleep(1) # Until the broker confirmed the subscriptions
+
+    commands.put("statistics")
+    before = portQueue.get(timeout=30)
+
+    startTime = time.perf_counter()
+    handshake.start()
+    isReady = waitUntil(lambda: len(handshake.getPendingPuzzles()) == 0, args.timeout)
+    duration = time.perf_counter() - startTime
+    time.sleep(0.5) # Until the last acknowledgements of QoS 1 and 2 are exchanged
+
+    commands.put("statistics")
+    after = portQueue.get(timeout=30)
+
+    handshake.stop()
+    attempts = sum(handshake.attempts.values())
+    timeToReady = handshake.getTimeToReady()
+    baseStatistics = baseConnection.getStatistics()
+    fleetStatistics = fleetConnection.getStatistics()
+    com.stop()
+    fleet.stop()
+
+    commands.put("stop")
+    brokerProcess.join()
+
+    counters = ["packetsReceived", "packetsSent", "bytesReceived", "bytesSent", "received", "sent"]
+    return {
+        "puzzles": len(puzzles),
+        "ready": len(timeToReady),
+        "allReady": isReady,
+        "durationS": duration,
+        "timeToReadyMs": getPercentiles([t * 1000 for t in timeToReady.values()]),
+        "initializeMessages": attempts,
+        "broker": {counter: after[counter] - before[counter] for counter in counters},
+        "publishBatches": {"baseStation": baseStatistics["publishBatches"], "fleet": fleetStatistics["publishBatches"]},
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Messages and latency of the initialization storm with and without delivery policies and batching")
+    parser.add_argument("--puzzles", type=int, default=500, help="Number of virtual puzzles")
+    parser.add_argument("--drop-initialize", type=float, default=0, help="Probability that a puzzle ignores an initialize message")
+    parser.add_argument("--modes", nargs="+", default=list(modes.keys()), choices=list(modes.keys()), help="Modes to measure")
+    parser.add_argument("--timeout", type=float, default=60, help="Seconds to wait until all puzzles are ready")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the fleet")
+    parser.add_argument("--json", type=Path, default=None, help="Write the results to this file")
+    args = parser.parse_args()
+
+    initLogger(None, WARNING)
+
+    results = {}
+    for name in args.modes:
+        results[name] = runMode(name, args)
+
+    print()
+    print(f"Initialization of {args.puzzles} puzzles")
+    print(f"{'Mode':<16} {'ready':>6} {'all [s]':>8} {'p50 [ms]':>9} {'p99 [ms]':>9} {'init':>6} {'packets':>8} {'kB':>8} {'batches':>8}")
+    for name, r in results.items():
+        latencies = r["timeToReadyMs"]
+        packets = r["broker"]["packetsReceived"] + r["broker"]["packetsSent"]
+        kilobytes = (r["broker"]["bytesReceived"] + r["broker"]["bytesSent"]) / 1000
+        batches = r["publishBatches"]["baseStation"] + r["publishBatches"]["fleet"]
+        p50 = f"{latencies['p50']:>9.1f}" if latencies["count"] > 0 else f"{'-':>9}"
+        p99 = f"{latencies['p99']:>9.1f}" if latencies["count"] > 0 else f"{'-':>9}"
+        print(f"{name:<16} {r['ready']:>6} {r['durationS']:>8.3f} {p50} {p99} {r['initializeMessages']:>6} {packets:>8} {kilobytes:>8.1f} {batches:>8}")
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=4)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+End-to-end load test of the base station with a fleet of virtual puzzles
+
+Runs the MainScreen with the Qt offscreen platform together with a VirtualPuzzleFleet, which speaks the protocol
+of the real puzzles, and reports
+    - the throughput of the messages sent by the fleet and of the state changes of the base station
+    - the latency percentiles from publishing a message until the base station changed its state
+    - the counters of the message queue of the base station
+    - the number of coalesced UI updates and the time needed to apply them
+
+By default the base station and the fleet share an in-process LoopbackConnection, so no broker is needed.
+With --broker both connect to the broker of the environment variables MQTT_BROKER and MQTT_PORT,
+each with its own connection. The test runs in an empty temporary folder, so the journal of a real game is not touched.
+
+Usage (from the BaseStation folder):
+    python Benchmarks/LoadTest.py
+    python Benchmarks/LoadTest.py --puzzles 500 --points-rate 5 --solve-time 20 --json load.json
+    python Benchmarks/LoadTest.py --broker --drop-initialize 0.2 --duplicate 0.01 --malformed 0.01
+    python Benchmarks/LoadTest.py --fleet-only --from-folder Puzzles # Only the puzzles, for a base station started separately
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+baseStationPath = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(baseStationPath))
+
+from Classes.Log import initLogger, WARNING, INFO
+from Classes.Puzzle import getAllPuzzlesFromFolder
+from Classes.VirtualPuzzleFleet import VirtualPuzzleFleet, createVirtualPuzzles
+
+def formatLatencies(name: str, latencies: dict):
+    """
+    Returns a line of the latency table
+    """
+    if latencies["count"] == 0:
+        return f"{name:<28} {0:>8}"
+    return (f"{name:<28} {latencies['count']:>8} {latencies['p50']:>9.2f} {latencies['p90']:>9.2f}"
+            f" {latencies['p99']:>9.2f} {latencies['max']:>9.2f}")
+
+def runWithBaseStation(args, puzzles):
+    """
+    Runs the MainScreen and the fleet in this process until the game is finished or the time is up
+    """
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PySide6.QtWidgets import QApplication
+    from PySide6.QtCore import QTimer, QCoreApplication, QEvent
+    from Classes.MqttConnection import MqttConnection, setSharedConnection
+    from Classes.LoopbackConnection import LoopbackConnection
+    from Widgets.MainScreen import MainScreen
+
+    if args.broker:
+        fleetConnection = MqttConnection()
+    else:
+        fleetConnection = LoopbackConnection(latency=args.latency / 1000)
+        setSharedConnection(fleetConnection)
+
+    app = QApplication(sys.argv)
+    fleet = VirtualPuzzleFleet(puzzles, fleetConnection, args.points_rate, args.solve_time, args.finish_retry,
+                               args.drop_initialize, args.duplicate, args.malformed, args.seed, args.presence)
+
+    stateChanges = [0]
+    def onStateChange(event, data):
+        stateChanges[0] += 1
+        fleet.latencyTracker.observe(event, data)
+
+    mainScreen = MainScreen(puzzles)
+    mainScreen.onStateChange = onStateChange
+    mainScreen.show()
+    fleet.start()
+
+    startTime = time.perf_counter()
+    def check():
+        completedCount = mainScreen.engine.getSnapshot().completedCount
+        if completedCount < len(puzzles) and time.perf_counter() - startTime < args.duration:
+            return
+        timer.stop()
+        queueStatistics = mainScreen.communicationManager.getStatistics()
+        telemetry = mainScreen.communicationManager.getTelemetry()
+        connectionStatistics = mainScreen.communicationManager.connection.getStatistics()
+        fleet.stop()
+        results["baseStation"] = {
+            "completed": completedCount,
+            "stateChanges": stateChanges[0],
+            "stateChangesPerS": stateChanges[0] / (time.perf_counter() - startTime),
+            "queue": queueStatistics,
+            "connection": connectionStatistics,
+            "telemetry": {"rates": telemetry["rates"], "all": telemetry["all"]},
+            "ui": mainScreen.uiUpdater.getStatistics(),
+        }
+        app.quit()
+
+    results = {}
+    timer = QTimer()
+    timer.timeout.connect(check)
+    timer.start(50)
+    app.exec()
+
+    # The threads of the game are stopped and the screens are deleted before the QApplication, otherwise the
+    # interpreter can crash while collecting them at exit. The session and the fleet release their connections
+    timer.stop()
+    timer.timeout.disconnect(check)
+    mainScreen.shutdown()
+    QCoreApplication.sendPostedEvents(None, QEvent.Type.DeferredDelete)
+    app.processEvents()
+
+    results["fleet"] = fleet.getStatistics()
+    return results
+
+def runFleetOnly(args, puzzles):
+    """
+    Runs only the fleet until every puzzle is finished or the time is up
+    """
+    fleet = VirtualPuzzleFleet(puzzles, None, args.points_rate, args.solve_time, args.finish_retry,
+                               args.drop_initialize, args.duplicate, args.malformed, args.seed, args.presence)
+    fleet.start()
+
+    startTime = time.perf_counter()
+    while not fleet.isDone() and time.perf_counter() - startTime < args.duration:
+        time.sleep(0.1)
+    fleet.stop()
+
+    return {"fleet": fleet.getStatistics()}
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the base station with virtual puzzles")
+    parser.add_argument("--puzzles", type=int, default=100, help="Number of virtual puzzles")
+    parser.add_argument("--from-folder", type=Path, default=None, help="Simulate the puzzles of this folder instead")
+    parser.add_argument("--points-rate", type=float, default=1, help="Points messages per second and puzzle")
+    parser.add_argument("--solve-time", type=float, default=10, help="Mean seconds from the initialization until a puzzle is finished")
+    parser.add_argument("--finish-retry", type=float, default=1, help="Seconds between two finished messages until the ack")
+    parser.add_argument("--drop-initialize", type=float, default=0, help="Probability that a puzzle ignores an initialize message")
+    parser.add_argument("--duplicate", type=float, default=0, help="Probability that a message is sent twice")
+    parser.add_argument("--malformed", type=float, default=0, help="Probability that a points message is not an integer")
+    parser.add_argument("--latency", type=float, default=0, help="Delay of the loopback connection in ms")
+    parser.add_argument("--duration", type=float, default=120, help="Maximum seconds of the test")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for the random numbers of the fleet")
+    parser.add_argument("--presence", action="store_true", help="The puzzles publish their retained online status, so the base station initializes them without the handshake")
+    parser.add_argument("--broker", action="store_true", help="Use the MQTT broker instead of the loopback connection")
+    parser.add_argument("--fleet-only", action="store_true", help="Only run the virtual puzzles against the broker")
+    parser.add_argument("--json", type=Path, default=None, help="Write the results to this file")
+    parser.add_argument("--verbose", action="store_true", help="Show all log messages")
+    args = parser.parse_args()
+
+    if args.from_folder is not None:
+        puzzles = getAllPuzzlesFromFolder(args.from_folder.resolve())
+    else:
+        puzzles = createVirtualPuzzles(args.puzzles)
+
+    jsonPath = args.json.resolve() if args.json is not None else None
+    with tempfile.TemporaryDirectory() as workingDirectory:
+        os.chdir(workingDirectory)
+        initLogger(None, INFO if args.verbose else WARNING)
+
+        if args.fleet_only:
+            results = runFleetOnly(args, puzzles)
+        else:
+            results = runWithBaseStation(args, puzzles)
+        os.chdir(baseStationPath)
+
+    fleet = results["fleet"]
+    print()
+    print(f"Puzzles: {fleet['puzzles']}, initialized {fleet['initialized']}, finished {fleet['finished']} in {fleet['durationS']:.1f} s")
+    print(f"Fleet published {fleet['published']} messages ({fleet['publishedPerS']:.0f}/s) and received {fleet['received']}")
+    print(f"Injected: {fleet['droppedInitialize']} ignored initialize, {fleet['duplicated']} duplicates, {fleet['malformed']} malformed points")
+
+    if "baseStation" in results:
+        baseStation = results["baseStation"]
+        queue = baseStation["queue"]
+        print(f"Base station: {baseStation['completed']} completed, {baseStation['stateChanges']} state changes ({baseStation['stateChangesPerS']:.0f}/s)")
+        print(f"Queue: max depth {queue['maxDepth']}, dropped {queue['dropped']}, coalesced {queue['coalesced']}, pauses {queue['pauses']}")
+        print(f"Messages without state change: {fleet['withoutStateChange']}, state changes without message: {fleet['unexpectedStateChanges']}")
+        ui = baseStation["ui"]
+        print(f"UI updates: {ui['posted']} posted, {ui['coalesced']} coalesced, {ui['applied']} applied in {ui['frames']} frames (max {ui['maxFrameSize']} per frame)")
+        print()
+        print(f"{'Publish -> state change [ms]':<28} {'count':>8} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}")
+        for event, latencies in sorted(fleet["latencyMs"].items()):
+            print(formatLatencies(event, latencies))
+        print()
+        print(f"{'Base station telemetry [ms]':<28} {'count':>8} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}")
+        for kind, latencies in baseStation["telemetry"]["all"].items():
+            print(formatLatencies(kind, latencies))
+        print()
+        print(f"{'UI updates [ms]':<28} {'count':>8} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}")
+        print(formatLatencies("apply time per frame", ui["applyMs"]))
+        print(formatLatencies("post -> apply", ui["delayMs"]))
+    print()
+    print(f"{'Round trip [ms]':<28} {'count':>8} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}")
+    print(formatLatencies("finished -> finished_ack", fleet["finishAckRoundTripMs"]))
+
+    if jsonPath is not None:
+        with open(jsonPath, "w") as f:
+            json.dump(results, f, indent=4)
+
+    if fleet["finished"] < fleet["puzzles"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Benchmark for the cold start of the base station
+
+Starts main.py several times in a fresh interpreter with the Qt offscreen platform and reports
+    - the time from starting the process until the start screen is shown
+    - the import time of the modules (python -X importtime)
+    - which of the heavy modules were already loaded when the start screen was shown
+
+The UI loop is replaced by a function which processes the pending events once and returns, so the application
+leaves right after the first window is shown. The application runs in an empty temporary folder (only containing
+the puzzles), so the log and a journal of a previous game do not influence the result.
+
+Usage (from the BaseStation folder):
+    python Benchmarks/StartupBenchmark.py
+    python Benchmarks/StartupBenchmark.py --runs 10 --top 20 --json startup.json
+    python Benchmarks/StartupBenchmark.py --max-window-ms 1500 # Exit code 1 if the start is slower
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+baseStationPath = Path(__file__).resolve().parent.parent
+
+# Modules which must not be loaded before the start screen is shown
+heavyModules = ["paho", "matplotlib", "numpy", "Widgets.MainScreen", "Widgets.DebugScreen", "Widgets.FinishScreen"]
+
+childCode = """
+import sys
+import time
+from PySide6.QtWidgets import QApplication
+
+def exec(self):
+    self.processEvents()
+    print(f"FIRST_WINDOW {time.time()}", flush=True)
+    loaded = [m for m in HEAVY_MODULES if m in sys.modules]
+    print(f"LOADED {','.join(loaded)}", flush=True)
+    return 0
+
+QApplication.exec = exec # Replaces the UI loop, so the application leaves after the first window is shown
+sys.argv = ["main.py"]
+sys.path.insert(0, BASE_STATION_PATH)
+
+import runpy
+runpy.run_path(BASE_STATION_PATH + "/main.py", run_name="__main__")
+"""
+
+def runOnce():
+    """
+    Starts the application once and returns the time until the first window in ms,
+    the cumulative import times in us by module and the loaded heavy modules
+    """
+    env = dict(os.environ)
+    env["QT_QPA_PLATFORM"] = "offscreen"
+    code = childCode.replace("HEAVY_MODULES", repr(heavyModules)).replace("BASE_STATION_PATH", repr(str(baseStationPath)))
+
+    with tempfile.TemporaryDirectory() as workingDirectory:
+        Path(workingDirectory, "Puzzles").symlink_to(baseStationPath / "Puzzles")
+
+        startTime = time.time()
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=workingDirectory, env=env,
+                                capture_output=True, text=True, timeout=120)
+
+    firstWindow = None
+    loaded = []
+    for line in result.stdout.splitlines():
+        if line.startswith("FIRST_WINDOW "):
+            firstWindow = (float(line.split(" ", 1)[1]) - startTime) * 1000
+        elif line.startswith("LOADED "):
+            loaded = [m for m in line.split(" ", 1)[1].split(",") if m != ""]
+
+    if firstWindow is None:
+        print(result.stdout)
+        print(result.stderr)
+        raise Exception("The application did not show a window")
+
+    importTimes = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        selfTime, cumulative, name = line[len("import time:"):].split("|")
+        name = name.rstrip()[1:]
+        # Nested imports are indented, only the first level is reported
+        if name.startswith("  "):
+            continue
+        importTimes[name.strip()] = int(cumulative)
+
+    return firstWindow, importTimes, loaded
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start benchmark of the base station")
+    parser.add_argument("--runs", type=int, default=5, help="Number of application starts")
+    parser.add_argument("--top", type=int, default=15, help="Number of modules shown in the import report")
+    parser.add_argument("--json", type=Path, default=None, help="Write the results to this file")
+    parser.add_argument("--max-window-ms", type=float, default=None, help="Fail if the median time to the first window is larger")
+    args = parser.parse_args()
+
+    windowTimes = []
+    importTimes = {}
+    loadedModules = set()
+    for run in range(args.runs):
+        firstWindow, times, loaded = runOnce()
+        windowTimes.append(firstWindow)
+        loadedModules.update(loaded)
+        for name, cumulative in times.items():
+            importTimes.setdefault(name, []).append(cumulative)
+        print(f"Run {run + 1}/{args.runs}: first window after {firstWindow:.0f} ms")
+
+    medianImportTimes = {name: statistics.median(times) / 1000 for name, times in importTimes.items()}
+    medianWindow = statistics.median(windowTimes)
+
+    print()
+    print(f"Time to first window: median {medianWindow:.0f} ms, min {min(windowTimes):.0f} ms, max {max(windowTimes):.0f} ms")
+    print()
+    print(f"{'Module':<40} {'Import [ms]':>12}")
+    for name, ms in sorted(medianImportTimes.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"{name:<40} {ms:>12.1f}")
+    print()
+    if len(loadedModules) > 0:
+        print(f"Heavy modules loaded before the first window: {', '.join(sorted(loadedModules))}")
+    else:
+        print("No heavy modules loaded before the first window")
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump({
+                "runs": args.runs,
+                "timeToFirstWindowMs": windowTimes,
+                "medianTimeToFirstWindowMs": medianWindow,
+                "medianImportTimesMs": medianImportTimes,
+                "heavyModulesLoaded": sorted(loadedModules),
+            }, f, indent=4)
+
+    if len(loadedModules) > 0:
+        sys.exit(1)
+    if args.max_window_ms is not None and medianWindow > args.max_window_ms:
+        print(f"Median time to first window is above {args.max_window_ms:.0f} ms")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,13 @@
-import paho.mqtt.client as mqtt
-from .Log import log
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict
+
+from .Log import log, ERROR
+from .MessageQueue import MessageQueue, OverflowPolicy
+from .MqttConnection import MqttConnection, getSharedConnection
+from .NetworkTelemetry import NetworkTelemetry
 
 initializeMessage: str = "initialize"
 initializeMessageAck: str = "initialize_ack"
@@ -7,15 +15,58 @@ initializeMessageAck: str = "initialize_ack"
 finishMessage: str = "finished"
 finishMessageAck: str= "finished_ack"
 
+# Retained on the status topic of a puzzle, offline is the last will of the puzzle
+onlineMessage: str = "online"
+offlineMessage: str = "offline"
+
+# Replies by request, in both directions of the protocol
+requestReplies = {
+    initializeMessage: initializeMessageAck,
+    finishMessage: finishMessageAck,
+}
+
+@dataclass(frozen=True)
+class DeliveryPolicy():
+    """
+    QoS and retain flag used to publish a type of message
+    """
+    qos: int = 2
+    retain: bool = False
+
+# Delivery by message, all other messages like points are sent exactly once with defaultDeliveryPolicy
+deliveryPolicies: Dict[str, DeliveryPolicy] = {
+    # Repeated until the puzzle acknowledges, so a lost message only costs a retry instead of 3 extra packets
+    initializeMessage: DeliveryPolicy(qos=0),
+    initializeMessageAck: DeliveryPolicy(qos=0),
+    # Also repeated until acknowledged, but a lost message delays the game by a whole retry interval
+    finishMessage: DeliveryPolicy(qos=1),
+    finishMessageAck: DeliveryPolicy(qos=1),
+    # Retained, so a new subscriber learns the status of a puzzle without asking it
+    onlineMessage: DeliveryPolicy(qos=1, retain=True),
+    offlineMessage: DeliveryPolicy(qos=1, retain=True),
+}
+defaultDeliveryPolicy = DeliveryPolicy(qos=2)
+
 class CommunicationManager():
     """
     Class used for communication with the puzzles via MQTT
 
+    All managers of the process share one MqttConnection, so every additional manager costs no extra broker traffic.
+    Received messages matching the subscriptions of the manager are put into its bounded MessageQueue,
+    so a slow consumer never stalls the network.
+
     The functions:
         onConnect
         onDisconnect
-        onMessage 
-    will be called when the client connects/disconnects to the broker, or a message is received
+        onMessage
+    will be called when the client connects/disconnects to the broker, or a message is received.
+    onMessage is called one message after another on a separate callback thread of the manager.
+
+    Every sent and received message is timestamped, so the round trip latencies of the requests like
+    initialize -> initialize_ack and the message rates can be read with getTelemetry().
+
+    The QoS and the retain flag of a published message are looked up in deliveryPolicies by the message,
+    which can be replaced for a single manager.
 
     Usage:
         com: CommunicationManager = CommunicationManager()
@@ -26,23 +77,35 @@ class CommunicationManager():
         com.start()
         ...
         com.stop()
+
+    Usage within a running asyncio event loop:
+        com: CommunicationManager = CommunicationManager()
+        await com.startAsync()
+        com.subscribe("topic/#")
+        async for topic, msg in com.messages():
+            ...
     """
 
-    # Parameter which must be set only once
-    mqttBroker: str | None = None
-    mqttPort: int | None = None
-    mqttUser: str | None = None
-    mqttPw: str | None = None
+    # Default size and overflow policy of the queue for received messages
+    queueSize: int = 1000
+    overflowPolicy: OverflowPolicy = OverflowPolicy.BLOCK
+
+    def __init__(self, queueSize: int | None = None, overflowPolicy: OverflowPolicy | None = None, coalesceTopics=None, connection: MqttConnection | None = None):
+        self.connection: MqttConnection = connection if connection is not None else getSharedConnection()
+
+        self.messageQueue = MessageQueue(
+            queueSize if queueSize is not None else self.queueSize,
+            overflowPolicy if overflowPolicy is not None else self.overflowPolicy,
+            coalesceTopics)
+        self.messageQueue.onFull = lambda: self.connection.pauseReading(self)
+        self.messageQueue.onSpace = lambda: self.connection.resumeReading(self)
 
-    def __init__(self):
-        self.mqttc = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2, protocol=mqtt.MQTTProtocolVersion.MQTTv5)
-        
-        if self.mqttUser is not None and self.mqttUser != "":
-            self.mqttc.username_pw_set(self.mqttUser, self.mqttPw)
+        self.telemetry = NetworkTelemetry(requestReplies)
+        self.deliveryPolicies: Dict[str, DeliveryPolicy] = deliveryPolicies
+        self.defaultDeliveryPolicy: DeliveryPolicy = defaultDeliveryPolicy
 
-        self.mqttc.on_connect = self._onConnect
-        self.mqttc.on_disconnect = self._onDisconnect
-        self.mqttc.on_message = self._onMessage
+        self.dispatchTask: asyncio.Task | None = None
+        self.callbackExecutor: ThreadPoolExecutor | None = None
 
         # Callback functionss
         self.onConnect = None
@@ -51,58 +114,114 @@ class CommunicationManager():
 
     def start(self):
         """
-        Starts the connection to the broker
+        Starts the connection to the broker, if it is not established yet
         """
-        try:
-            returnCode = self.mqttc.connect(self.mqttBroker, self.mqttPort, 60)
-        except Exception as ex:
-            log(f"Exception occured: {ex}")
-            log(f"Could not connect to {self.mqttBroker} @ {self.mqttPort}")
-            exit(1)
+        self.connection.start()
+        self.connection.addSubscriber(self)
+        self.connection.callInLoop(self._startDispatcher)
 
-        if returnCode != 0:
-            log("No connection established")
-            exit(1)
+    async def startAsync(self):
+        """
+        Starts the connection to the broker on the running event loop, if it is not established yet
+        """
+        await self.connection.startAsync()
+        self.connection.addSubscriber(self)
+        self._startDispatcher()
 
-        log(f"Connection established to {self.mqttBroker} @ {self.mqttPort}")
-        self.mqttc.loop_start()
-    
     def stop(self):
         """
-        Stops the connection to the broker
+        Removes the subscriptions of this manager and stops the connection to the broker if no other manager uses it
         """
-        self.mqttc.loop_stop()
+        self.connection.removeSubscriber(self)
+        self.connection.callInLoop(self._shutdown)
+        self.connection.stop()
+
+    def messages(self):
+        """
+        Returns the queue of received messages, which can be used with async for in the event loop of the connection
+        """
+        return self.messageQueue
+
+    def getStatistics(self):
+        """
+        Returns a dictionary with the depth and the counters of the queue for received messages
+        """
+        return self.messageQueue.getStatistics()
+
+    def getTelemetry(self):
+        """
+        Returns a dictionary with the message rates and the latencies in ms of the last minute by topic
+        """
+        return self.telemetry.getSnapshot()
+
+    def exportTelemetry(self, path: Path):
+        """
+        Writes the telemetry including the latency histograms since the start to a JSON file
+        """
+        self.telemetry.export(path)
 
     def publish(self, topic, message):
         """
-        Publish a message at topic
+        Publish a message at topic, with the QoS and retain flag of its delivery policy
         """
-        self.mqttc.publish(topic, message, qos=2)
-    
+        payload = str(message)
+        policy = self.deliveryPolicies.get(payload, self.defaultDeliveryPolicy)
+        self.telemetry.sent(topic, payload)
+        self.connection.publish(topic, message, qos=policy.qos, retain=policy.retain)
+
     def subscribe(self, topic):
         """
         Subscribe to a topic
         """
-        self.mqttc.subscribe(topic)
+        self.connection.subscribe(topic, self)
 
-    def _onConnect(self, client, userdata, flags, reason_code, properties):
+    def deliver(self, topic: str, payload: str):
         """
-        Internal function which calles self.onConnect()
+        Called by the connection in its event loop for every received message matching the subscriptions
         """
-        # Subscribing in on_connect() means that if we lose the connection and
-        # reconnect then subscriptions will be renewed.
-        self.onConnect(reason_code)
-    
-    def _onDisconnect(self, client, userdata, disconnect_flags, reason_code, properties):
+        self.telemetry.received(topic, payload)
+        self.messageQueue.put(topic, payload)
+
+    def connected(self, code):
         """
-        Internal function which calles self.onDisconnect()
+        Called by the connection in its event loop when the connection is established
         """
-        self.mqttc.reconnect()
-        self.onDisconnect(reason_code)
+        if self.onConnect is not None:
+            self.onConnect(code)
 
-    def _onMessage(self, client, userdata, msg):
+    def disconnected(self, code):
+        """
+        Called by the connection in its event loop when the connection is lost
+        """
+        if self.onDisconnect is not None:
+            self.onDisconnect(code)
+
+    def _startDispatcher(self):
+        """
+        Internal function which forwards the queued messages to self.onMessage() if a callback is set
+        """
+        if self.onMessage is None:
+            return
+        self.callbackExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="CommunicationManagerCallback")
+        self.dispatchTask = asyncio.get_running_loop().create_task(self._dispatch())
+
+    async def _dispatch(self):
+        """
+        Internal coroutine which calls self.onMessage() for every queued message on the callback thread
+        """
+        loop = asyncio.get_running_loop()
+        async for topic, payload in self.messageQueue:
+            try:
+                await loop.run_in_executor(self.callbackExecutor, self.onMessage, topic, payload)
+            except Exception as ex:
+                log(f"Exception in message callback for {topic}: {ex}", ERROR)
+
+    def _shutdown(self):
         """
-        Internal function which calles self.onMessage()
+        Internal function which stops forwarding messages, must be called in the event loop
         """
-        self.onMessage(msg.topic, msg.payload.decode("utf-8"))
-    
+        self.messageQueue.close()
+        if self.dispatchTask is not None:
+            self.dispatchTask.cancel()
+        if self.callbackExecutor is not None:
+            self.callbackExecutor.shutdown(wait=False)
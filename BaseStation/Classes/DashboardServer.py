@@ -0,0 +1,407 @@
+import json
+import threading
+import time
+from collections import deque
+from dataclasses import asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+from .GameEngine import GameSnapshot
+from .Log import log, DEBUG
+from .Puzzle import Puzzle
+
+"""
+Web dashboard of a GameSession, which only needs the Python standard library
+
+Endpoints:
+    GET  /          the dashboard page
+    GET  /state     the current state as JSON
+    GET  /events    Server-Sent Events, first a "snapshot" event with the whole state,
+                    then "delta" events with the changed values and the events of the game
+    POST /hint      buys the next hint of the puzzle in the JSON body {"puzzle": name}
+
+The changes of the game are collected by the DashboardHub and published at most publishRate times per second.
+Every message is serialized once and the same bytes are written to every viewer, so additional viewers
+only cost the write to their socket.
+
+Usage:
+    hub = DashboardHub(puzzles, session.getSnapshot())
+    session.addListener(hub.update)
+    server = DashboardServer(hub, session, "0.0.0.0", 8080)
+    server.start()
+    ...
+    server.stop()
+"""
+
+class DashboardHub():
+    """
+    Class which turns the changes of the game into Server-Sent Events messages for all viewers
+    """
+
+    publishRate: float = 10 # Maximum number of messages per second
+    historySize: int = 100 # Messages kept for viewers which are behind, older viewers get the whole state again
+    maxEvents: int = 100 # Events per message, further events are only counted
+    keepAliveInterval: float = 15 # Seconds after which a comment is sent to a viewer without messages
+
+    def __init__(self, puzzles: List[Puzzle], snapshot: GameSnapshot):
+        self.puzzleInfo = {p.name: {"hintCount": len(p.hints), "hintPoints": [h.points for h in p.hints]} for p in puzzles}
+
+        # Written by the engine thread
+        self.lock = threading.Lock()
+        self.latest: GameSnapshot = snapshot
+        self.pendingEvents = []
+        self.droppedEvents: int = 0
+        self.changed = threading.Event()
+
+        # Written by the publisher thread
+        self.condition = threading.Condition()
+        self.published: GameSnapshot = snapshot
+        self.seq: int = 0
+        self.history = deque(maxlen=self.historySize) # Tuples of (seq, message)
+        self.running: bool = False
+        self.thread: threading.Thread | None = None
+
+        # Statistics
+        self.viewers: int = 0
+        self.messages: int = 0
+        self.sentBytes: int = 0
+
+    def update(self, snapshot: GameSnapshot, events):
+        """
+        Registers a change of the game, can be used as listener of the GameSession
+        """
+        with self.lock:
+            self.latest = snapshot
+            for event, data in events:
+                if event == "timer":
+                    continue # The remaining time is part of the state
+                if len(self.pendingEvents) < self.maxEvents:
+                    self.pendingEvents.append([time.time(), event, data])
+                else:
+                    self.droppedEvents += 1
+        self.changed.set()
+
+    def start(self):
+        with self.condition:
+            self.running = True
+        self.thread = threading.Thread(target=self._run, name="DashboardHub", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops publishing and ends the streams of all viewers
+        """
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.changed.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def getState(self):
+        """
+        Returns the last published state as dictionary
+        """
+        with self.condition:
+            return self._getState(self.published)
+
+    def getSnapshotMessage(self):
+        """
+        Returns the sequence number and the message with the whole state for a new viewer
+        """
+        with self.condition:
+            return self.seq, self._encode("snapshot", self._getState(self.published), self.seq)
+
+    def waitForMessages(self, lastSeq: int, timeout: float):
+        """
+        Waits until there are messages after lastSeq and returns the new sequence number and the messages,
+        or None if the hub was stopped
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.seq > lastSeq or not self.running, timeout)
+            if not self.running:
+                return None
+            if self.seq == lastSeq:
+                return lastSeq, []
+            if len(self.history) == 0 or self.history[0][0] > lastSeq + 1:
+                # Too far behind, the viewer gets the whole state again
+                return self.seq, [self._encode("snapshot", self._getState(self.published), self.seq)]
+            return self.seq, [message for seq, message in self.history if seq > lastSeq]
+
+    def addSent(self, byteCount: int):
+        with self.condition:
+            self.sentBytes += byteCount
+
+    def setViewers(self, change: int):
+        with self.condition:
+            self.viewers += change
+
+    def getStatistics(self):
+        """
+        Returns a dictionary with the number of viewers, published messages and sent bytes
+        """
+        with self.condition:
+            return {"viewers": self.viewers, "messages": self.messages, "sentBytes": self.sentBytes, "droppedEvents": self.droppedEvents}
+
+    def _run(self):
+        """
+        Internal function of the publisher thread
+        """
+        interval = 1 / self.publishRate
+        while True:
+            self.changed.wait()
+            with self.condition:
+                if not self.running:
+                    return
+
+            with self.lock:
+                self.changed.clear()
+                snapshot = self.latest
+                events = self.pendingEvents
+                self.pendingEvents = []
+                dropped = self.droppedEvents
+
+            delta = self._getDelta(self.published, snapshot)
+            delta["events"] = events
+            delta["droppedEvents"] = dropped
+
+            with self.condition:
+                self.seq += 1
+                self.published = snapshot
+                self.history.append((self.seq, self._encode("delta", delta, self.seq)))
+                self.messages += 1
+                self.condition.notify_all()
+
+            time.sleep(interval)
+
+    def _getState(self, snapshot: GameSnapshot):
+        """
+        Internal function which returns the whole state of the snapshot as dictionary
+        """
+        state = asdict(snapshot)
+        state["puzzles"] = {p["name"]: {**p, **self.puzzleInfo[p["name"]]} for p in state["puzzles"]}
+        state["order"] = [p.name for p in snapshot.puzzles]
+        return state
+
+    def _getDelta(self, old: GameSnapshot, new: GameSnapshot):
+        """
+        Internal function which returns the values which changed between the snapshots
+        """
+        changes = {}
+        for key in ["points", "secondsLeft", "initializedCount", "completedCount", "allInitialized", "isFinished"]:
+            if getattr(old, key) != getattr(new, key):
+                changes[key] = getattr(new, key)
+
+        puzzles = {}
+        if old.puzzles is not new.puzzles:
+            for oldPuzzle, newPuzzle in zip(old.puzzles, new.puzzles):
+                if oldPuzzle != newPuzzle:
+                    puzzles[newPuzzle.name] = {**asdict(newPuzzle), **self.puzzleInfo[newPuzzle.name]}
+        return {"changes": changes, "puzzles": puzzles}
+
+    def _encode(self, event: str, data: dict, seq: int):
+        """
+        Internal function which returns the bytes of a Server-Sent Events message
+        """
+        return f"id: {seq}\nevent: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode()
+
+class DashboardRequestHandler(BaseHTTPRequestHandler):
+    """
+    Handler of the requests of the DashboardServer, every request is handled on its own thread
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        dashboard: DashboardServer = self.server.dashboard
+        if self.path == "/":
+            self._send(200, "text/html; charset=utf-8", dashboardPage.encode())
+        elif self.path == "/state":
+            self._send(200, "application/json", json.dumps(dashboard.hub.getState()).encode())
+        elif self.path == "/events":
+            self._stream(dashboard.hub)
+        else:
+            self._send(404, "text/plain", b"Not found")
+
+    def do_POST(self):
+        dashboard: DashboardServer = self.server.dashboard
+        if self.path != "/hint":
+            self._send(404, "text/plain", b"Not found")
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            puzzleName = json.loads(self.rfile.read(length))["puzzle"]
+        except (ValueError, KeyError, TypeError):
+            self._send(400, "text/plain", b"Expected {\"puzzle\": name}")
+            return
+
+        bought = dashboard.session.buyHint(puzzleName).result()
+        log(f"Dashboard {'bought' if bought else 'could not buy'} a hint for '{puzzleName}'")
+        self._send(200, "application/json", json.dumps({"bought": bought}).encode())
+
+    def log_message(self, format, *args):
+        log(f"Dashboard {self.address_string()}: {format % args}", DEBUG)
+
+    def _send(self, status: int, contentType: str, body: bytes):
+        """
+        Internal function which sends a complete response
+        """
+        self.send_response(status)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self, hub: DashboardHub):
+        """
+        Internal function which sends the Server-Sent Events until the viewer disconnects or the hub is stopped
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        hub.setViewers(1)
+        try:
+            seq, message = hub.getSnapshotMessage()
+            self.wfile.write(message)
+            self.wfile.flush()
+            while True:
+                result = hub.waitForMessages(seq, hub.keepAliveInterval)
+                if result is None:
+                    return
+                seq, messages = result
+                data = b"".join(messages) if len(messages) > 0 else b": keep alive\n\n"
+                self.wfile.write(data)
+                self.wfile.flush()
+                hub.addSent(len(data))
+        except (BrokenPipeError, ConnectionResetError):
+            pass # The viewer closed the page
+        finally:
+            hub.setViewers(-1)
+
+class DashboardServer():
+    """
+    Class which serves the dashboard of a GameSession on a background thread
+    """
+    def __init__(self, hub: DashboardHub, session, host: str = "0.0.0.0", port: int = 8080):
+        self.hub = hub
+        self.session = session
+        self.server = ThreadingHTTPServer((host, port), DashboardRequestHandler)
+        self.server.daemon_threads = True
+        self.server.dashboard = self
+        self.thread: threading.Thread | None = None
+
+    def getAddress(self):
+        """
+        Returns the host and the port the server listens on
+        """
+        return self.server.server_address[:2]
+
+    def start(self):
+        self.hub.start()
+        self.thread = threading.Thread(target=self.server.serve_forever, name="DashboardServer", daemon=True)
+        self.thread.start()
+        host, port = self.getAddress()
+        log(f"Dashboard running on http://{host}:{port}/")
+
+    def stop(self):
+        self.hub.stop()
+        self.server.shutdown()
+        self.server.server_close()
+        if self.thread is not None:
+            self.thread.join()
+
+dashboardPage = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>The escape game</title>
+<style>
+    body { font-family: sans-serif; margin: 2em; }
+    .big { font-size: 3em; }
+    table { border-collapse: collapse; margin-top: 1em; }
+    td, th { padding: 0.3em 1em; text-align: left; border-bottom: 1px solid #ccc; }
+    #status { color: #888; }
+    #events { max-height: 20em; overflow-y: auto; }
+</style>
+</head>
+<body>
+<h1>The escape game</h1>
+<div id="status">Connecting ...</div>
+<div class="big"><span id="time"></span> &middot; <span id="points"></span> points</div>
+<table>
+    <thead><tr><th>Puzzle</th><th>State</th><th>Hints</th><th></th></tr></thead>
+    <tbody id="puzzles"></tbody>
+</table>
+<h2>Events</h2>
+<ul id="events"></ul>
+<script>
+let state = null;
+const source = new EventSource("events");
+source.addEventListener("snapshot", e => { state = JSON.parse(e.data); render(); });
+source.addEventListener("delta", e => {
+    const delta = JSON.parse(e.data);
+    Object.assign(state, delta.changes);
+    Object.assign(state.puzzles, delta.puzzles);
+    for (const [t, event, data] of delta.events) addEvent(t, event, data);
+    render();
+});
+source.onopen = () => { document.getElementById("status").textContent = "Connected"; };
+source.onerror = () => { document.getElementById("status").textContent = "Disconnected, reconnecting ..."; };
+
+function formatTime(seconds) {
+    seconds = Math.max(0, seconds);
+    const pad = v => String(v).padStart(2, "0");
+    return `${pad(Math.floor(seconds / 3600))}:${pad(Math.floor(seconds / 60) % 60)}:${pad(seconds % 60)}`;
+}
+
+function addEvent(t, event, data) {
+    if (event === "points" && !data.puzzle) return;
+    const item = document.createElement("li");
+    const details = Object.entries(data).map(([k, v]) => `${k}: ${v}`).join(", ");
+    item.textContent = `${new Date(t * 1000).toLocaleTimeString()} ${event} ${details}`;
+    const list = document.getElementById("events");
+    list.insertBefore(item, list.firstChild);
+    while (list.children.length > 200) list.removeChild(list.lastChild);
+}
+
+function buyHint(name) {
+    fetch("hint", { method: "POST", body: JSON.stringify({ puzzle: name }) })
+        .then(r => r.json())
+        .then(r => { if (!r.bought) alert("Not enough points"); });
+}
+
+function render() {
+    document.getElementById("time").textContent = formatTime(state.secondsLeft);
+    document.getElementById("points").textContent = state.points;
+    document.getElementById("status").textContent = state.isFinished ? "Game finished" :
+        (state.allInitialized ? "Running" : `Initializing ${state.initializedCount} / ${state.order.length}`);
+
+    const rows = state.order.map(name => {
+        const p = state.puzzles[name];
+        const row = document.createElement("tr");
+        const stateText = p.isCompleted ? "Completed" : (p.isInitialized ? "Initialized" : "Waiting");
+        for (const text of [name, stateText, `${p.hintsUsed} / ${p.hintCount}`]) {
+            const cell = document.createElement("td");
+            cell.textContent = text;
+            row.appendChild(cell);
+        }
+        const cell = document.createElement("td");
+        if (p.hintsUsed < p.hintCount && !p.isCompleted && !state.isFinished) {
+            const button = document.createElement("button");
+            button.textContent = `Buy hint (${p.hintPoints[p.hintsUsed]} points)`;
+            button.onclick = () => buyHint(name);
+            cell.appendChild(button);
+        }
+        row.appendChild(cell);
+        return row;
+    });
+    document.getElementById("puzzles").replaceChildren(...rows);
+}
+</script>
+</body>
+</html>
+"""
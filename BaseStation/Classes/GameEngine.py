@@ -0,0 +1,337 @@
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass, replace
+from queue import SimpleQueue
+from typing import List, Tuple
+
+from .Log import log, ERROR
+from .Puzzle import Puzzle
+
+"""
+Rules of the game, independent of the UI
+
+The state of a game is only changed by the thread of the GameEngine, which executes the commands one after another
+in the order they were submitted. Commands can be submitted from any thread, e.g. the network callbacks
+and the GUI, without locks. After every command the engine publishes a new immutable GameSnapshot,
+so readers always see a consistent state.
+
+Every state transition is an event, which is recorded in the journal (see Journal.py for the events and their data)
+and passed to onChange together with the new snapshot.
+
+Usage:
+    engine = GameEngine(puzzles, 3600, 100, journal)
+    engine.onChange = lambda snapshot, events: print(snapshot.points, events)
+    engine.start()
+
+    engine.initialize("Tilt Maze") # Returns a Future with true if the state changed
+    engine.buyHint("Tilt Maze").result() # True if the hint was bought
+    engine.getSnapshot().points
+    ...
+    engine.stop()
+"""
+
+timerCheckpointInterval = 5 # Seconds between two records of the remaining time in the journal
+
+@dataclass(frozen=True)
+class PuzzleState():
+    """
+    State of a single puzzle within a GameSnapshot
+    """
+    name: str
+    isInitialized: bool = False
+    isCompleted: bool = False
+    hintsUsed: int = 0
+
+@dataclass(frozen=True)
+class GameSnapshot():
+    """
+    Immutable state of the game after a command of the GameEngine
+    """
+    version: int
+    points: int
+    secondsLeft: int
+    puzzles: Tuple[PuzzleState, ...]
+    initializedCount: int = 0
+    completedCount: int = 0
+    allInitialized: bool = False
+    isFinished: bool = False
+
+    def getPuzzle(self, name: str):
+        """
+        Returns the PuzzleState of the puzzle with the name, or None
+        """
+        for puzzle in self.puzzles:
+            if puzzle.name == name:
+                return puzzle
+        return None
+
+class GameEngine():
+    """
+    Class which owns the state of a game and is its only writer
+
+    The flags of the Puzzle and Hint objects (isInitialized, isCompleted, isUsed, nextHint) are only changed
+    by the engine thread as well, so the widgets can still read them.
+    onChange is called on the engine thread with the new snapshot and the list of (event, data) after every command
+    which changed the state, it must not wait for the GUI thread.
+    """
+    def __init__(self, puzzles: List[Puzzle], seconds: int, points: int, journal=None, resumeState=None):
+        """
+        Pass a Journal to record the events and the state replayed from the journal to resume a game
+        """
+        self.puzzles = puzzles
+        self.puzzlesByName = {p.name: p for p in puzzles}
+        self.indexByName = {p.name: i for i, p in enumerate(puzzles)}
+        self.journal = journal
+        self.resumeState = resumeState
+
+        if resumeState is not None:
+            resumeState.applyToPuzzles(puzzles)
+            seconds = resumeState.secondsLeft
+            points = resumeState.points
+
+        states = tuple(PuzzleState(p.name, p.isInitialized, p.isCompleted, p.nextHint - 1) for p in puzzles)
+        self.snapshot = GameSnapshot(
+            version=0,
+            points=points,
+            secondsLeft=seconds,
+            puzzles=states,
+            initializedCount=sum([1 for s in states if s.isInitialized]),
+            completedCount=sum([1 for s in states if s.isCompleted]),
+            allInitialized=resumeState is not None and resumeState.allInitialized)
+
+        self.onChange = None # Callback function called with the snapshot and the events after every change
+
+        self.commands = SimpleQueue() # Tuples of (function, args, future), None stops the engine
+        self.thread: threading.Thread | None = None
+        self.stopped: bool = False
+        self.events: List[tuple] = [] # Events of the running command
+
+    def start(self):
+        """
+        Starts the engine thread, a new game records its start first
+        """
+        if self.thread is not None:
+            return
+        if self.resumeState is None:
+            self._submit(self._begin)
+        self.thread = threading.Thread(target=self._run, name="GameEngine", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Executes the commands submitted so far and stops the engine thread
+        """
+        if self.thread is None:
+            return
+        self.stopped = True
+        self.commands.put(None)
+        if self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+
+        # Commands submitted while stopping are not executed
+        while not self.commands.empty():
+            command = self.commands.get()
+            if command is not None:
+                command[2].set_result(False)
+
+    def getSnapshot(self):
+        """
+        Returns the current GameSnapshot, can be called from any thread
+        """
+        return self.snapshot
+
+    def initialize(self, puzzleName: str):
+        """
+        The puzzle acknowledged the initialization
+        """
+        return self._submit(self._initialize, puzzleName)
+
+    def complete(self, puzzleName: str):
+        """
+        The puzzle was finished, the puzzle points are added if every puzzle is initialized
+        """
+        return self._submit(self._complete, puzzleName)
+
+    def subtractPoints(self, puzzleName: str, points: int):
+        """
+        The puzzle sent points which are subtracted, e.g. for a wrong answer
+        """
+        return self._submit(self._subtractPoints, puzzleName, points)
+
+    def buyHint(self, puzzleName: str):
+        """
+        Buys the next hint of the puzzle if there are enough points, the Future is true if the hint was bought
+        """
+        return self._submit(self._buyHint, puzzleName)
+
+    def tick(self):
+        """
+        One second of the game time has passed, the game ends when the time is up
+        """
+        return self._submit(self._tick)
+
+    def _submit(self, function, *args):
+        """
+        Internal function which queues a command and returns a Future with its result
+        """
+        future = Future()
+        if self.stopped:
+            future.set_result(False)
+        else:
+            self.commands.put((function, args, future))
+        return future
+
+    def _run(self):
+        """
+        Internal function of the engine thread
+        """
+        while True:
+            command = self.commands.get()
+            if command is None:
+                return
+
+            function, args, future = command
+            self.events = []
+            try:
+                result = function(*args)
+            except Exception as ex:
+                log(f"Exception in game command {function.__name__}{args}: {ex}", ERROR)
+                future.set_exception(ex)
+                continue
+
+            if len(self.events) > 0 or result:
+                self._publish()
+            future.set_result(result)
+
+    def _publish(self):
+        """
+        Internal function which records the events of the command and passes them to onChange
+        """
+        events = self.events
+        if self.journal is not None:
+            for event, data in events:
+                self.journal.record(event, **data)
+        if self.onChange is not None:
+            try:
+                self.onChange(self.snapshot, events)
+            except Exception as ex:
+                log(f"Exception in game change callback: {ex}", ERROR)
+
+    def _emit(self, event: str, **data):
+        """
+        Internal function which adds an event of the running command
+        """
+        self.events.append((event, data))
+
+    def _update(self, **changes):
+        """
+        Internal function which replaces the snapshot with a changed copy
+        """
+        self.snapshot = replace(self.snapshot, version=self.snapshot.version + 1, **changes)
+
+    def _updatePuzzle(self, state: PuzzleState, **changes):
+        """
+        Internal function which returns the puzzles of the snapshot with a changed state of one puzzle
+        """
+        puzzles = list(self.snapshot.puzzles)
+        puzzles[self.indexByName[state.name]] = replace(state, **changes)
+        return tuple(puzzles)
+
+    def _setPoints(self, points: int, label: str | None, puzzleName: str | None = None):
+        """
+        Internal function which changes the points
+        """
+        self._update(points=points)
+        if puzzleName is not None:
+            self._emit("points", points=points, label=label, puzzle=puzzleName)
+        else:
+            self._emit("points", points=points, label=label)
+
+    def _finish(self):
+        """
+        Internal function which ends the game
+        """
+        self._update(isFinished=True)
+        self._emit("finished")
+
+    def _begin(self):
+        s = self.snapshot
+        self._emit("start", puzzles=[p.name for p in s.puzzles], seconds=s.secondsLeft, points=s.points)
+        self._setPoints(s.points, "Start")
+        return True
+
+    def _initialize(self, puzzleName: str):
+        s = self.snapshot
+        state = s.getPuzzle(puzzleName)
+        if s.isFinished or state is None or state.isCompleted or state.isInitialized:
+            return False
+
+        self.puzzlesByName[puzzleName].isInitialized = True
+        initializedCount = s.initializedCount + 1
+        self._update(puzzles=self._updatePuzzle(state, isInitialized=True), initializedCount=initializedCount)
+        self._emit("initialized", puzzle=puzzleName)
+
+        if not s.allInitialized and initializedCount == len(s.puzzles):
+            self._update(allInitialized=True)
+            self._emit("allInitialized")
+        return True
+
+    def _complete(self, puzzleName: str):
+        s = self.snapshot
+        state = s.getPuzzle(puzzleName)
+        if s.isFinished or state is None or state.isCompleted or not s.allInitialized:
+            return False
+
+        puzzle = self.puzzlesByName[puzzleName]
+        puzzle.isCompleted = True
+        completedCount = s.completedCount + 1
+        self._update(puzzles=self._updatePuzzle(state, isCompleted=True), completedCount=completedCount)
+        self._emit("completed", puzzle=puzzleName)
+        self._setPoints(s.points + puzzle.points, puzzleName)
+
+        if completedCount == len(s.puzzles):
+            self._finish()
+        return True
+
+    def _subtractPoints(self, puzzleName: str, points: int):
+        s = self.snapshot
+        state = s.getPuzzle(puzzleName)
+        if s.isFinished or state is None or state.isCompleted or not state.isInitialized:
+            return False
+
+        self._setPoints(s.points - points, None, puzzleName)
+        return True
+
+    def _buyHint(self, puzzleName: str):
+        s = self.snapshot
+        state = s.getPuzzle(puzzleName)
+        if s.isFinished or state is None:
+            return False
+
+        puzzle = self.puzzlesByName[puzzleName]
+        if state.hintsUsed >= len(puzzle.hints):
+            return False
+        hint = puzzle.hints[state.hintsUsed]
+        if s.points - hint.points < 0:
+            return False
+
+        hint.isUsed = True
+        puzzle.nextHint = state.hintsUsed + 2
+        self._update(puzzles=self._updatePuzzle(state, hintsUsed=state.hintsUsed + 1))
+        self._emit("hint", puzzle=puzzleName, hint=state.hintsUsed)
+        self._setPoints(s.points - hint.points, f"Hint used\n{puzzleName}")
+        return True
+
+    def _tick(self):
+        s = self.snapshot
+        if s.isFinished:
+            return False
+
+        secondsLeft = s.secondsLeft - 1
+        self._update(secondsLeft=secondsLeft)
+        if secondsLeft % timerCheckpointInterval == 0:
+            self._emit("timer", seconds=secondsLeft)
+        if secondsLeft < 0:
+            self._finish()
+        return True
@@ -0,0 +1,308 @@
+import threading
+import time
+from pathlib import Path
+from typing import List
+
+from .CommunicationManager import CommunicationManager, initializeMessageAck, finishMessage, finishMessageAck, onlineMessage, offlineMessage
+from .GameEngine import GameEngine, GameSnapshot
+from .InitializeHandshake import InitializeHandshake
+from .Journal import Journal, JournalState, defaultJournalPath
+from .Log import log, WARNING, ERROR
+from .PresenceTracker import PresenceTracker
+from .Puzzle import Puzzle
+
+"""
+A game without any UI
+
+The GameSession connects the GameEngine with the puzzles: it turns the MQTT messages of the puzzles into commands,
+initializes the puzzles, answers the finished messages, records the journal and counts down the game time.
+Puzzles which are already online by their retained status are initialized right away, without waiting for the
+round trip of the initialize handshake, and puzzles which come back online during the game are initialized again.
+It does not import Qt, so it is used by the MainScreen as well as by the headless mode (headless.py).
+
+Usage:
+    session = GameSession(puzzles)
+    session.addListener(lambda snapshot, events: print(snapshot.points))
+    session.start()
+    ...
+    session.buyHint("Tilt Maze").result()
+    ...
+    session.stop()
+"""
+
+gameTime = 60*60
+startPoints = 100
+
+class GameSession():
+    """
+    Class which runs a game with the selected puzzles
+    """
+    def __init__(self, puzzles: List[Puzzle], resumeState: JournalState | None = None, journalPath: Path = defaultJournalPath,
+                 seconds: int = gameTime, points: int = startPoints, presence: PresenceTracker | None = None):
+        """
+        Pass the state replayed from the journal to resume a game,
+        and the PresenceTracker of the start screen to continue with the presence it already knows
+        """
+        self.puzzles = puzzles
+        self.puzzlesByName = {p.name: p for p in puzzles}
+
+        # Every state transition is recorded by the engine, so the game can be resumed after a crash
+        self.journal = Journal(journalPath, append=resumeState is not None)
+        self.engine = GameEngine(puzzles, seconds, points, self.journal, resumeState)
+        self.engine.onChange = self._onChange
+
+        self.listeners = [] # Functions called with the snapshot and the events after every change, on the engine thread
+
+        self.communicationManager: CommunicationManager = CommunicationManager()
+        self.communicationManager.onConnect = self.onConnect
+        self.communicationManager.onDisconnect = self.onDisconnect
+        self.communicationManager.onMessage = self.onMessage
+
+        self.initializeHandshake: InitializeHandshake = InitializeHandshake(self.communicationManager.publish, self.puzzles)
+
+        self.presence: PresenceTracker = presence if presence is not None else PresenceTracker(puzzles)
+        self.presence.setPuzzles(puzzles)
+        self.presence.addListener(self._onPresenceChange)
+        self.offlinePuzzles = set() # Names of the puzzles which went offline during the game
+
+        self.topicHandlers = {} # Maps a topic to the handler function and the corresponding puzzle
+        for puzzle in self.puzzles:
+            self.topicHandlers[puzzle.mqttTopicGeneral] = (self.onGeneralMessage, puzzle)
+            self.topicHandlers[puzzle.mqttTopicPoints] = (self.onPointsMessage, puzzle)
+            self.topicHandlers[puzzle.mqttTopicStatus] = (self.onStatusMessage, puzzle)
+
+        self.timerCondition = threading.Condition()
+        self.timerThread: threading.Thread | None = None
+        self.timerRunning: bool = False
+        self.finished = threading.Event()
+        self.stopped: bool = False
+
+    def addListener(self, listener):
+        """
+        Adds a function which is called with the snapshot and the events after every change of the game,
+        it is called on the thread of the engine and must not block
+        """
+        self.listeners.append(listener)
+
+    def removeListener(self, listener):
+        self.listeners.remove(listener)
+
+    def getSnapshot(self):
+        """
+        Returns the current GameSnapshot
+        """
+        return self.engine.getSnapshot()
+
+    def getPresence(self):
+        """
+        Returns the presence of every puzzle by puzzle name, see PresenceTracker.getPresence()
+        """
+        return self.presence.getAll()
+
+    def buyHint(self, puzzleName: str):
+        """
+        Buys the next hint of the puzzle, returns a Future which is true if there were enough points
+        """
+        return self.engine.buyHint(puzzleName)
+
+    def start(self):
+        """
+        Connects to the broker and starts the game, or the initialization of the puzzles if not every puzzle is initialized
+        """
+        self.communicationManager.start()
+        self.engine.start()
+        self.presence.start(subscribe=False)
+
+        # Also started for a resumed game, so puzzles which restart during the game are initialized again
+        self.initializeHandshake.start()
+        if self.engine.getSnapshot().allInitialized:
+            self.startTimer()
+
+        # The status of the puzzles which the PresenceTracker of the start screen already knows is not sent again
+        for puzzle in self.puzzles:
+            if self.presence.isOnline(puzzle.name):
+                self._onPresenceChange(puzzle.name, self.presence.getPresence(puzzle.name))
+
+    def stop(self):
+        """
+        Stops the game, the communication and the journal
+        """
+        if self.stopped:
+            return
+        self.stopped = True
+        self.stopTimer()
+        self.initializeHandshake.stop()
+        self.presence.removeListener(self._onPresenceChange)
+        self.presence.stop()
+        self.communicationManager.stop()
+        self.engine.stop()
+        self.journal.close()
+
+    def waitUntilFinished(self, timeout: float | None = None):
+        """
+        Waits until every puzzle is completed or the time is up, returns false on timeout
+        """
+        return self.finished.wait(timeout)
+
+    def startTimer(self):
+        """
+        Starts counting down the game time, one tick of the engine per second
+        """
+        with self.timerCondition:
+            if self.timerRunning or self.stopped:
+                return
+            self.timerRunning = True
+        self.timerThread = threading.Thread(target=self._runTimer, name="GameTimer", daemon=True)
+        self.timerThread.start()
+
+    def stopTimer(self):
+        with self.timerCondition:
+            self.timerRunning = False
+            self.timerCondition.notify()
+        if self.timerThread is not None and self.timerThread is not threading.current_thread():
+            self.timerThread.join()
+        self.timerThread = None
+
+    def _runTimer(self):
+        """
+        Internal function of the timer thread, the ticks are due at whole seconds after the start, so they do not drift
+        """
+        nextTick = time.monotonic() + 1
+        while True:
+            with self.timerCondition:
+                self.timerCondition.wait_for(lambda: not self.timerRunning, timeout=max(0, nextTick - time.monotonic()))
+                if not self.timerRunning:
+                    return
+            self.engine.tick()
+            nextTick += 1
+
+    # Be carefull
+    # This is executed in the thread of the engine
+    def _onChange(self, snapshot: GameSnapshot, events):
+        """
+        Internal function needed for the GameEngine
+        """
+        for event, data in events:
+            if event == "initialized":
+                log(f"Initialization done: '{data['puzzle']}'")
+            elif event == "allInitialized":
+                log("All puzzles initialized")
+                self.startTimer()
+            elif event == "completed":
+                log(f"Puzzle complete: '{data['puzzle']}'")
+            elif event == "finished":
+                log(f"Game finished with {snapshot.points} points and {max(0, snapshot.secondsLeft)} seconds left")
+                self.finished.set()
+
+        for listener in list(self.listeners):
+            try:
+                listener(snapshot, events)
+            except Exception as ex:
+                log(f"Exception in game listener {listener}: {ex}", ERROR)
+
+        if snapshot.isFinished:
+            with self.timerCondition:
+                self.timerRunning = False
+                self.timerCondition.notify()
+
+    # Be carefull
+    # This is executed in another thread
+    def onMessage(self, topic: str, payload: str):
+        """
+        Internal function needed for the CommunicationManager
+
+        It receives the messages sent by the puzzles and passes them as commands to the engine.
+        The handler is looked up by topic, so the cost per message does not depend on the number of puzzles
+        """
+        handler = self.topicHandlers.get(topic)
+        if handler is None:
+            return
+
+        function, puzzle = handler
+        function(puzzle, topic, payload)
+
+    # Be carefull
+    # This is executed in another thread
+    def onGeneralMessage(self, puzzle: Puzzle, topic: str, payload: str):
+        """
+        Internal function which handles the messages sent on the general topic of a puzzle
+        """
+        # The own messages on the general topic, like initialize, do not count as a sign of life of the puzzle
+        if payload == initializeMessageAck:
+            self.presence.seen(puzzle.name)
+            if self.initializeHandshake.acknowledge(puzzle) and len(self.initializeHandshake.getPendingPuzzles()) == 0:
+                log(f"Every puzzle acknowledged the initialization, time to ready: {self.initializeHandshake.getTimeToReady()}")
+            self.engine.initialize(puzzle.name)
+
+        elif payload == finishMessage:
+            self.presence.seen(puzzle.name)
+            self.communicationManager.publish(puzzle.mqttTopicGeneral, finishMessageAck)
+            self.engine.complete(puzzle.name)
+
+    # Be carefull
+    # This is executed in another thread
+    def onPointsMessage(self, puzzle: Puzzle, topic: str, payload: str):
+        """
+        Internal function which handles the messages sent on the points topic of a puzzle
+        """
+        self.presence.seen(puzzle.name)
+        try:
+            points = int(payload)
+        except ValueError:
+            log(f"Cannot convert payload to int: {topic} {payload}", WARNING)
+            return
+        self.engine.subtractPoints(puzzle.name, points)
+
+    # Be carefull
+    # This is executed in another thread
+    def onStatusMessage(self, puzzle: Puzzle, topic: str, payload: str):
+        """
+        Internal function which handles the retained online / offline status of a puzzle
+        """
+        self.presence.statusReceived(puzzle.name, payload)
+
+    # Be carefull
+    # This is executed in another thread
+    def _onPresenceChange(self, puzzleName: str, presence: dict):
+        """
+        Internal function needed for the PresenceTracker
+        """
+        puzzle = self.puzzlesByName.get(puzzleName)
+        if puzzle is None:
+            return
+
+        if presence["status"] == offlineMessage and puzzleName not in self.offlinePuzzles:
+            self.offlinePuzzles.add(puzzleName)
+            log(f"'{puzzleName}' went offline", WARNING)
+
+        elif presence["status"] == onlineMessage:
+            state = self.engine.getSnapshot().getPuzzle(puzzleName)
+            if not state.isInitialized:
+                # The puzzle is connected, so it will receive the initialize message of the handshake,
+                # which keeps sending it until the puzzle acknowledges
+                log(f"'{puzzleName}' is online, initialized without waiting for the handshake")
+                self.engine.initialize(puzzleName)
+            elif puzzleName in self.offlinePuzzles and not state.isCompleted:
+                # A restarted puzzle has lost its initialization
+                log(f"'{puzzleName}' is online again, sending the initialize message again")
+                self.initializeHandshake.retry(puzzle)
+            self.offlinePuzzles.discard(puzzleName)
+
+    # Be carefull
+    # This is executed in another thread
+    def onConnect(self, code):
+        """
+        Internal function needed for the CommunicationManager
+        """
+        log(f"Connected with result code: {code} to MQTT Broker")
+
+        for puzzle in self.puzzles:
+            self.communicationManager.subscribe(f"{puzzle.mqttTopic}/#")
+
+    # Be carefull
+    # This is executed in another thread
+    def onDisconnect(self, code):
+        """
+        Internal function needed for the CommunicationManager
+        """
+        log(f"Disconnected with result code: {code}")
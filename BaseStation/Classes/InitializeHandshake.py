@@ -0,0 +1,169 @@
+import heapq
+import threading
+import time
+from typing import Dict, List
+
+from .CommunicationManager import initializeMessage
+from .Log import log
+from .Puzzle import Puzzle
+
+class InitializeHandshake():
+    """
+    Class which sends the initialize message to all puzzles at once and retries every puzzle
+    on its own exponential backoff until the puzzle acknowledges the initialization
+
+    All retries are scheduled on a single worker thread, which sleeps until the next retry is due.
+
+    Usage:
+        handshake: InitializeHandshake = InitializeHandshake(com.publish, puzzles)
+        handshake.start()
+        ...
+        handshake.acknowledge(puzzle) # When the initialize_ack message was received
+        ...
+        handshake.retry(puzzle) # When the puzzle was restarted and has to be initialized again
+        ...
+        handshake.stop()
+    """
+
+    initialDelay: float = 0.5 # Seconds until the first retry
+    maxDelay: float = 8 # Upper limit for the time between two retries
+    backoffFactor: float = 2
+
+    def __init__(self, publish, puzzles: List[Puzzle], message: str = initializeMessage):
+        """
+        publish is a function taking the topic and the message, e.g. CommunicationManager.publish
+        """
+        self.publish = publish
+        self.puzzles = puzzles
+        self.message = message
+
+        self.condition = threading.Condition()
+        self.thread: threading.Thread | None = None
+        self.running: bool = False
+
+        self.schedule = [] # Heap of (due time, puzzle index)
+        self.delays: Dict[Puzzle, float] = {}
+        self.attempts: Dict[Puzzle, int] = {}
+        self.attemptStartTimes: Dict[Puzzle, float] = {} # Start of the current handshake of every pending puzzle, reset by retry()
+        self.startTime: float = 0
+        self.timeToReady: Dict[str, float] = {} # Seconds from start until the acknowledgement, by puzzle name
+
+    def start(self):
+        """
+        Sends the initialize message to every puzzle which is not initialized yet and starts the retry thread
+        """
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+            self.startTime = time.monotonic()
+
+            for index, puzzle in enumerate(self.puzzles):
+                if puzzle.isInitialized:
+                    continue
+                self.delays[puzzle] = self.initialDelay
+                self.attempts[puzzle] = 0
+                self.attemptStartTimes[puzzle] = self.startTime
+                heapq.heappush(self.schedule, (self.startTime, index))
+
+        self.thread = threading.Thread(target=self._run, name="InitializeHandshake", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Cancels all pending retries and waits until the retry thread has finished
+        """
+        with self.condition:
+            self.running = False
+            self.schedule.clear()
+            self.condition.notify()
+
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+
+    def acknowledge(self, puzzle: Puzzle):
+        """
+        Call this function when the puzzle has acknowledged the initialization, so no more retries are sent,
+        returns false if the puzzle was not waiting for the acknowledgement
+        """
+        with self.condition:
+            if puzzle not in self.delays:
+                return False
+            del self.delays[puzzle]
+
+            # The time of the first initialization is kept, a retry after a restart of the puzzle is not counted
+            now = time.monotonic()
+            timeToReady = now - self.attemptStartTimes.pop(puzzle)
+            sinceStart = now - self.startTime
+            self.timeToReady.setdefault(puzzle.name, timeToReady)
+            attempts = self.attempts[puzzle]
+
+        # Heap entries of acknowledged puzzles are skipped by the worker thread
+        log(f"'{puzzle.name}' ready after {timeToReady:.3f} s ({attempts} initialize messages, {sinceStart:.3f} s since the start)")
+        return True
+
+    def retry(self, puzzle: Puzzle):
+        """
+        Sends the initialize message to the puzzle again until it acknowledges, e.g. after the puzzle restarted
+        """
+        with self.condition:
+            if not self.running or puzzle in self.delays:
+                return
+            now = time.monotonic()
+            self.delays[puzzle] = self.initialDelay
+            self.attempts[puzzle] = 0
+            self.attemptStartTimes[puzzle] = now
+            heapq.heappush(self.schedule, (now, self.puzzles.index(puzzle)))
+            self.condition.notify()
+
+    def getTimeToReady(self):
+        """
+        Returns a dictionary with the seconds it took every acknowledged puzzle to get ready, by puzzle name
+        """
+        with self.condition:
+            return dict(self.timeToReady)
+
+    def getPendingPuzzles(self):
+        """
+        Returns the puzzles which have not acknowledged the initialization yet
+        """
+        with self.condition:
+            return list(self.delays.keys())
+
+    def _run(self):
+        """
+        Internal function of the retry thread
+        """
+        while True:
+            with self.condition:
+                while self.running:
+                    if len(self.schedule) == 0:
+                        self.condition.wait()
+                        continue
+                    timeout = self.schedule[0][0] - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    self.condition.wait(timeout)
+
+                if not self.running:
+                    return
+
+                due = []
+                now = time.monotonic()
+                while len(self.schedule) > 0 and self.schedule[0][0] <= now:
+                    _, index = heapq.heappop(self.schedule)
+                    puzzle = self.puzzles[index]
+                    if puzzle not in self.delays:
+                        continue
+
+                    due.append(puzzle)
+                    self.attempts[puzzle] += 1
+                    delay = self.delays[puzzle]
+                    self.delays[puzzle] = min(delay * self.backoffFactor, self.maxDelay)
+                    heapq.heappush(self.schedule, (now + delay, index))
+
+            # Publish outside of the lock, so acknowledgements are never blocked by the network
+            for puzzle in due:
+                log(f"Sending activation message to: '{puzzle.name}'")
+                self.publish(puzzle.mqttTopicGeneral, self.message)
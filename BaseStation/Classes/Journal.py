@@ -0,0 +1,194 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Set
+
+from .Log import log, WARNING
+from .Puzzle import Puzzle
+
+"""
+Append-only journal of the state transitions of a game, used to resume the game after a crash
+
+Every transition is one JSON object per line with the time "t", the event "e" and the event data.
+The records are written and synced to the disk in batches by a background thread.
+
+Events:
+    start           puzzles (names of the selected puzzles), seconds, points
+    initialized     puzzle
+    allInitialized
+    completed       puzzle
+    points          points, label (the event shown in the points chart), puzzle (only if the points were sent by a puzzle)
+    hint            puzzle, hint (index of the hint)
+    timer           seconds (remaining seconds)
+    finished
+
+Usage:
+    journal = Journal(path)
+    journal.record("completed", puzzle="Tilt Maze")
+    journal.close()
+
+    state = replayJournal(path) # None if there is no game to resume
+"""
+
+defaultJournalPath: Path = Path(".", "journal.jsonl")
+
+class Journal():
+    """
+    Class which appends the records to the journal file
+    """
+
+    syncInterval: float = 0.5 # Seconds between two syncs of the file to the disk
+
+    def __init__(self, path: Path, append: bool = False):
+        """
+        Opens the journal, an existing journal is overwritten unless append is true
+        """
+        self.path = path
+        self.file = open(self.path, "a" if append else "w")
+
+        self.pending: List[str] = []
+        self.condition = threading.Condition()
+        self.running: bool = True
+
+        self.thread = threading.Thread(target=self._run, name="Journal", daemon=True)
+        self.thread.start()
+
+    def record(self, event: str, **data):
+        """
+        Adds a record of the event to the journal
+        """
+        line = json.dumps({"t": time.time(), "e": event, **data})
+        with self.condition:
+            self.pending.append(line)
+            self.condition.notify()
+
+    def close(self):
+        """
+        Writes the remaining records and closes the journal
+        """
+        with self.condition:
+            if not self.running:
+                return
+            self.running = False
+            self.condition.notify()
+        self.thread.join()
+
+    def _run(self):
+        """
+        Internal function of the writer thread
+        """
+        while True:
+            with self.condition:
+                while self.running and len(self.pending) == 0:
+                    self.condition.wait()
+                running = self.running
+            if running:
+                # Collect more records before the next sync
+                with self.condition:
+                    self.condition.wait_for(lambda: not self.running, timeout=self.syncInterval)
+
+            with self.condition:
+                lines = self.pending
+                self.pending = []
+
+            if len(lines) > 0:
+                self.file.write("\n".join(lines) + "\n")
+                self.file.flush()
+                os.fsync(self.file.fileno())
+
+            if not running:
+                self.file.close()
+                return
+
+class JournalState():
+    """
+    Class representing the state of a game rebuilt from the journal
+    """
+    def __init__(self):
+        self.puzzleNames: List[str] = []
+        self.initialized: Set[str] = set()
+        self.completed: Set[str] = set()
+        self.hintsUsed: Dict[str, int] = {} # Number of used hints by puzzle name
+        self.allInitialized: bool = False
+        self.points: int = 0
+        self.pointsHistory = [] # Tuples of (timestamp, points, event)
+        self.secondsLeft: int = 0
+        self.isFinished: bool = False
+
+    def applyToPuzzles(self, puzzles: List[Puzzle]):
+        """
+        Restores the states of the puzzles and their hints
+        """
+        for puzzle in puzzles:
+            puzzle.isInitialized = puzzle.name in self.initialized
+            puzzle.isCompleted = puzzle.name in self.completed
+
+            hintsUsed = self.hintsUsed.get(puzzle.name, 0)
+            for hint in puzzle.hints[:hintsUsed]:
+                hint.isUsed = True
+            puzzle.nextHint = hintsUsed + 1
+
+def applyRecord(state: JournalState | None, record: dict):
+    """
+    Applies a record of the journal to the state and returns the state, which is a new one for a start record
+
+    Raises KeyError or TypeError for an invalid record, the state is not changed then
+    """
+    event = record["e"]
+    if event == "start":
+        newState = JournalState()
+        newState.puzzleNames = record["puzzles"]
+        newState.secondsLeft = record["seconds"]
+        newState.points = record["points"]
+        return newState
+    if state is None:
+        return None
+
+    if event == "initialized":
+        state.initialized.add(record["puzzle"])
+    elif event == "allInitialized":
+        state.allInitialized = True
+    elif event == "completed":
+        state.completed.add(record["puzzle"])
+    elif event == "points":
+        entry = (record["t"], record["points"], record["label"])
+        state.points = entry[1]
+        state.pointsHistory.append(entry)
+    elif event == "hint":
+        puzzleName = record["puzzle"]
+        hintsUsed = record["hint"] + 1
+        state.hintsUsed[puzzleName] = max(state.hintsUsed.get(puzzleName, 0), hintsUsed)
+    elif event == "timer":
+        state.secondsLeft = record["seconds"]
+    elif event == "finished":
+        state.isFinished = True
+    return state
+
+def replayJournal(path: Path):
+    """
+    Reads the journal and returns the JournalState of the game, or None if there is no unfinished game
+    """
+    if not path.exists():
+        return None
+
+    state: JournalState | None = None
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Only the last line can be incomplete, when the application crashed while writing it
+                log(f"Ignoring incomplete journal record: {line.strip()}", WARNING)
+                continue
+
+            try:
+                state = applyRecord(state, record)
+            except (KeyError, TypeError):
+                # E.g. a record of a different version of the application, the game continues without it
+                log(f"Ignoring invalid journal record: {line.strip()}", WARNING)
+
+    if state is None or state.isFinished:
+        return None
+    return state
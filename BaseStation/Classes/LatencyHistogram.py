@@ -0,0 +1,164 @@
+import time
+from typing import Dict, List
+
+class LatencyHistogram():
+    """
+    Histogram of latencies in the style of an HDR histogram
+
+    Values are counted in microseconds in buckets whose width grows with the value, so every value is stored
+    with a relative error below 1% and the memory does not depend on the number of recorded values.
+    Only buckets which are used are stored.
+
+    Usage:
+        histogram = LatencyHistogram()
+        histogram.record(0.0123) # Seconds
+        histogram.getPercentile(99) # Milliseconds
+    """
+
+    subBucketBits: int = 8 # Values below 2^subBucketBits us are stored exactly
+
+    def __init__(self):
+        self.counts: Dict[int, int] = {} # Number of values by bucket index
+        self.count: int = 0
+        self.sum: int = 0
+        self.min: int | None = None
+        self.max: int | None = None
+
+    def record(self, seconds: float):
+        """
+        Adds a latency in seconds to the histogram
+        """
+        value = max(0, int(seconds * 1000000))
+        index = self._index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other: "LatencyHistogram"):
+        """
+        Adds all values of the other histogram to this histogram
+        """
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.sum += other.sum
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def getPercentile(self, percentile: float):
+        """
+        Returns the latency in ms below which the percentage of the values lies, or None if the histogram is empty
+        """
+        if self.count == 0:
+            return None
+
+        rank = max(1, percentile / 100 * self.count)
+        seen = 0
+        for index in sorted(self.counts.keys()):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self._highestValue(index), self.max) / 1000
+        return self.max / 1000
+
+    def getSummary(self):
+        """
+        Returns a dictionary with the count and the min, mean, 50th, 90th, 99th percentile and max in ms
+        """
+        if self.count == 0:
+            return {"count": 0, "min": None, "mean": None, "p50": None, "p90": None, "p99": None, "max": None}
+        return {
+            "count": self.count,
+            "min": self.min / 1000,
+            "mean": self.sum / self.count / 1000,
+            "p50": self.getPercentile(50),
+            "p90": self.getPercentile(90),
+            "p99": self.getPercentile(99),
+            "max": self.max / 1000,
+        }
+
+    def getBuckets(self):
+        """
+        Returns the used buckets as list of [lowest us, highest us, count], e.g. for an export
+        """
+        return [[self._lowestValue(index), self._highestValue(index), self.counts[index]] for index in sorted(self.counts.keys())]
+
+    def _index(self, value: int):
+        """
+        Internal function which returns the bucket index of the value in us
+        """
+        shift = max(0, value.bit_length() - self.subBucketBits)
+        if shift == 0:
+            return value
+        halfCount = 1 << (self.subBucketBits - 1)
+        return (1 << self.subBucketBits) + (shift - 1) * halfCount + (value >> shift) - halfCount
+
+    def _shift(self, index: int):
+        """
+        Internal function which returns the shift and the sub bucket of the bucket index
+        """
+        fullCount = 1 << self.subBucketBits
+        if index < fullCount:
+            return 0, index
+        halfCount = fullCount >> 1
+        shift = (index - fullCount) // halfCount + 1
+        return shift, (index - fullCount) % halfCount + halfCount
+
+    def _lowestValue(self, index: int):
+        """
+        Internal function which returns the lowest value in us of the bucket
+        """
+        shift, subBucket = self._shift(index)
+        return subBucket << shift
+
+    def _highestValue(self, index: int):
+        """
+        Internal function which returns the highest value in us of the bucket
+        """
+        shift, subBucket = self._shift(index)
+        return ((subBucket + 1) << shift) - 1
+
+class RollingHistogram():
+    """
+    LatencyHistogram of the last windowSeconds, made of intervalCount histograms which are replaced one after another
+
+    Additionally a histogram with all values since the start is kept for the export
+    """
+    def __init__(self, windowSeconds: float = 60, intervalCount: int = 6):
+        self.intervalSeconds = windowSeconds / intervalCount
+        self.intervals: List[tuple] = [] # Tuples of (interval number, LatencyHistogram), the newest last
+        self.intervalCount = intervalCount
+        self.total = LatencyHistogram()
+
+    def record(self, seconds: float, now: float | None = None):
+        """
+        Adds a latency in seconds
+        """
+        if now is None:
+            now = time.monotonic()
+        interval = int(now // self.intervalSeconds)
+        if len(self.intervals) == 0 or self.intervals[-1][0] != interval:
+            self.intervals.append((interval, LatencyHistogram()))
+            self.intervals = self.intervals[-self.intervalCount:]
+
+        self.intervals[-1][1].record(seconds)
+        self.total.record(seconds)
+
+    def getWindow(self, now: float | None = None):
+        """
+        Returns a LatencyHistogram with the values of the last windowSeconds
+        """
+        if now is None:
+            now = time.monotonic()
+        oldest = int(now // self.intervalSeconds) - self.intervalCount + 1
+
+        window = LatencyHistogram()
+        for interval, histogram in self.intervals:
+            if interval >= oldest:
+                window.merge(histogram)
+        return window
@@ -1,46 +1,226 @@
+import atexit
+import json
+import os
+import queue
+import sys
+import threading
+import time
 from datetime import datetime
 from pathlib import Path
 
 """
 Logging functions for creating a logfile
 
+log() only puts the message into a queue, a background thread formats the messages, prints them to the console
+and appends them in batches to the file. Each line of the file is a JSON object with the time, the level,
+the thread and the message. The file is rotated when it gets larger than maxBytes.
+If writing the file fails, e.g. because the SD card is full, the error is reported once to stderr and the messages
+are only printed to the console from then on. The thread never stops on an error, so the queue does not grow.
+
 Usage:
-    from Log import initLogger, log
+    from Log import initLogger, log, shutdownLogger, WARNING
 
     initLogger(FILEPATH)
     log("Hello, Logger!")
+    log("Something is odd", WARNING)
+    shutdownLogger() # Optional, is also done when the application exits
 """
 
-writeToFile: bool = False
-filePath: str = ""
+DEBUG: int = 10
+INFO: int = 20
+WARNING: int = 30
+ERROR: int = 40
+
+levelNames = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
 
-def initLogger(path: Path|None):
+minLevel: int = INFO
+writer = None
+writerLock = threading.Lock()
+
+class LogWriter():
+    """
+    Class which writes the queued log messages in a background thread
+    """
+
+    flushInterval: float = 0.2 # Seconds the writer waits for more messages before writing a batch
+    maxBatchSize: int = 500
+
+    def __init__(self, path: Path | None, maxBytes: int, backupCount: int):
+        self.path = path
+        self.maxBytes = maxBytes
+        self.backupCount = backupCount
+
+        self.queue = queue.SimpleQueue()
+        self.console: bool = True # Set to false when printing failed, e.g. because stdout was closed
+        self.batchErrorReported: bool = False
+        self.file = None
+        if self.path is not None:
+            self.file = open(self.path, "w+")
+
+        self.thread = threading.Thread(target=self._run, name="LogWriter", daemon=True)
+        self.thread.start()
+
+    def put(self, record):
+        """
+        Queues a record of (time, level, thread name, message)
+        """
+        self.queue.put(record)
+
+    def stop(self):
+        """
+        Writes all queued messages and stops the thread
+        """
+        self.queue.put(None)
+        self.thread.join(timeout=5)
+
+    def _run(self):
+        """
+        Internal function of the writer thread
+        """
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.flushInterval
+            while len(batch) < self.maxBatchSize and batch[-1] is not None:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            if batch[-1] is None:
+                batch.pop()
+                running = False
+            try:
+                self._write(batch)
+            except Exception as e:
+                # The batch is lost, but the following ones are still written
+                if not self.batchErrorReported:
+                    self.batchErrorReported = True
+                    self._reportError("Writing a batch of log messages failed", e)
+
+        self._closeFile()
+
+    def _write(self, batch):
+        """
+        Internal function which prints and writes a batch of records
+        """
+        if len(batch) == 0:
+            return
+
+        consoleLines = []
+        fileLines = []
+        for timestamp, level, threadName, msg in batch:
+            date_time = datetime.fromtimestamp(timestamp)
+            consoleLines.append(f"{date_time.strftime('%Y/%m/%d %H:%M:%S')} - {msg}\n")
+            if self.file is not None:
+                fileLines.append(json.dumps({
+                    "time": date_time.isoformat(timespec="milliseconds"),
+                    "level": levelNames.get(level, str(level)),
+                    "thread": threadName,
+                    "message": str(msg),
+                }) + "\n")
+
+        if self.console:
+            try:
+                sys.stdout.write("".join(consoleLines))
+                sys.stdout.flush()
+            except Exception as e:
+                self.console = False
+                self._reportError("Printing the log messages failed, they are not printed anymore", e)
+
+        if self.file is not None:
+            try:
+                self.file.write("".join(fileLines))
+                self.file.flush()
+                if self.file.tell() > self.maxBytes:
+                    self._rotate()
+            except Exception as e:
+                self._closeFile()
+                self._reportError(f"Writing the log file {self.path} failed, the messages are only printed from now on", e)
+
+    def _rotate(self):
+        """
+        Internal function which renames the log file to FILE.1 (FILE.1 to FILE.2 and so on) and starts a new file
+        """
+        self.file.close()
+        for index in range(self.backupCount - 1, 0, -1):
+            source = Path(f"{self.path}.{index}")
+            if source.exists():
+                os.replace(source, f"{self.path}.{index + 1}")
+        if self.backupCount > 0:
+            os.replace(self.path, f"{self.path}.1")
+        self.file = open(self.path, "w+")
+
+    def _closeFile(self):
+        """
+        Internal function which closes the log file, errors are ignored as the file is not used anymore
+        """
+        if self.file is None:
+            return
+        try:
+            self.file.close()
+        except Exception:
+            pass
+        self.file = None
+
+    def _reportError(self, message: str, error: Exception):
+        """
+        Internal function which reports an error of the writer to stderr, as it can not be logged
+        """
+        try:
+            sys.stderr.write(f"{message}: {error!r}\n")
+            sys.stderr.flush()
+        except Exception:
+            pass
+
+def initLogger(path: Path|None, level: int = INFO, maxBytes: int = 5*1024*1024, backupCount: int = 3):
     """
     Innitialize the Logger
     Provide a file path object Path (from pathlib.Path) to log messages also to a file and not only the console.
 
-    If no path is provided the messages will only be printed to the console
+    If no path is provided the messages will only be printed to the console.
+    Messages below the level are ignored. When the file gets larger than maxBytes it is rotated, keeping backupCount old files
     """
-    global writeToFile, filePath
+    global writer, minLevel
 
-    if path is None:
-        return
+    minLevel = level
+    with writerLock:
+        if writer is not None:
+            writer.stop()
+        writer = LogWriter(path, maxBytes, backupCount)
 
-    writeToFile = True
-    open(path, "w+").close()
-    filePath = path
+def shutdownLogger():
+    """
+    Writes all queued messages, call this before the application exits
+    """
+    global writer
 
+    with writerLock:
+        if writer is not None:
+            writer.stop()
+            writer = None
 
-def log(msg):
+def log(msg, level: int = INFO):
     """
     Prints the message on the console and depending on the initialization also to a file
+
+    Only queues the message, the formatting and writing is done in a background thread
     """
-    global writeToFile, filePath
+    global writer
+
+    if level < minLevel:
+        return
+
+    currentWriter = writer
+    if currentWriter is None:
+        with writerLock:
+            if writer is None:
+                writer = LogWriter(None, 0, 0)
+            currentWriter = writer
 
-    date_time = datetime.now().strftime("%Y/%m/%d %H:%M:%S")
-    message = f"{date_time} - {msg}"
-    print(message)
+    currentWriter.put((time.time(), level, threading.current_thread().name, msg))
 
-    if writeToFile:
-        with open(filePath, "a") as f:
-            f.write(f"{message}\n")
\ No newline at end of file
+atexit.register(shutdownLogger)
@@ -0,0 +1,114 @@
+import asyncio
+from collections import deque
+
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.reasoncodes import ReasonCode
+
+from .MqttConnection import MqttConnection
+
+class LoopbackConnection(MqttConnection):
+    """
+    In-process stand-in for the MqttConnection, which needs no broker
+
+    Published messages are delivered to the matching subscribers of the same connection in its event loop,
+    like a broker which echoes every message. Pausing the reading holds the messages back until it is resumed,
+    so the flow control of the subscribers behaves as with a socket. An optional latency delays every delivery.
+
+    Usage:
+        connection = LoopbackConnection()
+        setSharedConnection(connection) # Every CommunicationManager of the process uses the loopback now
+    """
+
+    def __init__(self, latency: float = 0):
+        """
+        latency is the delay in seconds between publishing and delivering a message
+        """
+        super().__init__()
+        self.latency = latency
+        self.backlog = deque() # Messages held back while the reading is paused
+
+    def publish(self, topic, message, qos: int = 2, retain: bool = False):
+        """
+        Publish a message at topic, QoS and retain flag are ignored
+        """
+        self.published += 1
+        self.callInLoop(self._transmit, topic, str(message))
+
+    def pauseReading(self, subscriber):
+        """
+        Holds the published messages back, e.g. when the queue of a subscriber is full
+        """
+        self.pausingSubscribers.add(subscriber)
+        self.readingPaused = True
+
+    def resumeReading(self, subscriber):
+        """
+        Delivers the held back messages when no subscriber wants the reading to be paused anymore
+        """
+        self.pausingSubscribers.discard(subscriber)
+        if len(self.pausingSubscribers) > 0 or not self.readingPaused:
+            return
+
+        self.readingPaused = False
+        while len(self.backlog) > 0 and not self.readingPaused:
+            self._deliver(*self.backlog.popleft())
+
+    def getStatistics(self):
+        """
+        Returns a dictionary with the counters of the connection
+        """
+        statistics = super().getStatistics()
+        statistics["backlog"] = len(self.backlog)
+        return statistics
+
+    def _createClient(self):
+        """
+        Internal function, the loopback does not need a client
+        """
+        return None
+
+    def _subscribeAtBroker(self, topicFilter: str):
+        pass
+
+    def _unsubscribeAtBroker(self, topicFilter: str):
+        pass
+
+    def _connect(self):
+        """
+        Internal function which informs the subscribers about the connection as soon as the event loop runs
+        """
+        self.loop.call_soon_threadsafe(self._connected, ReasonCode(PacketTypes.CONNACK, "Success"))
+
+    def _shutdown(self, stopLoop: bool):
+        """
+        Internal function which stops the event loop, must be called in the event loop
+        """
+        with self.lock:
+            self.isConnected = False
+        self.backlog.clear()
+
+        if stopLoop:
+            self.loop.stop()
+        self.loop = None
+
+    def _transmit(self, topic: str, payload: str):
+        """
+        Internal function which delivers the message after the latency, must be called in the event loop
+        """
+        if self.latency > 0:
+            asyncio.get_running_loop().call_later(self.latency, self._deliver, topic, payload)
+        else:
+            self._deliver(topic, payload)
+
+    def _deliver(self, topic: str, payload: str):
+        """
+        Internal function which delivers the message to all matching subscribers, or holds it back while paused
+        """
+        if self.readingPaused:
+            self.backlog.append((topic, payload))
+            return
+
+        self.received += 1
+        for subscriber in self._route(topic):
+            self.delivered += 1
+            subscriber.deliver(topic, payload)
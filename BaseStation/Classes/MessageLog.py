@@ -0,0 +1,101 @@
+import threading
+import time
+from collections import deque
+from typing import List
+
+class MessageLog():
+    """
+    Ring buffer of the last capacity received messages as tuples of (time, topic, payload)
+
+    append() can be called from any thread, it only puts the message into a pending queue.
+    The consumer (e.g. the UI thread) moves the pending messages into the ring buffer with takePending(),
+    removeOldest() and extend(), so it can announce every change before it happens.
+    The pending queue is bounded by the capacity as well, so the memory does not grow while nothing is consumed.
+
+    Usage:
+        messageLog = MessageLog(10000)
+        messageLog.append(topic, payload) # Any thread
+        ...
+        entries = messageLog.takePending()
+        messageLog.removeOldest(messageLog.getOverflow(len(entries)))
+        messageLog.extend(entries)
+        messageLog.get(0) # Newest message
+    """
+    def __init__(self, capacity: int = 10000):
+        self.capacity = capacity
+
+        self.lock = threading.Lock()
+        self.pending = deque()
+        self.received: int = 0
+        self.dropped: int = 0 # Messages removed from the pending queue before they were consumed
+
+        # Only used by the consumer
+        self.entries: List[tuple | None] = [None] * capacity
+        self.first: int = 0 # Position of the oldest entry
+        self.count: int = 0
+
+    def append(self, topic: str, payload: str):
+        """
+        Adds a message to the pending queue
+        """
+        with self.lock:
+            if len(self.pending) >= self.capacity:
+                self.pending.popleft()
+                self.dropped += 1
+            self.pending.append((time.time(), topic, payload))
+            self.received += 1
+
+    def takePending(self):
+        """
+        Returns and removes the pending messages, the oldest first
+        """
+        with self.lock:
+            entries = self.pending
+            self.pending = deque()
+        return entries
+
+    def getOverflow(self, newCount: int):
+        """
+        Returns how many of the oldest entries must be removed before newCount entries can be added
+        """
+        return max(0, self.count + newCount - self.capacity)
+
+    def removeOldest(self, count: int):
+        """
+        Removes the count oldest entries
+        """
+        count = min(count, self.count)
+        for _ in range(count):
+            self.entries[self.first] = None
+            self.first = (self.first + 1) % self.capacity
+        self.count -= count
+
+    def extend(self, entries):
+        """
+        Adds the entries after the newest entry, there must be enough space for them (see getOverflow)
+        """
+        for entry in entries:
+            self.entries[(self.first + self.count) % self.capacity] = entry
+            self.count += 1
+
+    def clear(self):
+        """
+        Removes all entries, but not the pending messages
+        """
+        self.removeOldest(self.count)
+
+    def get(self, index: int):
+        """
+        Returns the entry at index, 0 is the newest entry
+        """
+        return self.entries[(self.first + self.count - 1 - index) % self.capacity]
+
+    def __len__(self):
+        return self.count
+
+    def getStatistics(self):
+        """
+        Returns a dictionary with the number of stored, pending, received and dropped messages
+        """
+        with self.lock:
+            return {"stored": self.count, "pending": len(self.pending), "received": self.received, "dropped": self.dropped}
@@ -0,0 +1,177 @@
+import asyncio
+from collections import deque
+from enum import Enum
+from typing import Dict, List
+
+import paho.mqtt.client as mqtt
+
+class OverflowPolicy(Enum):
+    """
+    What a MessageQueue does with a new message when it is full
+    """
+    DROP_OLDEST = "drop_oldest" # Remove the oldest queued message
+    COALESCE = "coalesce" # Replace the payload of a queued message with the same topic, otherwise drop the oldest
+    BLOCK = "block" # Keep the message and ask the producer to pause until the queue has drained
+
+class MessageQueue():
+    """
+    Bounded queue of (topic, payload) tuples for a single asyncio event loop
+
+    put() is called by the producer (the MQTT network callbacks), the consumer iterates over the queue:
+        async for topic, payload in queue:
+            ...
+
+    With OverflowPolicy.COALESCE only topics matching one of coalesceTopics (MQTT topic filters) are coalesced,
+    because most puzzle messages are events which must not be merged. Without filters every topic is coalesced.
+
+    With OverflowPolicy.BLOCK nothing is dropped, instead onFull() is called when the queue is full
+    and onSpace() when it has drained to half of its size, so the producer can stop and resume reading.
+
+    Must only be used from the thread running the event loop
+    """
+
+    def __init__(self, maxSize: int = 1000, policy: OverflowPolicy = OverflowPolicy.BLOCK, coalesceTopics: List[str] | None = None):
+        self.maxSize = maxSize
+        self.policy = policy
+        self.coalesceTopics = coalesceTopics
+
+        self.onFull = None
+        self.onSpace = None
+
+        self.entries = deque() # Lists of [topic, payload], so coalescing can replace the payload in place
+        self.entriesByTopic: Dict[str, list] = {}
+        self.getters = deque()
+        self.closed: bool = False
+        self.isFull: bool = False
+
+        # Counters
+        self.received: int = 0
+        self.delivered: int = 0
+        self.dropped: int = 0
+        self.coalesced: int = 0
+        self.maxDepth: int = 0
+        self.pauses: int = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        message = await self.get()
+        if message is None:
+            raise StopAsyncIteration
+        return message
+
+    def put(self, topic: str, payload: str):
+        """
+        Adds a message to the queue and applies the overflow policy
+        """
+        if self.closed:
+            return
+        self.received += 1
+
+        if self.policy == OverflowPolicy.COALESCE and self._isCoalesced(topic):
+            entry = self.entriesByTopic.get(topic)
+            if entry is not None:
+                entry[1] = payload
+                self.coalesced += 1
+                return
+
+        if len(self.entries) >= self.maxSize and self.policy != OverflowPolicy.BLOCK:
+            self._remove(self.entries.popleft())
+            self.dropped += 1
+
+        entry = [topic, payload]
+        self.entries.append(entry)
+        if self.policy == OverflowPolicy.COALESCE and self._isCoalesced(topic):
+            self.entriesByTopic[topic] = entry
+
+        self.maxDepth = max(self.maxDepth, len(self.entries))
+        self._wakeup()
+
+        if self.policy == OverflowPolicy.BLOCK and not self.isFull and len(self.entries) >= self.maxSize:
+            self.isFull = True
+            self.pauses += 1
+            if self.onFull is not None:
+                self.onFull()
+
+    async def get(self):
+        """
+        Waits for the next message and returns it as (topic, payload) tuple, or None if the queue was closed
+        """
+        while len(self.entries) == 0:
+            if self.closed:
+                return None
+            getter = asyncio.get_running_loop().create_future()
+            self.getters.append(getter)
+            try:
+                await getter
+            except asyncio.CancelledError:
+                if getter in self.getters:
+                    self.getters.remove(getter)
+                raise
+
+        entry = self.entries.popleft()
+        self._remove(entry)
+        self.delivered += 1
+
+        if self.isFull and len(self.entries) <= self.maxSize // 2:
+            self.isFull = False
+            if self.onSpace is not None:
+                self.onSpace()
+
+        return entry[0], entry[1]
+
+    def close(self):
+        """
+        Closes the queue, consumers receive the remaining messages and then stop iterating
+        """
+        self.closed = True
+        while len(self.getters) > 0:
+            getter = self.getters.popleft()
+            if not getter.done():
+                getter.set_result(None)
+
+    def getStatistics(self):
+        """
+        Returns a dictionary with the current depth and the counters of the queue
+        """
+        return {
+            "depth": len(self.entries),
+            "maxDepth": self.maxDepth,
+            "received": self.received,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "pauses": self.pauses,
+        }
+
+    def _isCoalesced(self, topic: str):
+        """
+        Internal function which returns true if messages on the topic can be coalesced
+        """
+        if self.coalesceTopics is None:
+            return True
+        for topicFilter in self.coalesceTopics:
+            if mqtt.topic_matches_sub(topicFilter, topic):
+                return True
+        return False
+
+    def _remove(self, entry: list):
+        """
+        Internal function to forget an entry which left the queue
+        """
+        if self.entriesByTopic.get(entry[0]) is entry:
+            del self.entriesByTopic[entry[0]]
+
+    def _wakeup(self):
+        """
+        Internal function to wake up one waiting consumer
+        """
+        while len(self.getters) > 0:
+            getter = self.getters.popleft()
+            if not getter.done():
+                getter.set_result(None)
+                return
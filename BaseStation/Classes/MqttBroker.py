@@ -0,0 +1,654 @@
+import asyncio
+import os
+import struct
+import threading
+from itertools import count
+from typing import Dict, List
+
+from .Log import log, DEBUG, WARNING, ERROR
+from .MqttConnection import MqttConnection, topicMatches
+
+"""
+MQTT broker which can be started by the base station itself, so the puzzles in the LAN connect to the base station
+directly instead of a public broker
+
+It supports MQTT 3.1.1 and the parts of MQTT 5 which are used by the base station and the puzzles:
+QoS 0, 1 and 2, retained messages, last will messages, keep alive and username / password authentication.
+Sessions are not persisted, every client starts with a clean session. MQTT 5 properties are accepted but ignored.
+
+Everything runs in one asyncio event loop, in a separate thread when started with start() or on the running loop
+when started with startAsync().
+
+Usage:
+    broker = MqttBroker(port=1883)
+    broker.start()
+    ...
+    broker.stop()
+
+Usage in the applications, if MQTT_EMBEDDED_BROKER=1 is set in the .env file:
+    broker = startEmbeddedBroker() # Before the first CommunicationManager is started
+"""
+
+# Packet types
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+PUBREC = 5
+PUBREL = 6
+PUBCOMP = 7
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+# Protocol levels
+MQTTv311 = 4
+MQTTv5 = 5
+
+class MqttProtocolError(Exception):
+    """
+    Exception raised when a client sends a packet which violates the protocol, the client is disconnected
+    """
+
+class PacketReader():
+    """
+    Reads the fields of the variable header and the payload of a packet
+    """
+    def __init__(self, data: bytes):
+        self.data = data
+        self.position = 0
+
+    def remaining(self):
+        return len(self.data) - self.position
+
+    def readByte(self):
+        if self.position >= len(self.data):
+            raise MqttProtocolError("Packet too short")
+        value = self.data[self.position]
+        self.position += 1
+        return value
+
+    def readUInt16(self):
+        if self.position + 2 > len(self.data):
+            raise MqttProtocolError("Packet too short")
+        value = struct.unpack_from("!H", self.data, self.position)[0]
+        self.position += 2
+        return value
+
+    def readBinary(self):
+        length = self.readUInt16()
+        if self.position + length > len(self.data):
+            raise MqttProtocolError("Packet too short")
+        value = self.data[self.position:self.position + length]
+        self.position += length
+        return value
+
+    def readString(self):
+        try:
+            return self.readBinary().decode("utf-8")
+        except UnicodeDecodeError:
+            raise MqttProtocolError("Invalid UTF-8 string")
+
+    def readVarInt(self):
+        value = 0
+        for shift in range(0, 28, 7):
+            byte = self.readByte()
+            value += (byte & 0x7F) << shift
+            if byte & 0x80 == 0:
+                return value
+        raise MqttProtocolError("Invalid variable byte integer")
+
+    def skipProperties(self):
+        """
+        Skips the properties of an MQTT 5 packet
+        """
+        length = self.readVarInt()
+        if self.position + length > len(self.data):
+            raise MqttProtocolError("Packet too short")
+        self.position += length
+
+    def readRest(self):
+        value = self.data[self.position:]
+        self.position = len(self.data)
+        return value
+
+def encodeVarInt(value: int):
+    """
+    Returns the bytes of a variable byte integer, used for the remaining length and the length of the properties
+    """
+    result = bytearray()
+    while True:
+        byte = value % 128
+        value //= 128
+        if value > 0:
+            byte |= 0x80
+        result.append(byte)
+        if value == 0:
+            return bytes(result)
+
+def encodeString(value: str | bytes):
+    if isinstance(value, str):
+        value = value.encode("utf-8")
+    return struct.pack("!H", len(value)) + value
+
+def encodePacket(packetType: int, flags: int, body: bytes):
+    """
+    Returns the bytes of a packet with the fixed header
+    """
+    return bytes([packetType << 4 | flags]) + encodeVarInt(len(body)) + body
+
+def isValidTopicFilter(topicFilter: str):
+    """
+    Returns true if the wildcards + and # are only used as whole levels and # only as the last level
+    """
+    if topicFilter == "":
+        return False
+    levels = topicFilter.split("/")
+    for index, level in enumerate(levels):
+        if "#" in level and (level != "#" or index != len(levels) - 1):
+            return False
+        if "+" in level and level != "+":
+            return False
+    return True
+
+class BrokerClient():
+    """
+    Connection of a client to the MqttBroker
+    """
+    def __init__(self, broker: "MqttBroker", reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.broker = broker
+        self.reader = reader
+        self.writer = writer
+        self.address = writer.get_extra_info("peername")
+
+        self.clientId: str = ""
+        self.protocolLevel: int = MQTTv311
+        self.keepAlive: int = 0
+        self.will: tuple | None = None # (topic, payload, qos, retain), published when the connection is lost
+        self.subscriptions: Dict[str, int] = {} # Granted QoS by topic filter
+        self.packetIds = count(1)
+        self.inflight: Dict[int, int] = {} # QoS by packet id of the messages sent to the client and not acknowledged yet
+        self.receivedQos2 = set() # Packet ids of the QoS 2 messages received from the client and not released yet
+        self.isConnected: bool = False
+
+    def send(self, packet: bytes):
+        """
+        Writes a packet to the socket, does not wait until it is sent
+        """
+        if self.writer.is_closing():
+            return
+        self.writer.write(packet)
+        self.broker.packetsSent += 1
+        self.broker.bytesSent += len(packet)
+
+    def sendPublish(self, topic: str, payload: bytes, qos: int, retain: bool):
+        """
+        Sends a message to the client, QoS 0 messages are dropped while the client does not read its socket
+        """
+        if qos == 0 and self.writer.transport.get_write_buffer_size() > self.broker.maxClientBuffer:
+            self.broker.dropped += 1
+            return
+
+        body = encodeString(topic)
+        if qos > 0:
+            packetId = self._nextPacketId()
+            if packetId is None:
+                self.broker.dropped += 1
+                return
+            self.inflight[packetId] = qos
+            body += struct.pack("!H", packetId)
+        if self.protocolLevel == MQTTv5:
+            body += b"\x00" # No properties
+        self.send(encodePacket(PUBLISH, qos << 1 | int(retain), body + payload))
+        self.broker.sent += 1
+
+    def close(self):
+        if not self.writer.is_closing():
+            self.writer.close()
+
+    def _nextPacketId(self):
+        """
+        Internal function which returns the next packet id which is not in use,
+        or None if the client did not acknowledge 65535 messages
+        """
+        for _ in range(65535):
+            packetId = next(self.packetIds) % 65536
+            if packetId != 0 and packetId not in self.inflight:
+                return packetId
+        return None
+
+class MqttBroker():
+    """
+    Class of the embedded MQTT broker
+    """
+
+    maxPacketSize: int = 1024 * 1024 # Larger packets are rejected
+    maxClientBuffer: int = 1024 * 1024 # Bytes waiting for a slow client above which its QoS 0 messages are dropped
+    connectTimeout: float = 10 # Seconds a new connection may take to send its CONNECT packet
+
+    def __init__(self, host: str = "0.0.0.0", port: int = 1883, user: str = "", password: str = ""):
+        """
+        If a user is set, clients must authenticate with the user and the password
+        """
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+
+        self.clients: Dict[str, BrokerClient] = {} # Connected clients by client id
+        self.subscribers: Dict[str, Dict[BrokerClient, int]] = {} # Granted QoS of the clients by topic filter
+        self.routeCache: Dict[str, List[tuple]] = {} # (client, qos) by topic, cleared when the subscriptions change
+        self.retained: Dict[str, tuple] = {} # (payload, qos) by topic
+        self.clientIds = count(1)
+        self.connections: Dict[BrokerClient, asyncio.Task] = {} # Tasks serving the open connections, also before CONNECT
+
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.loopThread: threading.Thread | None = None
+        self.server: asyncio.base_events.Server | None = None
+
+        # Counters
+        self.connects: int = 0
+        self.received: int = 0
+        self.sent: int = 0
+        self.dropped: int = 0
+        self.packetsReceived: int = 0
+        self.packetsSent: int = 0
+        self.bytesReceived: int = 0
+        self.bytesSent: int = 0
+
+    def start(self):
+        """
+        Starts the broker in an event loop in a separate thread, raises an OSError if the port can not be used
+        """
+        self.loop = asyncio.new_event_loop()
+        try:
+            self.loop.run_until_complete(self._listen())
+        except OSError:
+            self.loop.close()
+            self.loop = None
+            raise
+        self.loopThread = threading.Thread(target=self.loop.run_forever, name="MqttBroker", daemon=True)
+        self.loopThread.start()
+
+    async def startAsync(self):
+        """
+        Starts the broker on the running event loop
+        """
+        self.loop = asyncio.get_running_loop()
+        await self._listen()
+
+    def stop(self):
+        """
+        Disconnects all clients and stops the broker
+        """
+        if self.loop is None:
+            return
+        if self.loopThread is not None:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.loopThread.join()
+            self.loop.close()
+            self.loopThread = None
+        else:
+            self.loop.create_task(self._shutdown())
+        self.loop = None
+
+    def getAddress(self):
+        """
+        Returns the host and the port the broker listens on
+        """
+        return self.server.sockets[0].getsockname()[:2]
+
+    def getStatistics(self):
+        """
+        Returns a dictionary with the number of clients, subscriptions and retained messages and the counters
+        """
+        return {
+            "clients": len(self.clients),
+            "subscriptions": sum([len(subscribers) for subscribers in self.subscribers.values()]),
+            "retained": len(self.retained),
+            "connects": self.connects,
+            "received": self.received,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "packetsReceived": self.packetsReceived,
+            "packetsSent": self.packetsSent,
+            "bytesReceived": self.bytesReceived,
+            "bytesSent": self.bytesSent,
+        }
+
+    def publish(self, topic: str, payload: bytes, qos: int = 0, retain: bool = False):
+        """
+        Publishes a message to the subscribers, must be called in the event loop
+        """
+        self.received += 1
+        if retain:
+            if len(payload) == 0:
+                self.retained.pop(topic, None)
+            else:
+                self.retained[topic] = (payload, qos)
+
+        for client, grantedQos in self._route(topic):
+            client.sendPublish(topic, payload, min(qos, grantedQos), False)
+
+    async def _listen(self):
+        """
+        Internal coroutine which opens the server socket
+        """
+        self.server = await asyncio.start_server(self._serve, self.host, self.port)
+        host, port = self.getAddress()
+        log(f"MQTT broker listening on {host}:{port}")
+
+    async def _shutdown(self):
+        """
+        Internal coroutine which closes the server socket and all connections
+        """
+        self.server.close()
+        for client in self.connections.keys():
+            client.will = None
+            client.close() # The reading of the connection fails, so its task ends
+        await asyncio.gather(*self.connections.values(), return_exceptions=True)
+        await self.server.wait_closed()
+        log("MQTT broker stopped")
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Internal coroutine which handles the packets of a connection until it is closed
+        """
+        client = BrokerClient(self, reader, writer)
+        self.connections[client] = asyncio.current_task()
+        try:
+            packetType, flags, body = await asyncio.wait_for(self._readPacket(client), self.connectTimeout)
+            if packetType != CONNECT:
+                raise MqttProtocolError("The first packet must be CONNECT")
+            if not self._connect(client, PacketReader(body)):
+                return
+
+            while True:
+                timeout = client.keepAlive * 1.5 if client.keepAlive > 0 else None
+                packetType, flags, body = await asyncio.wait_for(self._readPacket(client), timeout)
+                if packetType == DISCONNECT:
+                    reader = PacketReader(body)
+                    # An MQTT 5 client can ask to send its will anyway with the reason code 0x04
+                    if client.protocolLevel != MQTTv5 or reader.remaining() == 0 or reader.readByte() != 0x04:
+                        client.will = None
+                    return
+                self._handlePacket(client, packetType, flags, PacketReader(body))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass # The client closed the connection
+        except asyncio.TimeoutError:
+            log(f"MQTT client '{client.clientId}' {client.address} timed out", DEBUG)
+        except MqttProtocolError as ex:
+            log(f"MQTT client '{client.clientId}' {client.address} violated the protocol: {ex}", WARNING)
+        except Exception as ex:
+            log(f"Exception in MQTT broker for client '{client.clientId}': {ex}", ERROR)
+        finally:
+            self._disconnect(client)
+            del self.connections[client]
+
+    async def _readPacket(self, client: BrokerClient):
+        """
+        Internal coroutine which reads the next packet, returns the packet type, the flags and the body
+        """
+        header = (await client.reader.readexactly(1))[0]
+        length = 0
+        for shift in range(0, 28, 7):
+            byte = (await client.reader.readexactly(1))[0]
+            length += (byte & 0x7F) << shift
+            if byte & 0x80 == 0:
+                break
+        else:
+            raise MqttProtocolError("Invalid remaining length")
+        if length > self.maxPacketSize:
+            raise MqttProtocolError(f"Packet of {length} bytes is too large")
+
+        body = await client.reader.readexactly(length) if length > 0 else b""
+        self.packetsReceived += 1
+        self.bytesReceived += length + 2
+        return header >> 4, header & 0x0F, body
+
+    def _connect(self, client: BrokerClient, reader: PacketReader):
+        """
+        Internal function which handles the CONNECT packet, returns false if the connection was refused
+        """
+        protocolName = reader.readString()
+        client.protocolLevel = reader.readByte()
+        if protocolName != "MQTT" or client.protocolLevel not in (MQTTv311, MQTTv5):
+            # The version is not known, so the reply is in the format of MQTT 3.1.1
+            client.send(encodePacket(CONNACK, 0, b"\x00\x01"))
+            log(f"MQTT client {client.address} uses the unsupported protocol {protocolName} {client.protocolLevel}", WARNING)
+            return False
+
+        flags = reader.readByte()
+        client.keepAlive = reader.readUInt16()
+        if client.protocolLevel == MQTTv5:
+            reader.skipProperties()
+
+        client.clientId = reader.readString()
+        assignedId = client.clientId == ""
+        if assignedId:
+            client.clientId = f"base-station-broker-{next(self.clientIds)}"
+
+        if flags & 0x04:
+            if client.protocolLevel == MQTTv5:
+                reader.skipProperties()
+            willTopic = reader.readString()
+            willPayload = reader.readBinary()
+            client.will = (willTopic, willPayload, (flags >> 3) & 0x03, bool(flags & 0x20))
+
+        user = reader.readString() if flags & 0x80 else ""
+        password = reader.readBinary().decode("utf-8", "replace") if flags & 0x40 else ""
+        if self.user != "" and (user != self.user or password != self.password):
+            returnCode = 0x86 if client.protocolLevel == MQTTv5 else 0x04
+            self._sendConnack(client, returnCode, False)
+            log(f"MQTT client '{client.clientId}' {client.address} used a wrong user or password", WARNING)
+            return False
+
+        # A client which connects again with the same id replaces the old connection
+        previous = self.clients.get(client.clientId)
+        if previous is not None:
+            previous.will = None
+            self._disconnect(previous)
+            previous.close()
+
+        client.isConnected = True
+        self.clients[client.clientId] = client
+        self.connects += 1
+        self._sendConnack(client, 0x00, assignedId)
+        log(f"MQTT client '{client.clientId}' connected from {client.address}", DEBUG)
+        return True
+
+    def _sendConnack(self, client: BrokerClient, returnCode: int, assignedId: bool):
+        """
+        Internal function which sends the CONNACK packet, a session is never present
+        """
+        body = bytes([0, returnCode])
+        if client.protocolLevel == MQTTv5:
+            properties = b"\x12" + encodeString(client.clientId) if assignedId else b""
+            body += encodeVarInt(len(properties)) + properties
+        client.send(encodePacket(CONNACK, 0, body))
+
+    def _disconnect(self, client: BrokerClient):
+        """
+        Internal function which removes the client and publishes its will
+        """
+        if not client.isConnected:
+            client.close()
+            return
+        client.isConnected = False
+        if self.clients.get(client.clientId) is client:
+            del self.clients[client.clientId]
+
+        for topicFilter in list(client.subscriptions.keys()):
+            self._removeSubscription(client, topicFilter)
+        client.close()
+
+        if client.will is not None:
+            topic, payload, qos, retain = client.will
+            client.will = None
+            log(f"Publishing the will of MQTT client '{client.clientId}' at {topic}", DEBUG)
+            self.publish(topic, payload, qos, retain)
+        log(f"MQTT client '{client.clientId}' disconnected", DEBUG)
+
+    def _handlePacket(self, client: BrokerClient, packetType: int, flags: int, reader: PacketReader):
+        """
+        Internal function which handles a packet of a connected client
+        """
+        if packetType == PUBLISH:
+            self._handlePublish(client, flags, reader)
+        elif packetType == PUBACK or packetType == PUBCOMP:
+            client.inflight.pop(reader.readUInt16(), None)
+        elif packetType == PUBREC:
+            packetId = reader.readUInt16()
+            client.send(encodePacket(PUBREL, 0x02, struct.pack("!H", packetId)))
+        elif packetType == PUBREL:
+            packetId = reader.readUInt16()
+            client.receivedQos2.discard(packetId)
+            client.send(encodePacket(PUBCOMP, 0, struct.pack("!H", packetId)))
+        elif packetType == SUBSCRIBE:
+            self._handleSubscribe(client, reader)
+        elif packetType == UNSUBSCRIBE:
+            self._handleUnsubscribe(client, reader)
+        elif packetType == PINGREQ:
+            client.send(encodePacket(PINGRESP, 0, b""))
+        else:
+            raise MqttProtocolError(f"Unexpected packet type {packetType}")
+
+    def _handlePublish(self, client: BrokerClient, flags: int, reader: PacketReader):
+        """
+        Internal function which routes a published message and acknowledges it depending on its QoS
+        """
+        qos = (flags >> 1) & 0x03
+        retain = bool(flags & 0x01)
+        topic = reader.readString()
+        if topic == "" or "+" in topic or "#" in topic or qos > 2:
+            raise MqttProtocolError(f"Invalid publish at '{topic}' with QoS {qos}")
+
+        packetId = reader.readUInt16() if qos > 0 else 0
+        if client.protocolLevel == MQTTv5:
+            reader.skipProperties()
+        payload = reader.readRest()
+
+        if qos == 0:
+            self.publish(topic, payload, qos, retain)
+        elif qos == 1:
+            self.publish(topic, payload, qos, retain)
+            client.send(encodePacket(PUBACK, 0, struct.pack("!H", packetId)))
+        else:
+            # A message sent again before PUBREL was received is only published once
+            if packetId not in client.receivedQos2:
+                client.receivedQos2.add(packetId)
+                self.publish(topic, payload, qos, retain)
+            client.send(encodePacket(PUBREC, 0, struct.pack("!H", packetId)))
+
+    def _handleSubscribe(self, client: BrokerClient, reader: PacketReader):
+        """
+        Internal function which adds the subscriptions and sends the retained messages matching them
+        """
+        packetId = reader.readUInt16()
+        if client.protocolLevel == MQTTv5:
+            reader.skipProperties()
+
+        returnCodes = bytearray()
+        newFilters = []
+        while reader.remaining() > 0:
+            topicFilter = reader.readString()
+            options = reader.readByte()
+            if not isValidTopicFilter(topicFilter):
+                returnCodes.append(0x8F if client.protocolLevel == MQTTv5 else 0x80)
+                continue
+            qos = min(options & 0x03, 2)
+            client.subscriptions[topicFilter] = qos
+            self.subscribers.setdefault(topicFilter, {})[client] = qos
+            returnCodes.append(qos)
+            newFilters.append(topicFilter)
+        if len(returnCodes) == 0:
+            raise MqttProtocolError("SUBSCRIBE without topic filter")
+        self.routeCache.clear()
+
+        body = struct.pack("!H", packetId)
+        if client.protocolLevel == MQTTv5:
+            body += b"\x00"
+        client.send(encodePacket(SUBACK, 0, body + bytes(returnCodes)))
+
+        for topic, (payload, qos) in self.retained.items():
+            for topicFilter in newFilters:
+                if topicMatches(topicFilter, topic):
+                    client.sendPublish(topic, payload, min(qos, client.subscriptions[topicFilter]), True)
+                    break
+
+    def _handleUnsubscribe(self, client: BrokerClient, reader: PacketReader):
+        """
+        Internal function which removes the subscriptions
+        """
+        packetId = reader.readUInt16()
+        if client.protocolLevel == MQTTv5:
+            reader.skipProperties()
+
+        reasonCodes = bytearray()
+        while reader.remaining() > 0:
+            topicFilter = reader.readString()
+            existed = topicFilter in client.subscriptions
+            self._removeSubscription(client, topicFilter)
+            reasonCodes.append(0x00 if existed else 0x11)
+
+        body = struct.pack("!H", packetId)
+        if client.protocolLevel == MQTTv5:
+            body += b"\x00" + bytes(reasonCodes)
+        client.send(encodePacket(UNSUBACK, 0, body))
+
+    def _removeSubscription(self, client: BrokerClient, topicFilter: str):
+        """
+        Internal function which removes a subscription of a client
+        """
+        client.subscriptions.pop(topicFilter, None)
+        subscribers = self.subscribers.get(topicFilter)
+        if subscribers is None:
+            return
+        subscribers.pop(client, None)
+        if len(subscribers) == 0:
+            del self.subscribers[topicFilter]
+        self.routeCache.clear()
+
+    def _route(self, topic: str):
+        """
+        Internal function which returns the clients subscribed to the topic with the highest granted QoS
+        """
+        route = self.routeCache.get(topic)
+        if route is not None:
+            return route
+
+        qosByClient: Dict[BrokerClient, int] = {}
+        for topicFilter, subscribers in self.subscribers.items():
+            if topicMatches(topicFilter, topic):
+                for client, qos in subscribers.items():
+                    qosByClient[client] = max(qos, qosByClient.get(client, 0))
+        route = list(qosByClient.items())
+
+        if len(self.routeCache) > 10000:
+            self.routeCache.clear() # Topics with ids in their names must not fill the memory
+        self.routeCache[topic] = route
+        return route
+
+def startEmbeddedBroker():
+    """
+    Starts the embedded broker of the base station and changes the MqttConnection to connect to it
+
+    The broker listens on MQTT_PORT of all interfaces, so the puzzles in the LAN can connect to it,
+    and uses MQTT_USER and MQTT_PW. Exits if the port is already in use
+    """
+    port = int(os.getenv("MQTT_PORT", "1883"))
+    broker = MqttBroker("0.0.0.0", port, os.getenv("MQTT_USER", ""), os.getenv("MQTT_PW", ""))
+    try:
+        broker.start()
+    except OSError as ex:
+        log(f"Could not start the embedded MQTT broker on port {port}: {ex}", ERROR)
+        exit(1)
+
+    MqttConnection.mqttBroker = "127.0.0.1"
+    MqttConnection.mqttPort = broker.getAddress()[1]
+    return broker
@@ -0,0 +1,654 @@
+import asyncio
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Dict
+
+import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+from .LatencyHistogram import LatencyHistogram
+from .Log import log, WARNING, ERROR
+
+def topicMatches(topicFilter: str, topic: str):
+    """
+    Returns true if the topic matches the topic filter
+
+    Most filters of the puzzles have no wildcards, which are compared directly, because
+    paho's topic_matches_sub is too slow to test hundreds of filters for every new topic
+    """
+    if "+" not in topicFilter and "#" not in topicFilter:
+        return topicFilter == topic
+    return mqtt.topic_matches_sub(topicFilter, topic)
+
+class MqttConnection():
+    """
+    Class holding the single connection of the process to the MQTT broker
+
+    Every CommunicationManager uses the shared connection returned by getSharedConnection(). Subscriptions are
+    reference counted, so a topic filter is only subscribed once at the broker no matter how many managers use it,
+    and received messages are fanned out to every manager whose filters match the topic.
+
+    The MQTT client is driven by an asyncio event loop, which runs in a separate thread when started with start()
+    or on the running loop when started with startAsync(). The connection is closed when the last user stops it.
+
+    Connecting never blocks the event loop: the socket is connected in another thread, and after a failed attempt or
+    a lost connection the next attempt is made after a growing delay. The session is kept by the broker for
+    sessionExpiryInterval seconds, so the messages of the subscriptions are queued by the broker while the connection
+    is lost. Messages published while the connection is lost are queued and sent in order after the reconnect,
+    and stop() waits until the published messages are acknowledged.
+    """
+
+    # Parameter which must be set only once, otherwise MQTT_BROKER, MQTT_PORT, MQTT_USER, MQTT_PW and MQTT_CLIENT_ID are used
+    mqttBroker: str | None = None
+    mqttPort: int | None = None
+    mqttUser: str | None = None
+    mqttPw: str | None = None
+    mqttClientId: str | None = None # With a fixed client id the session is also resumed after a restart
+
+    reconnectMinDelay: float = 0.5 # Seconds before the second attempt, doubled after every failed attempt
+    reconnectMaxDelay: float = 30
+    sessionExpiryInterval: int = 3600 # Seconds the broker keeps the session while the connection is lost
+    subscriptionQos: int = 2 # Brokers only queue messages with QoS 1 and 2 for a lost connection
+    outboundQueueSize: int = 1000 # Messages published while the connection is lost, the oldest are dropped when it is full
+    flushTimeout: float = 2 # Seconds stop() waits until the published messages are acknowledged
+    batchPublishes: bool = True # Messages published in the same tick are passed to the event loop at once
+
+    def __init__(self):
+        # Settings which are not set are read from the environment variables
+        if self.mqttBroker is None:
+            self.mqttBroker = os.getenv("MQTT_BROKER", "mqtt.eclipseprojects.io")
+        if self.mqttPort is None:
+            self.mqttPort = int(os.getenv("MQTT_PORT", "1883"))
+        if self.mqttUser is None:
+            self.mqttUser = os.getenv("MQTT_USER", "")
+        if self.mqttPw is None:
+            self.mqttPw = os.getenv("MQTT_PW", "")
+        if self.mqttClientId is None:
+            self.mqttClientId = os.getenv("MQTT_CLIENT_ID", "")
+
+        # The broker only resumes the session for the same client id, so an empty id can not be used
+        self.clientId = self.mqttClientId if self.mqttClientId != "" else f"base-station-{uuid.uuid4().hex[:12]}"
+        self.mqttc = self._createClient()
+
+        self.lock = threading.Lock()
+        self.users: int = 0
+        self.subscribers = [] # Objects with the functions deliver(topic, payload), connected(code) and disconnected(code)
+        self.subscriptionCounts: Dict[str, int] = {}
+        self.subscribersByFilter: Dict[str, list] = {}
+        self.routeCache: Dict[str, list] = {} # Subscribers by topic, cleared when the subscriptions change
+
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.loopThread: threading.Thread | None = None
+        self.socket = None
+        self.readingPaused: bool = False
+        self.pausingSubscribers = set()
+        self.miscTask: asyncio.Task | None = None
+        self.stopping: bool = False
+        self.isConnected: bool = False
+        self.connectCode = None
+
+        self.reconnectTask: asyncio.Task | None = None
+        self.failedAttempts: int = 0 # Attempts since the last established connection
+        self.disconnectTime: float | None = None
+        self.sessionPresent: bool = False
+        self.publishBatch = [] # (topic, message, qos, retain) published but not passed to the event loop yet
+        self.outbound = deque() # (topic, message, qos, retain) published while the connection is lost
+        self.pendingMids = set() # Ids of the published QoS 1 and 2 messages which are not acknowledged yet
+
+        # Counters
+        self.received: int = 0
+        self.delivered: int = 0
+        self.published: int = 0
+        self.publishBatches: int = 0
+        self.connectAttempts: int = 0
+        self.reconnects: int = 0
+        self.replayed: int = 0
+        self.outboundDropped: int = 0
+        self.reconnectTimes = LatencyHistogram() # Time from losing the connection until it is established again
+
+    def start(self):
+        """
+        Connects to the broker and runs the event loop in a separate thread, if this is the first user
+        """
+        with self.lock:
+            self.users += 1
+            if self.loop is not None:
+                return
+            self.loop = asyncio.new_event_loop()
+            self._connect()
+
+            self.loopThread = threading.Thread(target=self._runLoop, name="MqttConnection", daemon=True)
+            self.loopThread.start()
+
+    async def startAsync(self):
+        """
+        Connects to the broker on the running event loop, if this is the first user
+        """
+        with self.lock:
+            self.users += 1
+            if self.loop is not None:
+                return
+            self.loop = asyncio.get_running_loop()
+            self._connect()
+
+    def stop(self):
+        """
+        Disconnects from the broker and stops the event loop, if this was the last user
+        """
+        with self.lock:
+            if self.users == 0:
+                return
+            self.users -= 1
+            if self.users > 0:
+                return
+
+            loop = self.loop
+            loopThread = self.loopThread
+            self.loopThread = None
+
+        if loopThread is not None:
+            if loopThread is not threading.current_thread():
+                # Messages published right before stopping, like the last finished_ack, are still delivered
+                try:
+                    asyncio.run_coroutine_threadsafe(self._flush(), loop).result(self.flushTimeout + 1)
+                except (TimeoutError, RuntimeError):
+                    pass
+            loop.call_soon_threadsafe(self._shutdown, True)
+            if loopThread is not threading.current_thread():
+                loopThread.join()
+        else:
+            self._shutdown(False)
+
+    def addSubscriber(self, subscriber):
+        """
+        Registers an object which receives messages matching its subscriptions
+
+        If the connection is already established, subscriber.connected() is called right away
+        """
+        with self.lock:
+            self.subscribers.append(subscriber)
+            isConnected = self.isConnected
+
+        if isConnected:
+            self.callInLoop(subscriber.connected, self.connectCode)
+
+    def removeSubscriber(self, subscriber):
+        """
+        Unregisters the object and removes its subscriptions
+        """
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+            topicFilters = [f for f, subscribers in self.subscribersByFilter.items() if subscriber in subscribers]
+
+        self.callInLoop(self.resumeReading, subscriber)
+        for topicFilter in topicFilters:
+            self.unsubscribe(topicFilter, subscriber)
+
+    def subscribe(self, topicFilter: str, subscriber):
+        """
+        Adds the topic filter for the subscriber, the broker subscription is only made for the first subscriber
+        """
+        with self.lock:
+            subscribers = self.subscribersByFilter.setdefault(topicFilter, [])
+            if subscriber in subscribers:
+                return
+            subscribers.append(subscriber)
+            self.routeCache.clear()
+
+            count = self.subscriptionCounts.get(topicFilter, 0)
+            self.subscriptionCounts[topicFilter] = count + 1
+
+        if count == 0:
+            self.callInLoop(self._subscribeAtBroker, topicFilter)
+
+    def unsubscribe(self, topicFilter: str, subscriber):
+        """
+        Removes the topic filter for the subscriber, the broker subscription is removed with the last subscriber
+        """
+        with self.lock:
+            subscribers = self.subscribersByFilter.get(topicFilter, [])
+            if subscriber not in subscribers:
+                return
+            subscribers.remove(subscriber)
+            self.routeCache.clear()
+
+            count = self.subscriptionCounts[topicFilter] - 1
+            if count == 0:
+                del self.subscriptionCounts[topicFilter]
+                del self.subscribersByFilter[topicFilter]
+            else:
+                self.subscriptionCounts[topicFilter] = count
+
+        if count == 0:
+            self.callInLoop(self._unsubscribeAtBroker, topicFilter)
+
+    def publish(self, topic, message, qos: int = 2, retain: bool = False):
+        """
+        Publish a message at topic, it is queued while the connection is lost
+        """
+        if not self.batchPublishes:
+            self.published += 1
+            self.callInLoop(self._publish, topic, message, qos, retain)
+            return
+
+        # Only the first message of a batch wakes up the event loop, the others are sent with it
+        with self.lock:
+            if self.loop is None:
+                return
+            self.published += 1
+            self.publishBatch.append((topic, message, qos, retain))
+            if len(self.publishBatch) > 1:
+                return
+        self.callInLoop(self._publishBatch)
+
+    def callInLoop(self, function, *args, **kwargs):
+        """
+        Executes the function in the event loop, because paho is not thread safe when an external event loop is used
+        """
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            return
+        loop.call_soon_threadsafe(lambda: function(*args, **kwargs))
+
+    def pauseReading(self, subscriber):
+        """
+        Stops reading from the socket, e.g. when the queue of a subscriber is full
+        """
+        self.pausingSubscribers.add(subscriber)
+        if self.socket is not None and not self.readingPaused:
+            self.loop.remove_reader(self.socket)
+            self.readingPaused = True
+
+    def resumeReading(self, subscriber):
+        """
+        Continues reading from the socket when no subscriber wants it to be paused anymore
+        """
+        self.pausingSubscribers.discard(subscriber)
+        if len(self.pausingSubscribers) == 0 and self.socket is not None and self.readingPaused:
+            self.loop.add_reader(self.socket, self.mqttc.loop_read)
+            self.readingPaused = False
+
+    def getStatistics(self):
+        """
+        Returns a dictionary with the counters of the connection
+        """
+        with self.lock:
+            return {
+                "subscribers": len(self.subscribers),
+                "subscriptions": dict(self.subscriptionCounts),
+                "received": self.received,
+                "delivered": self.delivered,
+                "published": self.published,
+                "publishBatches": self.publishBatches,
+                "isConnected": self.isConnected,
+                "sessionPresent": self.sessionPresent,
+                "connectAttempts": self.connectAttempts,
+                "reconnects": self.reconnects,
+                "reconnectMs": self.reconnectTimes.getSummary(),
+                "outboundQueue": len(self.outbound),
+                "replayed": self.replayed,
+                "outboundDropped": self.outboundDropped,
+                "unacknowledged": len(self.pendingMids),
+            }
+
+    def _route(self, topic: str):
+        """
+        Internal function which returns the subscribers of the topic
+        """
+        subscribers = self.routeCache.get(topic)
+        if subscribers is not None:
+            return subscribers
+
+        with self.lock:
+            subscribers = []
+            for topicFilter, filterSubscribers in self.subscribersByFilter.items():
+                if topicMatches(topicFilter, topic):
+                    for subscriber in filterSubscribers:
+                        if subscriber not in subscribers:
+                            subscribers.append(subscriber)
+            self.routeCache[topic] = subscribers
+        return subscribers
+
+    def _createClient(self):
+        """
+        Internal function which creates the paho client
+        """
+        client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2, client_id=self.clientId, protocol=mqtt.MQTTProtocolVersion.MQTTv5)
+
+        if self.mqttUser != "":
+            client.username_pw_set(self.mqttUser, self.mqttPw)
+
+        client.on_connect = self._onConnect
+        client.on_disconnect = self._onDisconnect
+        client.on_message = self._onMessage
+        client.on_publish = self._onPublish
+
+        # The socket is served by the asyncio event loop instead of the paho network thread
+        client.on_socket_open = self._onSocketOpen
+        client.on_socket_close = self._onSocketClose
+        client.on_socket_register_write = self._onSocketRegisterWrite
+        client.on_socket_unregister_write = self._onSocketUnregisterWrite
+        return client
+
+    def _subscribeAtBroker(self, topicFilter: str):
+        """
+        Internal function which subscribes the topic filter at the broker, must be called in the event loop
+        """
+        self.mqttc.subscribe(topicFilter, qos=self.subscriptionQos)
+
+    def _unsubscribeAtBroker(self, topicFilter: str):
+        """
+        Internal function which unsubscribes the topic filter at the broker, must be called in the event loop
+        """
+        self.mqttc.unsubscribe(topicFilter)
+
+    def _publishBatch(self):
+        """
+        Internal function which publishes the messages of the current batch, must be called in the event loop
+        """
+        with self.lock:
+            batch = self.publishBatch
+            self.publishBatch = []
+        self.publishBatches += 1
+        for topic, message, qos, retain in batch:
+            self._publish(topic, message, qos, retain)
+
+    def _publish(self, topic, message, qos: int, retain: bool):
+        """
+        Internal function which sends the message or queues it while the connection is lost, must be called in the event loop
+        """
+        if self.isConnected and len(self.outbound) == 0:
+            self._send(topic, message, qos, retain)
+            return
+
+        if len(self.outbound) >= self.outboundQueueSize:
+            self.outbound.popleft()
+            self.outboundDropped += 1
+        self.outbound.append((topic, message, qos, retain))
+
+    def _send(self, topic, message, qos: int, retain: bool):
+        """
+        Internal function which passes the message to paho, must be called in the event loop
+        """
+        info = self.mqttc.publish(topic, message, qos=qos, retain=retain)
+        if qos > 0 and not info.is_published():
+            self.pendingMids.add(info.mid)
+
+    def _replay(self):
+        """
+        Internal function which sends the messages published while the connection was lost, in order
+        """
+        while self.isConnected and len(self.outbound) > 0:
+            topic, message, qos, retain = self.outbound.popleft()
+            self.replayed += 1
+            self._send(topic, message, qos, retain)
+
+    async def _flush(self):
+        """
+        Internal coroutine which waits until the queued and unacknowledged messages are sent, at most flushTimeout seconds
+        """
+        endTime = time.perf_counter() + self.flushTimeout
+        while (len(self.outbound) > 0 or len(self.pendingMids) > 0) and time.perf_counter() < endTime:
+            await asyncio.sleep(0.01)
+
+    def _isInLoop(self):
+        """
+        Internal function which returns whether it is called in the event loop
+        """
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    def _connect(self):
+        """
+        Internal function which starts connecting to the broker as soon as the event loop runs
+        """
+        properties = Properties(PacketTypes.CONNECT)
+        properties.SessionExpiryInterval = self.sessionExpiryInterval
+        # Without a fixed client id there is no session of a previous run, only the reconnects resume the session
+        cleanStart = False if self.mqttClientId != "" else mqtt.MQTT_CLEAN_START_FIRST_ONLY
+        self.mqttc.connect_async(self.mqttBroker, self.mqttPort, 60, clean_start=cleanStart, properties=properties)
+        self.loop.call_soon_threadsafe(self._startReconnect)
+
+    def _startReconnect(self):
+        """
+        Internal function which starts the task connecting to the broker, must be called in the event loop
+        """
+        if self.stopping or self.loop is None:
+            return
+        if self.reconnectTask is None or self.reconnectTask.done():
+            self.reconnectTask = self.loop.create_task(self._reconnect())
+
+    async def _reconnect(self):
+        """
+        Internal coroutine which tries to connect to the broker until the socket is connected
+
+        The CONNACK of the broker is handled by _onConnect, if the broker refuses the connection _onDisconnect
+        starts the next attempt. The delay grows with every attempt until a connection is established.
+        """
+        loop = asyncio.get_running_loop()
+        while not self.stopping:
+            if self.failedAttempts > 0:
+                delay = min(self.reconnectMinDelay * 2 ** (self.failedAttempts - 1), self.reconnectMaxDelay)
+                await asyncio.sleep(delay * random.uniform(0.5, 1)) # Many clients must not reconnect at the same time
+            self.failedAttempts += 1
+            self.connectAttempts += 1
+            try:
+                # Resolving and connecting blocks, so it is done in another thread and the event loop keeps running
+                await loop.run_in_executor(None, self.mqttc.reconnect)
+                return
+            except Exception as ex:
+                log(f"Could not connect to {self.mqttBroker} @ {self.mqttPort} (attempt {self.failedAttempts}): {ex}", WARNING)
+
+    def _runLoop(self):
+        """
+        Internal function of the event loop thread
+        """
+        loop = self.loop
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+
+        # Let the cancelled tasks finish before closing the loop
+        pending = asyncio.all_tasks(loop)
+        loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        loop.close()
+
+    def _shutdown(self, stopLoop: bool):
+        """
+        Internal function which disconnects and stops the event loop, must be called in the event loop
+        """
+        self.stopping = True
+        if self.reconnectTask is not None:
+            self.reconnectTask.cancel()
+            self.reconnectTask = None
+        if len(self.outbound) > 0 or len(self.pendingMids) > 0:
+            log(f"Disconnecting with {len(self.outbound)} queued and {len(self.pendingMids)} unacknowledged messages", WARNING)
+        self.outbound.clear()
+        self.pendingMids.clear()
+        self.mqttc.disconnect()
+        self.mqttc.loop_write() # Sends the disconnect message and closes the socket
+
+        if self.socket is not None:
+            self.loop.remove_reader(self.socket)
+            self.loop.remove_writer(self.socket)
+            self.socket = None
+        if self.miscTask is not None:
+            self.miscTask.cancel()
+            self.miscTask = None
+        self.stopping = False
+
+        if stopLoop:
+            self.loop.stop()
+        with self.lock:
+            self.loop = None
+            self.publishBatch = []
+
+    async def _miscLoop(self):
+        """
+        Internal coroutine which handles keepalive and retries of paho
+        """
+        while self.mqttc.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+
+    def _onSocketOpen(self, client, userdata, sock):
+        """
+        Internal function which registers the socket in the event loop
+        """
+        if not self._isInLoop():
+            self.callInLoop(self._onSocketOpen, client, userdata, sock) # Called by reconnect() in the connecting thread
+            return
+        # The acks and replies are small packets, which must not wait for the delayed TCP ack of the previous packet
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.socket = sock
+        self.readingPaused = False
+        self.loop.add_reader(sock, client.loop_read)
+        if self.miscTask is None or self.miscTask.done():
+            self.miscTask = self.loop.create_task(self._miscLoop())
+
+    def _onSocketClose(self, client, userdata, sock):
+        """
+        Internal function which removes the socket from the event loop
+        """
+        if not self._isInLoop():
+            self.callInLoop(self._onSocketClose, client, userdata, sock)
+            return
+        self.loop.remove_reader(sock)
+        self.loop.remove_writer(sock)
+        self.socket = None
+
+    def _onSocketRegisterWrite(self, client, userdata, sock):
+        """
+        Internal function which is called when paho has data to send
+        """
+        if not self._isInLoop():
+            self.callInLoop(self._onSocketRegisterWrite, client, userdata, sock)
+            return
+        self.loop.add_writer(sock, self._write, sock)
+
+    def _write(self, sock):
+        """
+        Internal function which writes the queued packets, corked so the packets of a batch leave in one segment
+        """
+        cork = hasattr(socket, "TCP_CORK")
+        if cork:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 1)
+        self.mqttc.loop_write()
+        if cork and sock.fileno() != -1:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 0)
+
+    def _onSocketUnregisterWrite(self, client, userdata, sock):
+        """
+        Internal function which is called when paho has sent all data
+        """
+        if not self._isInLoop():
+            self.callInLoop(self._onSocketUnregisterWrite, client, userdata, sock)
+            return
+        self.loop.remove_writer(sock)
+
+    def _onConnect(self, client, userdata, flags, reason_code, properties):
+        """
+        Internal function which counts the reconnects and handles the established connection
+        """
+        if reason_code.is_failure:
+            log(f"Connection to {self.mqttBroker} @ {self.mqttPort} refused: {reason_code}", ERROR)
+        else:
+            self.failedAttempts = 0
+            self.sessionPresent = flags.session_present
+            if self.disconnectTime is not None:
+                duration = time.perf_counter() - self.disconnectTime
+                self.reconnects += 1
+                self.reconnectTimes.record(duration)
+                self.disconnectTime = None
+                log(f"Reconnected to {self.mqttBroker} @ {self.mqttPort} after {duration * 1000:.0f} ms, "
+                    f"session present: {self.sessionPresent}, {len(self.outbound)} messages to replay")
+            else:
+                log(f"Connection established to {self.mqttBroker} @ {self.mqttPort}, session present: {self.sessionPresent}")
+        self._connected(reason_code)
+
+    def _connected(self, reason_code):
+        """
+        Internal function which renews the subscriptions, informs the subscribers and sends the queued messages
+        """
+        with self.lock:
+            self.isConnected = not reason_code.is_failure
+            self.connectCode = reason_code
+            topicFilters = list(self.subscriptionCounts.keys())
+            subscribers = list(self.subscribers)
+
+        # The subscriptions made while the connection was lost are not known by the broker, even if the session is present
+        for topicFilter in topicFilters:
+            self._subscribeAtBroker(topicFilter)
+
+        for subscriber in subscribers:
+            subscriber.connected(reason_code)
+
+        if self.isConnected:
+            # paho resends its unacknowledged messages after this callback, the queued messages are newer
+            self.loop.call_soon(self._replay)
+
+    def _onDisconnect(self, client, userdata, disconnect_flags, reason_code, properties):
+        """
+        Internal function which starts reconnecting and informs the subscribers
+        """
+        with self.lock:
+            wasConnected = self.isConnected
+            self.isConnected = False
+            subscribers = list(self.subscribers)
+
+        if self.disconnectTime is None:
+            self.disconnectTime = time.perf_counter()
+        if not self.stopping:
+            if wasConnected:
+                log(f"Connection to {self.mqttBroker} @ {self.mqttPort} lost: {reason_code}", WARNING)
+            self._startReconnect()
+
+        for subscriber in subscribers:
+            subscriber.disconnected(reason_code)
+
+    def _onPublish(self, client, userdata, mid, reason_code, properties):
+        """
+        Internal function which is called when the broker acknowledged a message
+        """
+        self.pendingMids.discard(mid)
+
+    def _onMessage(self, client, userdata, msg):
+        """
+        Internal function which delivers the message to all matching subscribers
+        """
+        self.received += 1
+        payload = msg.payload.decode("utf-8")
+        for subscriber in self._route(msg.topic):
+            self.delivered += 1
+            subscriber.deliver(msg.topic, payload)
+
+sharedConnection: MqttConnection | None = None
+sharedConnectionLock = threading.Lock()
+
+def getSharedConnection():
+    """
+    Returns the MQTT connection shared by the whole process
+    """
+    global sharedConnection
+
+    with sharedConnectionLock:
+        if sharedConnection is None:
+            sharedConnection = MqttConnection()
+        return sharedConnection
+
+def setSharedConnection(connection):
+    """
+    Replaces the connection shared by the whole process, e.g. with a LoopbackConnection for a load test
+
+    Must be called before the first CommunicationManager is created
+    """
+    global sharedConnection
+
+    with sharedConnectionLock:
+        sharedConnection = connection
@@ -0,0 +1,199 @@
+import json
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+from typing import Dict
+
+from .LatencyHistogram import LatencyHistogram, RollingHistogram
+
+"""
+Latency and message rate telemetry of a CommunicationManager
+
+Three latencies are measured for every topic:
+    roundTrip   from sending a request until the reply is received, e.g. initialize -> initialize_ack
+    handling    from receiving a request until the reply is sent, e.g. finished -> finished_ack
+    broker      from sending any message until the broker delivers it back, because the topic is also subscribed
+
+If a request is sent again before the reply arrives, it is unknown which request is answered,
+so the round trip is not measured for this reply (Karn's algorithm) and counted as ambiguous instead.
+"""
+
+latencyKinds = ["roundTrip", "handling", "broker"]
+
+class RateCounter():
+    """
+    Class which counts events per second over the last slotCount seconds
+    """
+    def __init__(self, slotCount: int = 60):
+        self.slotCount = slotCount
+        self.slots = [0] * slotCount
+        self.slotSeconds = [0] * slotCount
+        self.total: int = 0
+
+    def add(self, now: float, count: int = 1):
+        """
+        Counts events which happened at now (time.monotonic())
+        """
+        second = int(now)
+        index = second % self.slotCount
+        if self.slotSeconds[index] != second:
+            self.slotSeconds[index] = second
+            self.slots[index] = 0
+        self.slots[index] += count
+        self.total += count
+
+    def getRate(self, now: float, seconds: int = 10):
+        """
+        Returns the events per second over the last completed seconds
+        """
+        seconds = min(seconds, self.slotCount - 1)
+        current = int(now)
+        count = sum([c for c, s in zip(self.slots, self.slotSeconds) if current - seconds <= s < current])
+        return count / seconds
+
+class TopicTelemetry():
+    """
+    Class holding the latencies and counters of a single topic
+    """
+    def __init__(self):
+        self.latencies: Dict[str, RollingHistogram] = {kind: RollingHistogram() for kind in latencyKinds}
+        self.sent: int = 0
+        self.received: int = 0
+        self.ambiguous: int = 0
+
+        self.pendingRequest: tuple | None = None # (reply, time of the last request, number of requests)
+        self.receivedRequests: Dict[str, float] = {} # Time of receiving by expected reply
+        self.pendingEchoes: Dict[str, deque] = {} # Send times by payload
+
+class NetworkTelemetry():
+    """
+    Class which measures the latencies and message rates of the messages sent and received by a CommunicationManager
+
+    sent() and received() can be called from any thread.
+    """
+
+    maxPendingEchoes: int = 100 # Messages per topic and payload waiting for the echo of the broker
+
+    def __init__(self, requestReplies: Dict[str, str]):
+        """
+        requestReplies maps the requests of the protocol to their replies, e.g. {"initialize": "initialize_ack"}
+        """
+        self.requestReplies = requestReplies
+
+        self.lock = threading.Lock()
+        self.startTime = time.monotonic()
+        self.topics: Dict[str, TopicTelemetry] = {}
+        self.sentRate = RateCounter()
+        self.receivedRate = RateCounter()
+
+    def sent(self, topic: str, payload: str):
+        """
+        Registers a message sent by the manager
+        """
+        now = time.monotonic()
+        with self.lock:
+            self.sentRate.add(now)
+            telemetry = self._getTopic(topic)
+            telemetry.sent += 1
+
+            echoes = telemetry.pendingEchoes.setdefault(payload, deque())
+            echoes.append(now)
+            if len(echoes) > self.maxPendingEchoes:
+                echoes.popleft()
+
+            reply = self.requestReplies.get(payload)
+            if reply is not None:
+                if telemetry.pendingRequest is not None and telemetry.pendingRequest[0] == reply:
+                    telemetry.pendingRequest = (reply, now, telemetry.pendingRequest[2] + 1)
+                else:
+                    telemetry.pendingRequest = (reply, now, 1)
+
+            requestTime = telemetry.receivedRequests.pop(payload, None)
+            if requestTime is not None:
+                telemetry.latencies["handling"].record(now - requestTime, now)
+
+    def received(self, topic: str, payload: str):
+        """
+        Registers a message received by the manager
+        """
+        now = time.monotonic()
+        with self.lock:
+            self.receivedRate.add(now)
+            telemetry = self._getTopic(topic)
+            telemetry.received += 1
+
+            # Own message delivered back by the broker
+            echoes = telemetry.pendingEchoes.get(payload)
+            if echoes is not None and len(echoes) > 0:
+                telemetry.latencies["broker"].record(now - echoes.popleft(), now)
+                return
+
+            if telemetry.pendingRequest is not None and telemetry.pendingRequest[0] == payload:
+                _, requestTime, requestCount = telemetry.pendingRequest
+                telemetry.pendingRequest = None
+                if requestCount == 1:
+                    telemetry.latencies["roundTrip"].record(now - requestTime, now)
+                else:
+                    telemetry.ambiguous += 1
+
+            reply = self.requestReplies.get(payload)
+            if reply is not None and reply not in telemetry.receivedRequests:
+                telemetry.receivedRequests[reply] = now
+
+    def getSnapshot(self):
+        """
+        Returns a dictionary with the message rates and the latency summaries in ms of the last minute by topic
+        and for all topics together
+        """
+        now = time.monotonic()
+        with self.lock:
+            combined = {kind: LatencyHistogram() for kind in latencyKinds}
+            topics = {}
+            for topic, telemetry in self.topics.items():
+                summaries = {}
+                for kind in latencyKinds:
+                    window = telemetry.latencies[kind].getWindow(now)
+                    combined[kind].merge(window)
+                    summaries[kind] = window.getSummary()
+                topics[topic] = {"sent": telemetry.sent, "received": telemetry.received, "ambiguous": telemetry.ambiguous, **summaries}
+
+            return {
+                "uptimeS": now - self.startTime,
+                "rates": {
+                    "sent": self.sentRate.total,
+                    "received": self.receivedRate.total,
+                    "sentPerS": self.sentRate.getRate(now),
+                    "receivedPerS": self.receivedRate.getRate(now),
+                },
+                "all": {kind: histogram.getSummary() for kind, histogram in combined.items()},
+                "topics": topics,
+            }
+
+    def export(self, path: Path):
+        """
+        Writes the snapshot and the buckets of the histograms with all values since the start to a JSON file
+        """
+        snapshot = self.getSnapshot()
+        with self.lock:
+            histograms = {topic: {kind: telemetry.latencies[kind].total.getBuckets() for kind in latencyKinds}
+                          for topic, telemetry in self.topics.items()}
+
+        with open(path, "w") as f:
+            json.dump({
+                "time": datetime.now().isoformat(timespec="seconds"),
+                "snapshot": snapshot,
+                "bucketUnit": "us",
+                "histograms": histograms, # Lists of [lowest value, highest value, count] by topic and kind
+            }, f, indent=4)
+
+    def _getTopic(self, topic: str):
+        """
+        Internal function which returns the telemetry of the topic, the lock must be held
+        """
+        telemetry = self.topics.get(topic)
+        if telemetry is None:
+            telemetry = TopicTelemetry()
+            self.topics[topic] = telemetry
+        return telemetry
@@ -1,25 +1,250 @@
-import os
+import math
+import threading
 from datetime import datetime
-from PySide6.QtWidgets import QApplication
-from PySide6.QtGui import QPalette
+from PySide6.QtWidgets import QApplication, QWidget
+from PySide6.QtCore import Qt, QPointF, QRect, QRectF, QSize, Signal
+from PySide6.QtGui import QColor, QImage, QPainter, QPalette, QPen
 
-os.environ["QT_API"] = "PySide6"
+class ScoreChart(QWidget):
+    """
+    Widget which draws the points over time as a line chart with a label for every event
+
+    Appended points are painted incrementally onto a cached image which also holds the axes, so only the region
+    of the new segment has to be repainted. The whole image is only redrawn when the widget is resized or a point
+    lies outside of the current axis ranges, which are then enlarged with some headroom.
+
+    appendPoint() can be called from any thread, the painting always happens in the GUI thread
+    """
+
+    pointsAppendedSignal = Signal() # Emitted from the appending thread, handled in the GUI thread
 
-import matplotlib.dates as md
-from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg
-from matplotlib.figure import Figure
+    marginLeft: int = 50
+    marginRight: int = 35
+    marginTop: int = 20
+    marginBottom: int = 30
+    tickCount: int = 5
+    initialTimeSpan: float = 60 # Seconds shown on the time axis before the first rescale
+
+    def __init__(self, textColor: QColor, backgroundColor: QColor):
+        super().__init__()
+        self.textColor = textColor
+        self.backgroundColor = backgroundColor
+        self.lineColor = QColor("#1f77b4")
+
+        self.timestamps = [] # Seconds since the epoch
+        self.points = []
+        self.events = []
 
-class MatplotlibCanvas(FigureCanvasQTAgg):
-    def __init__(self, width, height, dpi):
-        fig = Figure(figsize=(width, height), dpi=dpi)
-        self.axes = fig.add_subplot(111)
+        self.pending = [] # Points appended but not painted yet
+        self.pendingLock = threading.Lock()
 
-        fig.set_facecolor('none')
-        fig.tight_layout()
+        self.layer: QImage | None = None
+        self.timeRange = None # (start, end) in seconds since the epoch
+        self.pointsRange = None # (min, max)
 
-        super().__init__(fig)
+        self.setAttribute(Qt.WidgetAttribute.WA_TranslucentBackground)
+        self.pointsAppendedSignal.connect(self._applyPending)
 
-        self.setStyleSheet("background: transparent")
+    def sizeHint(self):
+        return QSize(500, 400)
+
+    def appendPoint(self, timestamp: datetime, points: int, event: str | None):
+        """
+        Adds a point to the chart, the event is drawn as label if it is not None
+        """
+        with self.pendingLock:
+            self.pending.append((timestamp.timestamp(), points, event))
+            # The first point of a batch emits the signal, the following points are painted with it
+            if len(self.pending) > 1:
+                return
+        self.pointsAppendedSignal.emit()
+
+    def paintEvent(self, event):
+        if self.layer is None or self.layer.size() != self.size():
+            self._rebuildLayer()
+
+        painter = QPainter(self)
+        painter.drawImage(event.rect(), self.layer, event.rect())
+        painter.end()
+
+    def resizeEvent(self, event):
+        self.layer = None
+        super().resizeEvent(event)
+
+    def _applyPending(self):
+        """
+        Internal function which paints the appended points onto the cached layer and repaints the changed region
+        """
+        with self.pendingLock:
+            pending = self.pending
+            self.pending = []
+        if len(pending) == 0:
+            return
+
+        needsRebuild = self.layer is None
+        for timestamp, points, event in pending:
+            self.timestamps.append(timestamp)
+            self.points.append(points)
+            self.events.append(event)
+            if self._extendRanges(timestamp, points):
+                needsRebuild = True
+
+        if needsRebuild:
+            self.layer = None
+            self.update()
+            return
+
+        dirty = QRect()
+        painter = self._beginLayerPainter()
+        for index in range(len(self.points) - len(pending), len(self.points)):
+            dirty = dirty.united(self._paintPoint(painter, index))
+        painter.end()
+
+        self.update(dirty)
+
+    def _extendRanges(self, timestamp: float, points: int):
+        """
+        Internal function which enlarges the axis ranges if the point lies outside, returns true if they were changed
+        """
+        changed = False
+
+        if self.timeRange is None:
+            self.timeRange = (timestamp, timestamp + self.initialTimeSpan)
+            changed = True
+        elif timestamp > self.timeRange[1]:
+            start = self.timeRange[0]
+            span = self.timeRange[1] - start
+            while start + span < timestamp:
+                span *= 2
+            self.timeRange = (start, start + span)
+            changed = True
+
+        if self.pointsRange is None:
+            self.pointsRange = (points - 10, points + 10)
+            changed = True
+        elif points < self.pointsRange[0] or points > self.pointsRange[1]:
+            low = min(points, self.pointsRange[0])
+            high = max(points, self.pointsRange[1])
+            headroom = (high - low) / 4
+            if points < self.pointsRange[0]:
+                low -= headroom
+            else:
+                high += headroom
+            self.pointsRange = (low, high)
+            changed = True
+
+        return changed
+
+    def _plotRect(self):
+        """
+        Internal function which returns the area inside of the axes
+        """
+        return QRectF(self.marginLeft, self.marginTop,
+                      max(1, self.width() - self.marginLeft - self.marginRight),
+                      max(1, self.height() - self.marginTop - self.marginBottom))
+
+    def _map(self, timestamp: float, points: float):
+        """
+        Internal function which maps a point to pixel coordinates
+        """
+        plot = self._plotRect()
+        timeStart, timeEnd = self.timeRange
+        pointsMin, pointsMax = self.pointsRange
+
+        x = plot.left() + (timestamp - timeStart) / (timeEnd - timeStart) * plot.width()
+        y = plot.bottom() - (points - pointsMin) / (pointsMax - pointsMin) * plot.height()
+        return QPointF(x, y)
+
+    def _beginLayerPainter(self):
+        """
+        Internal function which returns a painter for the cached layer
+        """
+        painter = QPainter(self.layer)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        return painter
+
+    def _rebuildLayer(self):
+        """
+        Internal function which draws the axes and all points onto a new layer
+        """
+        self.layer = QImage(self.size(), QImage.Format.Format_ARGB32_Premultiplied)
+        self.layer.fill(Qt.GlobalColor.transparent)
+        if self.timeRange is None:
+            return
+
+        painter = self._beginLayerPainter()
+        self._paintAxes(painter)
+        for index in range(len(self.points)):
+            self._paintPoint(painter, index)
+        painter.end()
+
+    def _paintAxes(self, painter: QPainter):
+        """
+        Internal function which draws the axes with their tick labels
+        """
+        plot = self._plotRect()
+        painter.setPen(QPen(self.textColor, 1))
+        painter.drawRect(plot)
+
+        metrics = painter.fontMetrics()
+        timeStart, timeEnd = self.timeRange
+        pointsMin, pointsMax = self.pointsRange
+
+        for i in range(self.tickCount + 1):
+            timestamp = timeStart + (timeEnd - timeStart) * i / self.tickCount
+            x = self._map(timestamp, pointsMin).x()
+            painter.drawLine(QPointF(x, plot.bottom()), QPointF(x, plot.bottom() + 4))
+            text = datetime.fromtimestamp(timestamp).strftime("%H:%M:%S")
+            painter.drawText(QPointF(x - metrics.horizontalAdvance(text) / 2, plot.bottom() + 6 + metrics.ascent()), text)
+
+        step = self._tickStep(pointsMax - pointsMin)
+        value = math.ceil(pointsMin / step) * step
+        while value <= pointsMax:
+            y = self._map(timeStart, value).y()
+            painter.drawLine(QPointF(plot.left() - 4, y), QPointF(plot.left(), y))
+            text = f"{value:g}"
+            painter.drawText(QPointF(plot.left() - 6 - metrics.horizontalAdvance(text), y + metrics.ascent() / 2 - 1), text)
+            value += step
+
+    def _tickStep(self, span: float):
+        """
+        Internal function which returns a round distance between two ticks of the points axis
+        """
+        rough = span / self.tickCount
+        magnitude = 10 ** math.floor(math.log10(rough))
+        for factor in [1, 2, 5, 10]:
+            if factor * magnitude >= rough:
+                return factor * magnitude
+        return 10 * magnitude
+
+    def _paintPoint(self, painter: QPainter, index: int):
+        """
+        Internal function which draws the segment ending at the point and its label, returns the painted region
+        """
+        point = self._map(self.timestamps[index], self.points[index])
+        dirty = QRectF(point, point)
+
+        if index > 0:
+            previous = self._map(self.timestamps[index - 1], self.points[index - 1])
+            painter.setPen(QPen(self.lineColor, 2))
+            painter.drawLine(previous, point)
+            dirty = dirty.united(QRectF(previous, point).normalized())
+
+        event = self.events[index]
+        if event is not None:
+            flags = Qt.AlignmentFlag.AlignCenter
+            textRect = painter.fontMetrics().boundingRect(QRect(0, 0, 1000, 1000), flags, event)
+            labelRect = QRectF(textRect).adjusted(-4, -3, 4, 3)
+            labelRect.moveCenter(QPointF(point.x(), point.y() - labelRect.height() / 2))
+
+            painter.setPen(QPen(self.textColor, 1))
+            painter.setBrush(self.backgroundColor)
+            painter.drawRoundedRect(labelRect, 4, 4)
+            painter.setBrush(Qt.BrushStyle.NoBrush)
+            painter.drawText(labelRect, flags, event)
+            dirty = dirty.united(labelRect)
+
+        return dirty.toAlignedRect().adjusted(-2, -2, 2, 2)
 
 class PointTracker():
     """
@@ -30,44 +255,28 @@ class PointTracker():
         self.points = []
         self.events = []
 
-        self.mlptCanvas = MatplotlibCanvas(width=5, height=4, dpi=100)
-        self.formatter = md.DateFormatter('%H:%M:%S')
-
         palette = QApplication.palette()
-        self.textColor = palette.color(QPalette.ColorRole.WindowText).name()
-        self.backgroundColor = palette.color(QPalette.ColorRole.Window).name()
-    
-    def setPoints(self, points: int, event: str):
+        self.textColor = palette.color(QPalette.ColorRole.WindowText)
+        self.backgroundColor = palette.color(QPalette.ColorRole.Window)
+
+        self.chart = ScoreChart(self.textColor, self.backgroundColor)
+
+    def setPoints(self, points: int, event: str, timestamp: datetime | None = None):
         """
         Call setPoints to register a new event
 
-        The time when the event happend will also be remenbered
+        The time when the event happend will also be remenbered, pass a timestamp to register a past event
         """
-        self.timestamps.append(datetime.now())
+        if timestamp is None:
+            timestamp = datetime.now()
+        self.timestamps.append(timestamp)
         self.points.append(points)
         self.events.append(event)
 
-        datenums = md.date2num(self.timestamps)
-
-        self.mlptCanvas.axes.clear()
-        self.mlptCanvas.axes.plot(datenums,self.points)
-
-        for x, y, text in zip(datenums, self.points, self.events):
-            if text is not None:
-                self.mlptCanvas.axes.text(x=x, y=y, s=text, horizontalalignment="center", color=self.textColor, bbox=dict(boxstyle="round", facecolor=self.backgroundColor, edgecolor=self.textColor))
-
-        self.mlptCanvas.draw()
+        self.chart.appendPoint(timestamp, points, event)
 
     def getPlot(self):
         """
-        Returns a FigureCanvasQTAgg widget which can be used within an QT application
-        """
-        self.mlptCanvas.axes.xaxis.set_major_formatter(self.formatter)
-        self.mlptCanvas.axes.set_facecolor('none')
-        self.mlptCanvas.axes.tick_params(colors=self.textColor)
-        self.mlptCanvas.axes.spines[:].set_color(self.textColor)
-        self.mlptCanvas.axes.yaxis.label.set_color(self.textColor)
-        self.mlptCanvas.axes.xaxis.label.set_color(self.textColor)
-        self.mlptCanvas.axes.title.set_color(self.textColor)
-    
-        return self.mlptCanvas
\ No newline at end of file
+        Returns a ScoreChart widget which can be used within an QT application
+        """
+        return self.chart
@@ -0,0 +1,233 @@
+import threading
+import time
+from typing import Dict, List
+
+from .CommunicationManager import CommunicationManager, onlineMessage, offlineMessage
+from .Log import log, ERROR, WARNING
+from .Puzzle import Puzzle
+from .TimerWheel import TimerWheel
+
+class PresenceTracker():
+    """
+    Class which tracks whether the puzzles are online, from their retained status messages and their last will
+
+    Every puzzle publishes "online" retained at <topic>/status after connecting and registers "offline" as its
+    last will, which the broker publishes when the connection of the puzzle is lost. As both are retained, the status
+    of every puzzle is known right after subscribing, without a round trip to the puzzles.
+
+    Besides the status, the time every puzzle was last seen on any topic is tracked. A puzzle which has not been seen
+    for silentAfter seconds is reported as silent. The timeouts are kept in a TimerWheel, so a message only costs a
+    dictionary update and the wheel is touched at most once per silentAfter seconds and puzzle.
+
+    The listeners are called with the name of the puzzle and its presence (see getPresence()) whenever the status
+    or the silent flag of a puzzle changes, on the callback thread of the CommunicationManager or of the tracker.
+
+    Usage:
+        presence = PresenceTracker(puzzles)
+        presence.addListener(lambda name, presence: print(name, presence["status"]))
+        presence.start() # Subscribes to the status topics of the puzzles
+        ...
+        presence.seen("Tilt Maze") # For the other messages of a puzzle
+        ...
+        presence.stop()
+
+    A GameSession already receives the status topics with its own subscriptions, so it starts the tracker
+    with subscribe=False and passes the messages to statusReceived() and seen().
+    """
+
+    silentAfter: float = 120 # Seconds without any message until a puzzle is reported as silent
+
+    def __init__(self, puzzles: List[Puzzle], silentAfter: float | None = None):
+        self.silentAfter = silentAfter if silentAfter is not None else self.silentAfter
+
+        self.lock = threading.Lock()
+        self.puzzlesByStatusTopic: Dict[str, Puzzle] = {}
+        self.status: Dict[str, str] = {} # "unknown", "online" or "offline" by puzzle name
+        self.lastSeen: Dict[str, float] = {} # time.monotonic() of the last message by puzzle name
+        self.silent = set() # Names of the puzzles which have not been seen for silentAfter seconds
+        self.wheel = TimerWheel(resolution=1, now=time.monotonic())
+
+        self.listeners = []
+        self.communicationManager: CommunicationManager | None = None
+        self.thread: threading.Thread | None = None
+        self.stopEvent = threading.Event()
+        self.running: bool = False
+
+        self.setPuzzles(puzzles)
+
+    def addListener(self, listener):
+        """
+        Adds a function which is called with the name and the presence of a puzzle when its presence changed,
+        it must not block
+        """
+        self.listeners.append(listener)
+
+    def removeListener(self, listener):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def setPuzzles(self, puzzles: List[Puzzle]):
+        """
+        Sets the puzzles which are tracked, the presence of puzzles which were tracked before is kept
+        """
+        with self.lock:
+            self.puzzlesByStatusTopic = {p.mqttTopicStatus: p for p in puzzles}
+            for puzzle in puzzles:
+                self.status.setdefault(puzzle.name, "unknown")
+
+        if self.communicationManager is not None:
+            for topic in self.puzzlesByStatusTopic:
+                self.communicationManager.subscribe(topic)
+
+    def start(self, subscribe: bool = True):
+        """
+        Starts the thread which detects silent puzzles, and subscribes to the status topics of the puzzles
+        """
+        with self.lock:
+            if self.running:
+                return
+            self.running = True
+            self.stopEvent.clear()
+
+        if subscribe:
+            self.communicationManager = CommunicationManager()
+            self.communicationManager.onMessage = self.onMessage
+            self.communicationManager.start()
+            for topic in self.puzzlesByStatusTopic:
+                self.communicationManager.subscribe(topic)
+
+        self.thread = threading.Thread(target=self._run, name="PresenceTracker", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops the thread and the subscriptions of the tracker
+        """
+        with self.lock:
+            if not self.running:
+                return
+            self.running = False
+        self.stopEvent.set()
+
+        if self.communicationManager is not None:
+            self.communicationManager.stop()
+            self.communicationManager = None
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+
+    def isOnline(self, puzzleName: str):
+        """
+        Returns true if the last status of the puzzle was online
+        """
+        return self.status.get(puzzleName) == "online"
+
+    def getPresence(self, puzzleName: str):
+        """
+        Returns a dictionary with the status ("unknown", "online" or "offline") of the puzzle,
+        the seconds since it was last seen or None and whether it is silent
+        """
+        with self.lock:
+            return self._getPresence(puzzleName, time.monotonic())
+
+    def getAll(self):
+        """
+        Returns the presence of every tracked puzzle by puzzle name
+        """
+        now = time.monotonic()
+        with self.lock:
+            return {p.name: self._getPresence(p.name, now) for p in self.puzzlesByStatusTopic.values()}
+
+    # Be carefull
+    # This is executed in another thread
+    def onMessage(self, topic: str, payload: str):
+        """
+        Internal function needed for the CommunicationManager
+        """
+        puzzle = self.puzzlesByStatusTopic.get(topic)
+        if puzzle is not None:
+            self.statusReceived(puzzle.name, payload)
+
+    def statusReceived(self, puzzleName: str, payload: str):
+        """
+        Call this function with the payload of a message on the status topic of the puzzle
+        """
+        if payload not in (onlineMessage, offlineMessage):
+            # An empty retained message only clears the status at the broker
+            if payload != "":
+                log(f"Unknown status of '{puzzleName}': {payload}", WARNING)
+            return
+
+        now = time.monotonic()
+        with self.lock:
+            changed = self.status.get(puzzleName) != payload
+            self.status[puzzleName] = payload
+            if payload == onlineMessage:
+                changed = self._seen(puzzleName, now) or changed
+            else:
+                # The broker has already noticed that the puzzle is gone, so it is not reported as silent as well
+                self.wheel.cancel(puzzleName)
+            presence = self._getPresence(puzzleName, now)
+
+        if changed:
+            self._notify(puzzleName, presence)
+
+    def seen(self, puzzleName: str):
+        """
+        Call this function for every message of the puzzle, so it is not reported as silent
+        """
+        now = time.monotonic()
+        with self.lock:
+            changed = self._seen(puzzleName, now)
+            presence = self._getPresence(puzzleName, now) if changed else None
+
+        if changed:
+            self._notify(puzzleName, presence)
+
+    def _seen(self, puzzleName: str, now: float):
+        """
+        Internal function which updates the last seen time, returns true if the puzzle was silent before
+        """
+        self.lastSeen[puzzleName] = now
+        # A scheduled timeout is not moved, the expired timeout is rescheduled from the last seen time instead
+        if puzzleName not in self.wheel:
+            self.wheel.schedule(puzzleName, now + self.silentAfter)
+        if puzzleName in self.silent:
+            self.silent.discard(puzzleName)
+            return True
+        return False
+
+    def _getPresence(self, puzzleName: str, now: float):
+        lastSeen = self.lastSeen.get(puzzleName)
+        return {
+            "status": self.status.get(puzzleName, "unknown"),
+            "lastSeenS": now - lastSeen if lastSeen is not None else None,
+            "isSilent": puzzleName in self.silent,
+        }
+
+    def _notify(self, puzzleName: str, presence: dict):
+        for listener in list(self.listeners):
+            try:
+                listener(puzzleName, presence)
+            except Exception as ex:
+                log(f"Exception in presence listener {listener}: {ex}", ERROR)
+
+    def _run(self):
+        """
+        Internal function of the thread, which advances the timer wheel once per second
+        """
+        while not self.stopEvent.wait(self.wheel.resolution):
+            now = time.monotonic()
+            changes = []
+            with self.lock:
+                for puzzleName in self.wheel.advance(now):
+                    deadline = self.lastSeen[puzzleName] + self.silentAfter
+                    if deadline > now:
+                        self.wheel.schedule(puzzleName, deadline)
+                        continue
+                    self.silent.add(puzzleName)
+                    changes.append((puzzleName, self._getPresence(puzzleName, now)))
+
+            for puzzleName, presence in changes:
+                log(f"'{puzzleName}' has not been seen for {presence['lastSeenS']:.0f} s")
+                self._notify(puzzleName, presence)
@@ -4,6 +4,33 @@ from pathlib import Path
 
 from .Hint import Hint
 
+# Schemas of the puzzle config files, by key the expected type and whether the key is required
+puzzleSchema = {
+    "name": (str, True),
+    "description": (str, True),
+    "points": (int, True),
+    "reveal_after_finish": (str, False),
+    "hints": (list, True),
+    "mqtt": (dict, True),
+}
+hintSchema = {
+    "name": (str, True),
+    "text": (str, True),
+    "points": (int, True),
+}
+mqttSchema = {
+    "topic": (str, True),
+}
+
+class PuzzleConfigError(Exception):
+    """
+    Exception raised when a puzzle config file can not be read or does not match the schema
+    """
+    def __init__(self, path: Path, errors: List[str]):
+        self.path = path
+        self.errors = errors
+        super().__init__(f"Invalid puzzle config '{path}': {'; '.join(errors)}")
+
 class Puzzle():
     """
     Class representing a Puzzle
@@ -22,38 +49,61 @@ class Puzzle():
         self.isInitialized: bool = False
         self.isSelectedForPlay: bool = False
         self.nextHint = 1
+        self.configHash: str | None = None # Hash of the config file, set by the PuzzleCatalog
 
         self.mqttTopicGeneral: str = ""
         self.mqttTopicPoints: str = ""
+        self.mqttTopicStatus: str = "" # Retained online / offline status, see PresenceTracker
     
-def checkAllPuzzlesCompleted(puzzleList: List[Puzzle]):
+def checkFields(data: dict, schema: dict, prefix: str):
     """
-    Pass a lit of puzzles and returns true if every puzzle is completed
+    Returns a list of errors for the keys of data which are missing or have the wrong type
     """
-    puzzle: Puzzle
-    for puzzle in puzzleList:
-        if not puzzle.isCompleted:
-            return False
-    return True
+    errors = []
+    for key, (expectedType, isRequired) in schema.items():
+        if key not in data:
+            if isRequired:
+                errors.append(f"'{prefix}{key}' is missing")
+            continue
+        value = data[key]
+        # bool is a subclass of int, but true is not a valid number of points
+        if not isinstance(value, expectedType) or (expectedType is int and isinstance(value, bool)):
+            errors.append(f"'{prefix}{key}' must be of type {expectedType.__name__}, not {type(value).__name__}")
+    return errors
 
-def checkAllPuzzlesInitialized(puzzleList: List[Puzzle]):
+def validatePuzzleConfig(data):
     """
-    Pass a lit of puzzles and returns true if every puzzle is initialized
+    Returns a list of errors of the data read from a puzzle config file, the list is empty if the data is valid
     """
-    puzzle: Puzzle
-    for puzzle in puzzleList:
-        if not puzzle.isInitialized:
-            return False
-    return True
+    if not isinstance(data, dict):
+        return ["the config must be a JSON object"]
 
-def getPuzzleFromFile(filePath: Path):
+    errors = checkFields(data, puzzleSchema, "")
+    isValidType = lambda key, expectedType: isinstance(data.get(key), expectedType)
+
+    if isValidType("name", str) and data["name"].strip() == "":
+        errors.append("'name' must not be empty")
+    if isValidType("points", int) and data["points"] < 0:
+        errors.append("'points' must not be negative")
+
+    if isValidType("hints", list):
+        for index, hint in enumerate(data["hints"]):
+            if not isinstance(hint, dict):
+                errors.append(f"'hints[{index}]' must be an object")
+                continue
+            errors += checkFields(hint, hintSchema, f"hints[{index}].")
+
+    if isValidType("mqtt", dict):
+        errors += checkFields(data["mqtt"], mqttSchema, "mqtt.")
+        topic = data["mqtt"].get("topic")
+        if isinstance(topic, str) and (topic == "" or "+" in topic or "#" in topic):
+            errors.append("'mqtt.topic' must not be empty or contain the wildcards + and #")
+    return errors
+
+def getPuzzleFromData(data: dict):
     """
-    Provide a file path to a json file and returns the data from the json file as a puzzle object 
+    Returns a puzzle object from the validated data of a puzzle config file
     """
-    data: dict
-    with open(filePath) as f:
-        data = json.load(f)
-    
     p = Puzzle()
     p.name = data["name"]
     p.description = data["description"]
@@ -65,6 +115,7 @@ def getPuzzleFromFile(filePath: Path):
     p.mqttTopic = data["mqtt"]["topic"]
     p.mqttTopicGeneral = p.mqttTopic + "/general"
     p.mqttTopicPoints = p.mqttTopic + "/points"
+    p.mqttTopicStatus = p.mqttTopic + "/status"
 
     for hint in data["hints"]:
         h = Hint()
@@ -75,6 +126,23 @@ def getPuzzleFromFile(filePath: Path):
         p.hints.append(h)
     return p
 
+def getPuzzleFromFile(filePath: Path):
+    """
+    Provide a file path to a json file and returns the data from the json file as a puzzle object
+
+    Raises a PuzzleConfigError if the file is not valid JSON or does not match the schema
+    """
+    try:
+        with open(filePath) as f:
+            data = json.load(f)
+    except (OSError, ValueError) as ex:
+        raise PuzzleConfigError(filePath, [str(ex)])
+
+    errors = validatePuzzleConfig(data)
+    if len(errors) > 0:
+        raise PuzzleConfigError(filePath, errors)
+    return getPuzzleFromData(data)
+
 def getAllPuzzlesFromFolder(folderPath: Path):
     """
     Provide a folder path where only json files are located and returns the data from the json files as a list of puzzles 
@@ -0,0 +1,296 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict
+
+from .Log import log, WARNING
+from .Puzzle import Puzzle, PuzzleConfigError, getPuzzleFromData, validatePuzzleConfig
+
+"""
+Catalog of the puzzle config files in a folder
+
+The parsed and validated configs are cached in an index file, keyed by the file name with the modification time,
+the size and the SHA-1 hash of the file. On the next start only files whose modification time or size changed
+are read again, and only files whose content changed are parsed and validated again.
+
+While the catalog is watched, the folder is checked every pollInterval seconds and only the changed files are reloaded.
+
+Usage:
+    catalog = PuzzleCatalog(Path(".", "Puzzles"))
+    puzzles = catalog.load()
+    catalog.getErrors() # Invalid files by file name
+
+    catalog.onChange = lambda puzzles: print(puzzles)
+    catalog.start()
+    ...
+    catalog.stop()
+"""
+
+defaultIndexPath: Path = Path(".", "puzzle_index.json")
+indexVersion: int = 1
+
+class PuzzleCatalog():
+    """
+    Class which loads the puzzles from a folder, caches them in an index file and reloads changed files
+    """
+
+    pollInterval: float = 1 # Seconds between two checks of the folder while watching
+
+    def __init__(self, folderPath: Path, indexPath: Path | None = defaultIndexPath):
+        """
+        Pass None as indexPath to not use an index file
+        """
+        self.folderPath = folderPath
+        self.indexPath = indexPath
+
+        self.lock = threading.Lock()
+        self.entries: Dict[str, dict] = {} # Index entries by file name with mtime, size, hash and the data or the errors
+        self.puzzlesByFile: Dict[str, Puzzle] = {}
+        self.errors: Dict[str, PuzzleConfigError] = {}
+
+        self.onChange = None # Callback function called with the puzzles after files were changed, called on the watcher thread
+
+        self.condition = threading.Condition()
+        self.thread: threading.Thread | None = None
+        self.running: bool = False
+
+        # Counters of the last load or reload
+        self.statistics = {"files": 0, "unchanged": 0, "cached": 0, "parsed": 0, "invalid": 0, "durationMs": 0}
+
+    def load(self):
+        """
+        Loads all puzzles, using the index file if it exists, and returns them sorted by name
+        """
+        if not self.folderPath.exists():
+            raise Exception(f"Path '{self.folderPath.absolute()}' does not exist")
+
+        self._readIndex()
+        self.reload()
+        s = self.statistics
+        log(f"Loaded {s['files']} puzzle configs in {s['durationMs']:.1f} ms ({s['cached']} from the index, {s['parsed']} parsed, {s['invalid']} invalid)")
+        return self.getPuzzles()
+
+    def getPuzzles(self):
+        """
+        Returns the valid puzzles sorted by name
+        """
+        with self.lock:
+            return sorted(self.puzzlesByFile.values(), key=lambda p: p.name)
+
+    def getErrors(self):
+        """
+        Returns the PuzzleConfigErrors of the invalid files by file name
+        """
+        with self.lock:
+            return dict(self.errors)
+
+    def getStatistics(self):
+        """
+        Returns a dictionary with the counters of the last load or reload
+        """
+        with self.lock:
+            return dict(self.statistics)
+
+    def reload(self):
+        """
+        Reloads the files which were added, changed or removed since the last load, returns true if something changed
+        """
+        startTime = time.perf_counter()
+        statistics = {"files": 0, "unchanged": 0, "cached": 0, "parsed": 0, "invalid": 0}
+
+        try:
+            files = {e.name: e for e in os.scandir(self.folderPath) if e.is_file() and e.name.endswith(".json")}
+        except OSError as ex:
+            log(f"Cannot read the puzzle folder '{self.folderPath}': {ex}", WARNING)
+            return False
+
+        changed = False
+        with self.lock:
+            for name in list(self.entries.keys()):
+                if name not in files:
+                    del self.entries[name]
+                    changed = True
+
+            for name, dirEntry in files.items():
+                statistics["files"] += 1
+                stat = dirEntry.stat()
+                entry = self.entries.get(name)
+                isLoaded = name in self.puzzlesByFile or name in self.errors
+
+                if entry is not None and entry["mtime"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+                    if isLoaded:
+                        statistics["unchanged"] += 1
+                        continue
+                    # Known from the index, the file does not need to be read
+                    statistics["cached"] += 1
+                    changed = True
+                    continue
+
+                try:
+                    content = Path(dirEntry.path).read_bytes()
+                except OSError as ex:
+                    self.entries[name] = {"mtime": stat.st_mtime_ns, "size": stat.st_size, "hash": None, "errors": [str(ex)]}
+                    changed = True
+                    continue
+
+                fileHash = hashlib.sha1(content).hexdigest()
+                if entry is not None and entry["hash"] == fileHash:
+                    # Only touched, the content did not change
+                    entry["mtime"] = stat.st_mtime_ns
+                    if isLoaded:
+                        statistics["unchanged"] += 1
+                    else:
+                        statistics["cached"] += 1
+                    changed = changed or not isLoaded
+                    continue
+
+                statistics["parsed"] += 1
+                self.entries[name] = self._parse(content, stat, fileHash)
+                changed = True
+
+            if changed:
+                self._buildPuzzles()
+            statistics["invalid"] = len(self.errors)
+            statistics["durationMs"] = (time.perf_counter() - startTime) * 1000
+            self.statistics = statistics
+
+        if changed:
+            self._writeIndex()
+        return changed
+
+    def start(self):
+        """
+        Starts watching the folder for changed files
+        """
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self._run, name="PuzzleCatalog", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops watching the folder
+        """
+        with self.condition:
+            if not self.running:
+                return
+            self.running = False
+            self.condition.notify()
+        if self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def _run(self):
+        """
+        Internal function of the watcher thread
+        """
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: not self.running, timeout=self.pollInterval)
+                if not self.running:
+                    return
+
+            if self.reload():
+                s = self.getStatistics()
+                log(f"Reloaded puzzle configs ({s['parsed']} parsed, {s['invalid']} invalid)")
+                if self.onChange is not None:
+                    self.onChange(self.getPuzzles())
+
+    def _parse(self, content: bytes, stat, fileHash: str):
+        """
+        Internal function which parses and validates the content of a file and returns its index entry
+        """
+        entry = {"mtime": stat.st_mtime_ns, "size": stat.st_size, "hash": fileHash}
+        try:
+            data = json.loads(content)
+        except ValueError as ex:
+            entry["errors"] = [f"invalid JSON: {ex}"]
+            return entry
+
+        errors = validatePuzzleConfig(data)
+        if len(errors) > 0:
+            entry["errors"] = errors
+        else:
+            entry["data"] = data
+        return entry
+
+    def _buildPuzzles(self):
+        """
+        Internal function which creates the puzzles of new or changed entries and checks for duplicates, the lock must be held
+        """
+        puzzlesByFile = {}
+        errors = {}
+        names = {}
+        topics = {}
+
+        for name in sorted(self.entries.keys()):
+            entry = self.entries[name]
+            path = Path(self.folderPath, name)
+            if "errors" in entry:
+                errors[name] = PuzzleConfigError(path, entry["errors"])
+                continue
+
+            # Unchanged files keep their puzzle object
+            puzzle = self.puzzlesByFile.get(name)
+            if puzzle is None or puzzle.configHash != entry["hash"]:
+                puzzle = getPuzzleFromData(entry["data"])
+                puzzle.configHash = entry["hash"]
+
+            duplicates = []
+            if puzzle.name in names:
+                duplicates.append(f"the name '{puzzle.name}' is already used by '{names[puzzle.name]}'")
+            if puzzle.mqttTopic in topics:
+                duplicates.append(f"the topic '{puzzle.mqttTopic}' is already used by '{topics[puzzle.mqttTopic]}'")
+            if len(duplicates) > 0:
+                errors[name] = PuzzleConfigError(path, duplicates)
+                continue
+
+            names[puzzle.name] = name
+            topics[puzzle.mqttTopic] = name
+            puzzlesByFile[name] = puzzle
+
+        for name, error in errors.items():
+            if name not in self.errors or self.errors[name].errors != error.errors:
+                log(str(error), WARNING)
+
+        self.puzzlesByFile = puzzlesByFile
+        self.errors = errors
+
+    def _readIndex(self):
+        """
+        Internal function which reads the entries from the index file, an invalid index is ignored
+        """
+        if self.indexPath is None or not self.indexPath.exists():
+            return
+        try:
+            with open(self.indexPath) as f:
+                index = json.load(f)
+        except (OSError, ValueError) as ex:
+            log(f"Ignoring the puzzle index '{self.indexPath}': {ex}", WARNING)
+            return
+
+        if index.get("version") != indexVersion or index.get("folder") != str(self.folderPath.resolve()):
+            return
+        with self.lock:
+            self.entries = index["files"]
+
+    def _writeIndex(self):
+        """
+        Internal function which writes the entries to the index file, replacing it at once so it is never incomplete
+        """
+        if self.indexPath is None:
+            return
+        with self.lock:
+            index = {"version": indexVersion, "folder": str(self.folderPath.resolve()), "files": self.entries}
+            content = json.dumps(index, separators=(",", ":"))
+
+        temporaryPath = Path(f"{self.indexPath}.tmp")
+        try:
+            temporaryPath.write_text(content)
+            os.replace(temporaryPath, self.indexPath)
+        except OSError as ex:
+            log(f"Cannot write the puzzle index '{self.indexPath}': {ex}", WARNING)
@@ -0,0 +1,132 @@
+from .MqttConnection import MqttConnection
+
+class RelayConnection(MqttConnection):
+    """
+    Stand-in for the MqttConnection in a worker process of the RoomSupervisor
+
+    The worker has no connection to the broker. Subscriptions, publishes and the flow control are passed as messages
+    to the supervisor by the send function, which uses the single broker connection of the supervisor.
+    The supervisor relays the received messages and the state of its connection back, which are passed to
+    receive(), relayConnected() and relayDisconnected().
+
+    Usage:
+        connection = RelayConnection(pipe.send)
+        setSharedConnection(connection) # Every CommunicationManager of the worker uses the relay now
+        ...
+        connection.receive(topic, payload) # For every message relayed by the supervisor
+    """
+
+    def __init__(self, send):
+        """
+        send is called with the tuples for the supervisor from any thread, it must be thread safe
+        """
+        super().__init__()
+        self.send = send
+
+    def publish(self, topic, message, qos: int = 2, retain: bool = False):
+        """
+        Publish a message at topic
+        """
+        self.published += 1
+        self.send(("publish", topic, str(message), qos, retain))
+
+    def receive(self, topic: str, payload: str):
+        """
+        Delivers a message relayed by the supervisor, can be called from any thread
+        """
+        self.callInLoop(self._deliver, topic, payload)
+
+    def relayConnected(self, code):
+        """
+        The connection of the supervisor to the broker is established, can be called from any thread
+        """
+        self.callInLoop(self._relayConnected, code)
+
+    def relayDisconnected(self, code):
+        """
+        The connection of the supervisor to the broker is lost, can be called from any thread
+        """
+        self.callInLoop(self._relayDisconnected, code)
+
+    def pauseReading(self, subscriber):
+        """
+        Asks the supervisor to stop relaying messages, e.g. when the queue of a subscriber is full
+        """
+        self.pausingSubscribers.add(subscriber)
+        if not self.readingPaused:
+            self.readingPaused = True
+            self.send(("pause",))
+
+    def resumeReading(self, subscriber):
+        """
+        Asks the supervisor to continue relaying messages when no subscriber wants the reading to be paused anymore
+        """
+        self.pausingSubscribers.discard(subscriber)
+        if len(self.pausingSubscribers) == 0 and self.readingPaused:
+            self.readingPaused = False
+            self.send(("resume",))
+
+    def _createClient(self):
+        """
+        Internal function, the relay does not need a client
+        """
+        return None
+
+    def _subscribeAtBroker(self, topicFilter: str):
+        self.send(("subscribe", topicFilter))
+
+    def _unsubscribeAtBroker(self, topicFilter: str):
+        self.send(("unsubscribe", topicFilter))
+
+    def _connect(self):
+        """
+        Internal function, the worker is informed by the supervisor about the connection
+        """
+        pass
+
+    def _shutdown(self, stopLoop: bool):
+        """
+        Internal function which stops the event loop, must be called in the event loop
+        """
+        with self.lock:
+            self.isConnected = False
+
+        if stopLoop:
+            self.loop.stop()
+        self.loop = None
+
+    def _relayConnected(self, code):
+        """
+        Internal function which renews the subscriptions and informs the subscribers, must be called in the event loop
+        """
+        with self.lock:
+            self.isConnected = True
+            self.connectCode = code
+            topicFilters = list(self.subscriptionCounts.keys())
+            subscribers = list(self.subscribers)
+
+        for topicFilter in topicFilters:
+            self._subscribeAtBroker(topicFilter)
+
+        for subscriber in subscribers:
+            subscriber.connected(code)
+
+    def _relayDisconnected(self, code):
+        """
+        Internal function which informs the subscribers, must be called in the event loop
+        """
+        with self.lock:
+            self.isConnected = False
+            subscribers = list(self.subscribers)
+
+        for subscriber in subscribers:
+            subscriber.disconnected(code)
+
+    def _deliver(self, topic: str, payload: str):
+        """
+        Internal function which delivers the message to all matching subscribers, must be called in the event loop
+        """
+        self.received += 1
+        for subscriber in self._route(topic):
+            self.delivered += 1
+            subscriber.deliver(topic, payload)
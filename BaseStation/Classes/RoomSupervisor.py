@@ -0,0 +1,650 @@
+import copy
+import json
+import multiprocessing
+import os
+import queue
+import re
+import resource
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from pathlib import Path
+from typing import Dict, List
+
+from .GameSession import GameSession
+from .Journal import replayJournal
+from .Log import log, initLogger, shutdownLogger, DEBUG, WARNING, ERROR
+from .MqttConnection import MqttConnection, getSharedConnection, setSharedConnection
+from .Puzzle import Puzzle
+from .RelayConnection import RelayConnection
+
+"""
+Runs several escape rooms with their own games from one base station
+
+Every room is an isolated GameSession with its own puzzles, journal and topic namespace: the topics of the puzzles
+of a room start with rooms/<room>/, e.g. rooms/red/tilt_maze/general. The sessions run in worker processes,
+so a busy room does not take the CPU of the others. Only the supervisor process connects to the broker,
+the workers use a RelayConnection which passes the subscriptions and publishes to the supervisor, and the
+supervisor relays the received messages to the worker of the room.
+
+Every worker reports the state of its rooms and its CPU and memory usage every healthInterval seconds.
+A worker which crashed is restarted and resumes its unfinished games from their journals.
+
+Usage:
+    rooms = {name: getRoomPuzzles(puzzles, name) for name in ["red", "blue"]}
+    supervisor = RoomSupervisor(rooms)
+    supervisor.start()
+    ...
+    supervisor.getHealth()["red"]["status"]
+    supervisor.buyHint("red", "Tilt Maze").result()
+    ...
+    supervisor.stop()
+"""
+
+roomTopicPrefix: str = "rooms"
+roomNamePattern = re.compile(r"^[A-Za-z0-9_-]+$") # Used in topics and file names
+
+def getRoomPuzzles(puzzles: List[Puzzle], roomName: str):
+    """
+    Returns copies of the puzzles with the topics in the namespace of the room
+    """
+    if roomNamePattern.match(roomName) is None:
+        raise ValueError(f"Invalid room name '{roomName}', only letters, digits, - and _ are allowed")
+
+    roomPuzzles = []
+    for puzzle in puzzles:
+        p = copy.deepcopy(puzzle)
+        p.mqttTopic = f"{roomTopicPrefix}/{roomName}/{puzzle.mqttTopic}"
+        p.mqttTopicGeneral = p.mqttTopic + "/general"
+        p.mqttTopicPoints = p.mqttTopic + "/points"
+        p.mqttTopicStatus = p.mqttTopic + "/status"
+        roomPuzzles.append(p)
+    return roomPuzzles
+
+def getRoomJournalPath(journalFolder: Path, roomName: str):
+    return Path(journalFolder, f"journal-{roomName}.jsonl")
+
+def getResourceUsage():
+    """
+    Returns a dictionary with the CPU time and the peak memory of the current process
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    maxRss = usage.ru_maxrss / (1024 * 1024) if sys.platform == "darwin" else usage.ru_maxrss / 1024
+    return {
+        "pid": os.getpid(),
+        "cpuSeconds": usage.ru_utime + usage.ru_stime,
+        "maxRssMb": round(maxRss, 1),
+        "threads": threading.active_count(),
+    }
+
+def getRoomState(session: GameSession):
+    """
+    Returns a dictionary with the state of the game and the queues of a session
+    """
+    s = session.getSnapshot()
+    return {
+        "points": s.points,
+        "secondsLeft": max(0, s.secondsLeft),
+        "puzzles": len(s.puzzles),
+        "initialized": s.initializedCount,
+        "completed": s.completedCount,
+        "online": sum(1 for p in session.getPresence().values() if p["status"] == "online"),
+        "isFinished": s.isFinished,
+        "engineQueue": session.engine.commands.qsize(),
+        "messageQueue": session.communicationManager.getStatistics(),
+    }
+
+def runWorker(index: int, rooms: Dict[str, List[Puzzle]], pipe, journalFolder: Path, logPath: Path | None,
+              healthInterval: float, isRestart: bool):
+    """
+    Main function of a worker process, runs the sessions of the rooms until the supervisor sends stop
+
+    A restarted worker only resumes the unfinished games, it does not start the finished games again
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # Ctrl+C is handled by the supervisor, which stops the workers
+    initLogger(logPath)
+    log(f"Room worker {index} started with rooms: {list(rooms.keys())}")
+
+    sendLock = threading.Lock()
+    def send(message):
+        with sendLock:
+            try:
+                pipe.send(message)
+            except OSError:
+                pass # The supervisor is gone, the worker stops when reading from the pipe fails
+
+    connection = RelayConnection(send)
+    setSharedConnection(connection)
+
+    sessions: Dict[str, GameSession] = {}
+    for name, puzzles in rooms.items():
+        journalPath = getRoomJournalPath(journalFolder, name)
+        resumeState = replayJournal(journalPath)
+        if resumeState is None and isRestart:
+            log(f"Room '{name}' has no unfinished game to resume")
+            continue
+        if resumeState is not None:
+            puzzles = [p for p in puzzles if p.name in resumeState.puzzleNames]
+        for puzzle in puzzles:
+            puzzle.isSelectedForPlay = True
+        sessions[name] = GameSession(puzzles, resumeState, journalPath)
+        log(f"{'Resuming' if resumeState is not None else 'Starting'} game in room '{name}' with puzzles: '{[p.name for p in puzzles]}'")
+
+    for session in sessions.values():
+        session.start()
+
+    stopped = threading.Event()
+    def sendHealth():
+        while True:
+            health = getResourceUsage()
+            health["relay"] = connection.getStatistics()
+            health["rooms"] = {name: getRoomState(session) for name, session in sessions.items()}
+            send(("health", health))
+            if stopped.wait(healthInterval):
+                return
+    healthThread = threading.Thread(target=sendHealth, name="RoomWorkerHealth", daemon=True)
+    healthThread.start()
+
+    try:
+        while True:
+            message = pipe.recv()
+            kind = message[0]
+            if kind == "message":
+                connection.receive(message[1], message[2])
+            elif kind == "connected":
+                connection.relayConnected(message[1])
+            elif kind == "disconnected":
+                connection.relayDisconnected(message[1])
+            elif kind == "hint":
+                requestId, roomName, puzzleName = message[1:]
+                session = sessions.get(roomName)
+                if session is None:
+                    send(("reply", requestId, False))
+                    continue
+                session.buyHint(puzzleName).add_done_callback(
+                    lambda f, requestId=requestId: send(("reply", requestId, f.exception() is None and f.result())))
+            elif kind == "stop":
+                break
+    except (EOFError, OSError):
+        log(f"Room worker {index} lost the connection to the supervisor", ERROR)
+    finally:
+        stopped.set()
+        healthThread.join()
+        for session in sessions.values():
+            session.stop()
+        pipe.close()
+        log(f"Room worker {index} stopped")
+        shutdownLogger()
+
+class RoomWorker():
+    """
+    Worker process of the RoomSupervisor as seen by the supervisor
+
+    It is the subscriber of the worker at the broker connection, so the connection routes only the messages
+    matching the subscriptions of its rooms to it. The messages for the worker are queued and written to its pipe
+    by a sender thread, so a worker which does not read its pipe never blocks the event loop of the connection,
+    which serves all rooms. When the queue is full further messages are dropped and counted.
+    """
+    maxQueued: int = 10000 # Messages queued for a worker before further messages are dropped
+
+    def __init__(self, index: int, roomNames: List[str]):
+        self.index = index
+        self.roomNames = roomNames
+
+        self.process = None
+        self.pipe = None
+        self.outbox: queue.Queue | None = None
+        self.sendLock = threading.Lock()
+        self.readerThread: threading.Thread | None = None
+        self.senderThread: threading.Thread | None = None
+        self.startTime: float = 0
+        self.restarts: int = 0
+        self.status: str = "stopped"
+
+        self.health: dict | None = None # Last report of the worker
+        self.healthTime: float = 0
+        self.cpuPercent: float = 0
+
+        # Counters
+        self.relayed: int = 0
+        self.published: int = 0
+        self.dropped: int = 0
+        self.dropping: bool = False
+
+    def attach(self, pipe):
+        """
+        Starts sending the queued messages to the pipe of a new worker process
+        """
+        with self.sendLock:
+            self.pipe = pipe
+            self.outbox = queue.Queue(self.maxQueued)
+            self.dropping = False
+        self.senderThread = threading.Thread(target=self._sendToWorker, args=(pipe, self.outbox), name=f"RoomWorkerSender-{self.index}", daemon=True)
+        self.senderThread.start()
+
+    def detach(self):
+        """
+        Stops the sender thread after the worker process is gone, the queued messages are discarded
+        """
+        with self.sendLock:
+            self.pipe = None
+            outbox = self.outbox
+        if outbox is None:
+            return
+        # No message is queued anymore, so the queue has room for the end marker after emptying it
+        while True:
+            try:
+                outbox.get_nowait()
+            except queue.Empty:
+                break
+        outbox.put_nowait(None)
+        self.senderThread.join()
+
+    def send(self, message):
+        """
+        Queues a message for the worker process, returns false if the worker is gone or its queue is full
+        It never blocks, so it can be called from the event loop of the connection
+        """
+        with self.sendLock:
+            if self.pipe is None:
+                return False
+            outbox = self.outbox
+        try:
+            outbox.put_nowait(message)
+        except queue.Full:
+            self.dropped += 1
+            if not self.dropping:
+                self.dropping = True
+                log(f"Room worker {self.index} does not read its messages, dropping them", WARNING)
+            return False
+        if self.dropping:
+            self.dropping = False
+            log(f"Room worker {self.index} reads its messages again, {self.dropped} messages dropped so far", WARNING)
+        return True
+
+    def getQueued(self):
+        """
+        Returns the number of messages waiting for the worker
+        """
+        outbox = self.outbox
+        return outbox.qsize() if outbox is not None else 0
+
+    def _sendToWorker(self, pipe, outbox: queue.Queue):
+        """
+        Internal function of the sender thread, which writes the queued messages to the pipe until detach()
+        """
+        while True:
+            message = outbox.get()
+            if message is None:
+                return
+            try:
+                pipe.send(message)
+            except (OSError, ValueError):
+                # The worker is gone, the reader thread notices it and calls detach()
+                continue
+
+    def setHealth(self, health: dict):
+        """
+        Stores a report of the worker and calculates its CPU usage since the last report
+        """
+        now = time.monotonic()
+        if self.health is not None and now > self.healthTime:
+            cpuSeconds = health["cpuSeconds"] - self.health["cpuSeconds"]
+            self.cpuPercent = round(100 * cpuSeconds / (now - self.healthTime), 1)
+        self.health = health
+        self.healthTime = now
+
+    # Be carefull
+    # The following functions are executed in the event loop of the connection
+    def deliver(self, topic: str, payload: str):
+        self.relayed += 1
+        self.send(("message", topic, payload))
+
+    def connected(self, code):
+        self.send(("connected", str(code)))
+
+    def disconnected(self, code):
+        self.send(("disconnected", str(code)))
+
+class RoomSupervisor():
+    """
+    Class which runs the rooms in worker processes and relays their messages over a single broker connection
+    """
+
+    healthInterval: float = 1 # Seconds between two reports of a worker
+    staleAfter: float = 5 # Seconds without report after which a worker is reported as stale
+    maxRestarts: int = 3 # Restarts of a crashed worker before its rooms are given up
+
+    def __init__(self, rooms: Dict[str, List[Puzzle]], workerCount: int | None = None, journalFolder: Path = Path(".", "journals"),
+                 logFolder: Path | None = None, connection: MqttConnection | None = None):
+        """
+        rooms are the puzzles by room name, see getRoomPuzzles(). By default every room gets its own worker,
+        up to the number of CPUs. Pass a logFolder to write the log of every worker to a separate file
+        """
+        for name in rooms.keys():
+            if roomNamePattern.match(name) is None:
+                raise ValueError(f"Invalid room name '{name}', only letters, digits, - and _ are allowed")
+
+        self.rooms = rooms
+        self.journalFolder = journalFolder
+        self.logFolder = logFolder
+        self.connection: MqttConnection = connection if connection is not None else getSharedConnection()
+
+        if workerCount is None:
+            workerCount = min(len(rooms), os.cpu_count() or 1)
+        workerCount = max(1, min(workerCount, len(rooms)))
+        roomNames = sorted(rooms.keys())
+        self.workers = [RoomWorker(i, roomNames[i::workerCount]) for i in range(workerCount)]
+        self.workerByRoom = {name: worker for worker in self.workers for name in worker.roomNames}
+        self.roomStates: Dict[str, dict] = {} # Last reported state by room name, kept when a worker is restarted
+
+        # Spawned workers do not inherit the threads and the broker connection of the supervisor
+        self.context = multiprocessing.get_context("spawn")
+        self.lock = threading.Lock()
+        self.requestIds = count()
+        self.pendingReplies: Dict[int, tuple] = {} # Tuples of (worker, Future) by request id
+
+        self.condition = threading.Condition()
+        self.monitorThread: threading.Thread | None = None
+        self.running: bool = False
+
+    def start(self):
+        """
+        Connects to the broker and starts the workers
+        """
+        self.journalFolder.mkdir(parents=True, exist_ok=True)
+        self.connection.start()
+        self.running = True
+        for worker in self.workers:
+            self._startWorker(worker, False)
+
+        self.monitorThread = threading.Thread(target=self._monitor, name="RoomSupervisor", daemon=True)
+        self.monitorThread.start()
+        log(f"Supervisor started {len(self.rooms)} rooms in {len(self.workers)} workers")
+
+    def stop(self):
+        """
+        Stops the workers, which stop their games and journals, and the broker connection
+        """
+        with self.condition:
+            if not self.running:
+                return
+            self.running = False
+            self.condition.notify()
+        self.monitorThread.join()
+
+        for worker in self.workers:
+            worker.send(("stop",))
+        for worker in self.workers:
+            if worker.process is None:
+                continue
+            worker.process.join(5)
+            if worker.process.is_alive():
+                log(f"Room worker {worker.index} did not stop, terminating it", WARNING)
+                worker.process.terminate()
+                worker.process.join()
+            if worker.readerThread is not None:
+                worker.readerThread.join()
+            worker.status = "stopped"
+
+        self.connection.stop()
+        log("Supervisor stopped")
+
+    def buyHint(self, roomName: str, puzzleName: str):
+        """
+        Buys the next hint of the puzzle in the room, returns a Future which is true if the hint was bought
+        """
+        future = Future()
+        worker = self.workerByRoom.get(roomName)
+        if worker is None:
+            future.set_result(False)
+            return future
+
+        with self.lock:
+            requestId = next(self.requestIds)
+            self.pendingReplies[requestId] = (worker, future)
+        if not worker.send(("hint", requestId, roomName, puzzleName)):
+            self._reply(requestId, False)
+        return future
+
+    def getHealth(self):
+        """
+        Returns a dictionary by room name with the status and the usage of its worker and the last reported game state
+
+        The status is one of starting, ok, stale (no report for staleAfter seconds), restarting, failed or stopped.
+        The CPU and memory usage are the ones of the worker, which is shared by its rooms
+        """
+        now = time.monotonic()
+        health = {}
+        for name in sorted(self.rooms.keys()):
+            worker = self.workerByRoom[name]
+            room = {
+                "worker": worker.index,
+                "status": worker.status,
+                "restarts": worker.restarts,
+                "uptime": round(now - worker.startTime, 1) if worker.status != "stopped" else 0,
+                "heartbeatAge": round(now - worker.healthTime, 1) if worker.health is not None else None,
+                "cpuPercent": worker.cpuPercent,
+            }
+            if worker.health is not None:
+                room["pid"] = worker.health["pid"]
+                room["cpuSeconds"] = round(worker.health["cpuSeconds"], 2)
+                room["maxRssMb"] = worker.health["maxRssMb"]
+                room["threads"] = worker.health["threads"]
+            state = self.roomStates.get(name)
+            if state is not None:
+                room.update(state)
+            health[name] = room
+        return health
+
+    def getStatistics(self):
+        """
+        Returns a dictionary with the health of the rooms, the relay counters of the workers and the broker connection
+        """
+        workers = []
+        for worker in self.workers:
+            relay = worker.health["relay"] if worker.health is not None else {}
+            workers.append({
+                "index": worker.index,
+                "rooms": worker.roomNames,
+                "status": worker.status,
+                "relayed": worker.relayed,
+                "published": worker.published,
+                "queued": worker.getQueued(),
+                "dropped": worker.dropped,
+                "subscriptions": len(relay.get("subscriptions", {})),
+            })
+        return {"rooms": self.getHealth(), "workers": workers, "connection": self.connection.getStatistics()}
+
+    def _startWorker(self, worker: RoomWorker, isRestart: bool):
+        """
+        Internal function which starts the process of the worker and the thread which reads its messages
+        """
+        rooms = {name: self.rooms[name] for name in worker.roomNames}
+        logPath = Path(self.logFolder, f"log-worker{worker.index}.jsonl") if self.logFolder is not None else None
+        pipe, workerPipe = self.context.Pipe()
+        process = self.context.Process(
+            target=runWorker,
+            args=(worker.index, rooms, workerPipe, self.journalFolder, logPath, self.healthInterval, isRestart),
+            name=f"RoomWorker-{worker.index}",
+            daemon=True)
+        process.start()
+        workerPipe.close() # Only the worker holds its end, so reading fails when the worker is gone
+
+        worker.attach(pipe)
+        worker.process = process
+        worker.health = None
+        worker.cpuPercent = 0
+        worker.startTime = time.monotonic()
+        worker.status = "starting"
+
+        worker.readerThread = threading.Thread(target=self._readWorker, args=(worker, pipe), name=f"RoomWorkerReader-{worker.index}", daemon=True)
+        worker.readerThread.start()
+        self.connection.addSubscriber(worker)
+
+    def _readWorker(self, worker: RoomWorker, pipe):
+        """
+        Internal function of the reader thread of a worker, which executes its requests until the worker is gone
+        """
+        while True:
+            try:
+                message = pipe.recv()
+            except (EOFError, OSError):
+                break
+
+            kind = message[0]
+            if kind == "publish":
+                worker.published += 1
+                self.connection.publish(message[1], message[2], qos=message[3], retain=message[4])
+            elif kind == "subscribe":
+                self.connection.subscribe(message[1], worker)
+            elif kind == "unsubscribe":
+                self.connection.unsubscribe(message[1], worker)
+            elif kind == "pause":
+                self.connection.callInLoop(self.connection.pauseReading, worker)
+            elif kind == "resume":
+                self.connection.callInLoop(self.connection.resumeReading, worker)
+            elif kind == "health":
+                worker.setHealth(message[1])
+                self.roomStates.update(message[1]["rooms"])
+            elif kind == "reply":
+                self._reply(message[1], message[2])
+
+        # The worker is gone, its subscriptions and open requests are removed
+        self.connection.removeSubscriber(worker)
+        worker.detach()
+        pipe.close()
+        with self.lock:
+            requestIds = [i for i, (w, _) in self.pendingReplies.items() if w is worker]
+        for requestId in requestIds:
+            self._reply(requestId, False)
+
+    def _reply(self, requestId: int, result):
+        """
+        Internal function which completes the Future of a request
+        """
+        with self.lock:
+            pending = self.pendingReplies.pop(requestId, None)
+        if pending is not None:
+            pending[1].set_result(result)
+
+    def _monitor(self):
+        """
+        Internal function of the monitor thread, which updates the status of the workers and restarts crashed workers
+        """
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: not self.running, timeout=self.healthInterval)
+                if not self.running:
+                    return
+
+            now = time.monotonic()
+            for worker in self.workers:
+                if worker.status in ("failed", "stopped"):
+                    continue
+
+                if not worker.process.is_alive():
+                    log(f"Room worker {worker.index} with rooms {worker.roomNames} exited with code {worker.process.exitcode}", ERROR)
+                    worker.readerThread.join()
+                    if worker.restarts >= self.maxRestarts:
+                        log(f"Room worker {worker.index} crashed {worker.restarts + 1} times, giving up its rooms", ERROR)
+                        worker.status = "failed"
+                        continue
+                    worker.restarts += 1
+                    worker.status = "restarting"
+                    self._startWorker(worker, True)
+                    continue
+
+                if worker.health is None:
+                    status = "starting"
+                elif now - worker.healthTime > self.staleAfter:
+                    status = "stale"
+                else:
+                    status = "ok"
+                if status != worker.status:
+                    log(f"Room worker {worker.index} is {status}", WARNING if status == "stale" else DEBUG)
+                    worker.status = status
+
+class SupervisorRequestHandler(BaseHTTPRequestHandler):
+    """
+    Handler of the requests of the SupervisorServer
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        supervisor: RoomSupervisor = self.server.supervisor
+        if self.path == "/rooms":
+            self._send(200, json.dumps(supervisor.getHealth()).encode())
+        elif self.path == "/stats":
+            self._send(200, json.dumps(supervisor.getStatistics()).encode())
+        else:
+            self._send(404, b"{\"error\": \"Not found\"}")
+
+    def do_POST(self):
+        supervisor: RoomSupervisor = self.server.supervisor
+        parts = self.path.strip("/").split("/")
+        if len(parts) != 3 or parts[0] != "rooms" or parts[2] != "hint" or parts[1] not in supervisor.rooms:
+            self._send(404, b"{\"error\": \"Not found\"}")
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            puzzleName = json.loads(self.rfile.read(length))["puzzle"]
+        except (ValueError, KeyError, TypeError):
+            self._send(400, b"{\"error\": \"Expected {\\\"puzzle\\\": name}\"}")
+            return
+
+        bought = supervisor.buyHint(parts[1], puzzleName).result()
+        log(f"Supervisor {'bought' if bought else 'could not buy'} a hint for '{puzzleName}' in room '{parts[1]}'")
+        self._send(200, json.dumps({"bought": bought}).encode())
+
+    def log_message(self, format, *args):
+        log(f"Supervisor {self.address_string()}: {format % args}", DEBUG)
+
+    def _send(self, status: int, body: bytes):
+        """
+        Internal function which sends a complete JSON response
+        """
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class SupervisorServer():
+    """
+    Class which serves the health of the rooms as JSON on a background thread
+
+    Endpoints:
+        GET /rooms                  Health and game state by room
+        GET /stats                  Health, relay counters of the workers and counters of the broker connection
+        POST /rooms/<room>/hint     Buys a hint, the body is {"puzzle": name}
+    """
+    def __init__(self, supervisor: RoomSupervisor, host: str = "0.0.0.0", port: int = 8090):
+        self.supervisor = supervisor
+        self.server = ThreadingHTTPServer((host, port), SupervisorRequestHandler)
+        self.server.daemon_threads = True
+        self.server.supervisor = supervisor
+        self.thread: threading.Thread | None = None
+
+    def getAddress(self):
+        """
+        Returns the host and the port the server listens on
+        """
+        return self.server.server_address[:2]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="SupervisorServer", daemon=True)
+        self.thread.start()
+        host, port = self.getAddress()
+        log(f"Room health served on http://{host}:{port}/rooms")
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.thread is not None:
+            self.thread.join()
@@ -0,0 +1,70 @@
+import math
+from typing import Dict, List
+
+class TimerWheel():
+    """
+    Hashed timing wheel, which keeps one timeout per key with constant cost per schedule, cancel and expiry
+
+    The time is divided into ticks of resolution seconds and a timeout is stored in the slot of its tick.
+    Timeouts more than one revolution away stay in their slot until their tick has come, so the wheel works
+    for any deadline. advance() only visits the slots of the ticks passed since the last call, so the cost
+    does not depend on the number of scheduled keys.
+
+    Usage:
+        wheel = TimerWheel(resolution=1)
+        wheel.schedule("Tilt Maze", time.monotonic() + 30)
+        ...
+        for key in wheel.advance(time.monotonic()):
+            print(f"{key} timed out")
+    """
+    def __init__(self, resolution: float = 1, slotCount: int = 256, now: float = 0):
+        self.resolution = resolution
+        self.slots: List[Dict[object, int]] = [{} for _ in range(slotCount)] # Tick of the deadline by key
+        self.slotIndexByKey: Dict[object, int] = {}
+        self.currentTick: int = self._tick(now)
+
+    def __len__(self):
+        return len(self.slotIndexByKey)
+
+    def __contains__(self, key):
+        return key in self.slotIndexByKey
+
+    def schedule(self, key, deadline: float):
+        """
+        Schedules the timeout of the key at the deadline, replacing an earlier timeout of the key
+        """
+        self.cancel(key)
+        # Rounded up, so a timeout never expires early. A deadline in the past expires at the next tick
+        tick = max(math.ceil(deadline / self.resolution), self.currentTick + 1)
+        index = tick % len(self.slots)
+        self.slots[index][key] = tick
+        self.slotIndexByKey[key] = index
+
+    def cancel(self, key):
+        """
+        Removes the timeout of the key, if it is scheduled
+        """
+        index = self.slotIndexByKey.pop(key, None)
+        if index is not None:
+            del self.slots[index][key]
+
+    def advance(self, now: float):
+        """
+        Moves the wheel to the time now and returns the keys whose deadline has passed
+        """
+        targetTick = self._tick(now)
+        expired = []
+        # After a whole revolution every slot has been visited, so a long pause costs at most one revolution
+        steps = min(targetTick - self.currentTick, len(self.slots))
+        for step in range(1, steps + 1):
+            slot = self.slots[(self.currentTick + step) % len(self.slots)]
+            due = [key for key, tick in slot.items() if tick <= targetTick]
+            for key in due:
+                del slot[key]
+                del self.slotIndexByKey[key]
+            expired += due
+        self.currentTick = max(self.currentTick, targetTick)
+        return expired
+
+    def _tick(self, time: float):
+        return math.floor(time / self.resolution)
@@ -0,0 +1,143 @@
+import threading
+import time
+from collections import OrderedDict
+from itertools import count
+
+from PySide6.QtCore import QObject, QTimer, Signal
+
+from .LatencyHistogram import LatencyHistogram
+from .Log import log, ERROR
+
+class UiUpdateCoalescer(QObject):
+    """
+    Collects updates of widgets from any thread and applies them on the GUI thread at most frameRate times per second
+
+    An update is a function with its arguments. Updates posted with a key replace a pending update with the same key,
+    so e.g. a burst of points messages only sets the text of the points label once per frame.
+    Updates posted without a key are events, which are all applied in the order they were posted.
+
+    Only the first update of a frame emits a signal to the GUI thread, so the Qt event queue does not grow with the
+    number of messages.
+
+    Usage:
+        updater = UiUpdateCoalescer()
+        updater.post("points", label.setText, "42") # Any thread
+        updater.post(None, button.setEnabled, True)
+        ...
+        updater.stop()
+    """
+
+    frameRate: float = 30 # Maximum number of frames per second
+
+    scheduleSignal = Signal() # Emitted by the first update of a frame, handled in the GUI thread
+
+    def __init__(self, frameRate: float | None = None):
+        super().__init__()
+        if frameRate is not None:
+            self.frameRate = frameRate
+        self.frameInterval = 1 / self.frameRate
+
+        self.lock = threading.Lock()
+        self.pending: OrderedDict = OrderedDict() # (function, args, time of the first post) by key
+        self.scheduled: bool = False
+        self.eventKeys = count() # Unique keys of the updates without key
+        self.lastFrameTime: float = 0
+        self.stopped: bool = False
+
+        # Statistics
+        self.posted: int = 0
+        self.coalesced: int = 0 # Updates replaced by a later update with the same key
+        self.applied: int = 0
+        self.frames: int = 0
+        self.maxFrameSize: int = 0
+        self.applyTimes = LatencyHistogram() # Time needed to apply the updates of a frame
+        self.delays = LatencyHistogram() # Time from posting an update until it is applied
+
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.applyPending)
+        self.scheduleSignal.connect(self._schedule)
+
+    def post(self, key, function, *args):
+        """
+        Posts an update which is applied in the next frame, pass None as key if the update must not be replaced
+        """
+        with self.lock:
+            if self.stopped:
+                return
+            self.posted += 1
+            if key is None:
+                key = ("event", next(self.eventKeys))
+            previous = self.pending.get(key)
+            if previous is not None:
+                self.coalesced += 1
+                self.pending[key] = (function, args, previous[2])
+            else:
+                self.pending[key] = (function, args, time.perf_counter())
+
+            if self.scheduled:
+                return
+            self.scheduled = True
+        self.scheduleSignal.emit()
+
+    def applyPending(self):
+        """
+        Applies all pending updates at once, must be called in the GUI thread
+        """
+        with self.lock:
+            pending = self.pending
+            self.pending = OrderedDict()
+            self.scheduled = False
+        if len(pending) == 0:
+            return
+
+        startTime = time.perf_counter()
+        for function, args, _ in pending.values():
+            try:
+                function(*args)
+            except Exception as ex:
+                log(f"Exception in UI update {function}: {ex}", ERROR)
+        endTime = time.perf_counter()
+        self.lastFrameTime = endTime
+
+        with self.lock:
+            for _, _, postTime in pending.values():
+                self.delays.record(startTime - postTime)
+            self.applyTimes.record(endTime - startTime)
+            self.applied += len(pending)
+            self.frames += 1
+            self.maxFrameSize = max(self.maxFrameSize, len(pending))
+
+    def stop(self):
+        """
+        Discards the pending updates and ignores all further updates
+        """
+        with self.lock:
+            self.stopped = True
+            self.pending.clear()
+        self.timer.stop()
+
+    def getStatistics(self):
+        """
+        Returns a dictionary with the counters and the summaries of the apply times and delays in ms
+        """
+        with self.lock:
+            return {
+                "posted": self.posted,
+                "coalesced": self.coalesced,
+                "applied": self.applied,
+                "frames": self.frames,
+                "maxFrameSize": self.maxFrameSize,
+                "pending": len(self.pending),
+                "applyMs": self.applyTimes.getSummary(),
+                "delayMs": self.delays.getSummary(),
+            }
+
+    def _schedule(self):
+        """
+        Internal function which starts the timer for the next frame, called in the GUI thread
+        """
+        if self.timer.isActive() or self.stopped:
+            return
+        wait = self.lastFrameTime + self.frameInterval - time.perf_counter()
+        self.timer.start(max(0, int(wait * 1000)))
@@ -0,0 +1,322 @@
+import asyncio
+import math
+import random
+import threading
+import time
+from collections import deque
+from typing import Dict, List
+
+from .CommunicationManager import CommunicationManager, initializeMessage, initializeMessageAck, finishMessage, finishMessageAck, onlineMessage, offlineMessage
+from .Log import log
+from .MqttConnection import MqttConnection
+from .Puzzle import Puzzle
+
+"""
+Virtual puzzles which speak the protocol of the real puzzles, used to put load on the base station
+
+Every virtual puzzle answers the initialize message with initialize_ack, sends integers on its points topic
+and publishes finished after its solve time until the base station sends finished_ack.
+Failures can be injected by ignoring initialize messages, sending messages twice or sending invalid points.
+With publishStatus the puzzles publish their retained online status after connecting and offline when stopped.
+
+Usage:
+    puzzles = createVirtualPuzzles(100)
+    fleet = VirtualPuzzleFleet(puzzles, pointsRate=2, solveTime=20)
+    mainScreen.onStateChange = fleet.latencyTracker.observe # Measures the latency until the base station reacts
+    fleet.start()
+    ...
+    fleet.stop()
+    print(fleet.getStatistics())
+"""
+
+def createVirtualPuzzles(count: int, topicPrefix: str = "virtual"):
+    """
+    Returns a list of puzzles with the topics TOPICPREFIX/puzzle_001 and so on
+    """
+    puzzles = []
+    for index in range(1, count + 1):
+        p = Puzzle()
+        p.name = f"Virtual Puzzle {index:03d}"
+        p.description = "Simulated puzzle of the load test"
+        p.points = 100
+        p.mqttTopic = f"{topicPrefix}/puzzle_{index:03d}"
+        p.mqttTopicGeneral = p.mqttTopic + "/general"
+        p.mqttTopicPoints = p.mqttTopic + "/points"
+        p.mqttTopicStatus = p.mqttTopic + "/status"
+        puzzles.append(p)
+    return puzzles
+
+def getPercentiles(values: List[float]):
+    """
+    Returns a dictionary with the count, the 50th, 90th and 99th percentile and the maximum of the values
+    """
+    if len(values) == 0:
+        return {"count": 0, "p50": None, "p90": None, "p99": None, "max": None}
+
+    ordered = sorted(values)
+    rank = lambda fraction: ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+    return {"count": len(ordered), "p50": rank(0.5), "p90": rank(0.9), "p99": rank(0.99), "max": ordered[-1]}
+
+class LatencyTracker():
+    """
+    Class which measures the time from publishing a message until the state change it causes in the base station
+
+    expect() is called when a message is published and observe() with every state change of the MainScreen.
+    The state changes of a puzzle are matched with its published messages in order.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending: Dict[tuple, deque] = {} # Publish times by (event, puzzle name)
+        self.latencies: Dict[str, List[float]] = {} # Seconds by event
+        self.unexpected: int = 0 # State changes without a published message, e.g. from messages sent twice
+
+    def expect(self, event: str, puzzleName: str):
+        """
+        Registers a published message, which should cause the state change event for the puzzle
+        """
+        with self.lock:
+            self.pending.setdefault((event, puzzleName), deque()).append(time.perf_counter())
+
+    def observe(self, event: str, data: dict):
+        """
+        Registers a state change of the base station, can be used as MainScreen.onStateChange
+        """
+        now = time.perf_counter()
+        puzzleName = data.get("puzzle")
+        if puzzleName is None:
+            return
+
+        with self.lock:
+            pending = self.pending.get((event, puzzleName))
+            if pending is None or len(pending) == 0:
+                self.unexpected += 1
+                return
+            self.latencies.setdefault(event, []).append(now - pending.popleft())
+
+    def getStatistics(self):
+        """
+        Returns a dictionary with the latency percentiles in ms by event and the number of unmatched messages and state changes
+        """
+        with self.lock:
+            return {
+                "latencyMs": {event: getPercentiles([l * 1000 for l in latencies]) for event, latencies in self.latencies.items()},
+                "withoutStateChange": sum([len(pending) for pending in self.pending.values()]),
+                "unexpectedStateChanges": self.unexpected,
+            }
+
+class VirtualPuzzle():
+    """
+    Class holding the state of a single virtual puzzle
+    """
+    def __init__(self, puzzle: Puzzle):
+        self.puzzle = puzzle
+        self.isInitialized: bool = False
+        self.isFinished: bool = False # True when the base station acknowledged the finished message
+        self.finishSentAt: float | None = None
+        self.playTask: asyncio.Task | None = None
+
+class VirtualPuzzleFleet():
+    """
+    Class which simulates many puzzles on a single connection to the broker
+
+    All puzzles run as tasks in the event loop of the connection. Without a connection the fleet opens its own
+    MqttConnection, so the base station and the fleet talk to each other through the broker like real devices.
+    Pass the shared LoopbackConnection to run the whole system in one process without a broker.
+    """
+    def __init__(self, puzzles: List[Puzzle], connection: MqttConnection | None = None,
+                 pointsRate: float = 1, solveTime: float = 10, finishRetryInterval: float = 1,
+                 dropInitialize: float = 0, duplicate: float = 0, malformed: float = 0, seed: int | None = None,
+                 publishStatus: bool = False):
+        """
+        pointsRate is the number of points messages per second and puzzle, solveTime the mean number of seconds
+        from the initialization until a puzzle is finished.
+
+        dropInitialize, duplicate and malformed are the probabilities that an initialize message is ignored,
+        that a message is sent twice and that a points message does not contain an integer.
+        publishStatus lets the puzzles publish their retained status like the real puzzles
+        """
+        self.puzzles = puzzles
+        self.connection = connection if connection is not None else MqttConnection()
+        self.pointsRate = pointsRate
+        self.solveTime = solveTime
+        self.finishRetryInterval = finishRetryInterval
+        self.dropInitialize = dropInitialize
+        self.duplicate = duplicate
+        self.malformed = malformed
+        self.publishStatus = publishStatus
+        self.random = random.Random(seed)
+
+        self.nodesByTopic: Dict[str, VirtualPuzzle] = {p.mqttTopicGeneral: VirtualPuzzle(p) for p in self.puzzles}
+        self.latencyTracker = LatencyTracker()
+        self.ackRoundTrips: List[float] = [] # Seconds from the first finished message until finished_ack
+
+        self.communicationManager: CommunicationManager = CommunicationManager(connection=self.connection)
+        self.communicationManager.onConnect = self.onConnect
+        self.receiveTask: asyncio.Task | None = None
+
+        # Counters
+        self.published: int = 0
+        self.received: int = 0
+        self.droppedInitialize: int = 0
+        self.duplicated: int = 0
+        self.malformedSent: int = 0
+
+    def start(self):
+        """
+        Connects the fleet and lets the puzzles wait for the initialize message
+        """
+        log(f"Starting virtual puzzle fleet with {len(self.puzzles)} puzzles")
+        self.startTime = time.perf_counter()
+        self.communicationManager.start()
+        self.connection.callInLoop(self._startReceiving)
+
+    def stop(self):
+        """
+        Stops all puzzles and disconnects the fleet
+        """
+        self.connection.callInLoop(self._cancelTasks)
+        if self.publishStatus:
+            # Like the last will of a real puzzle, but the connection of the fleet is closed cleanly
+            for node in self.nodesByTopic.values():
+                self._publish(node.puzzle.mqttTopicStatus, offlineMessage)
+        self.communicationManager.stop()
+        log("Stopped virtual puzzle fleet")
+
+    def isDone(self):
+        """
+        Returns true if every puzzle received the finished_ack message
+        """
+        return all([node.isFinished for node in self.nodesByTopic.values()])
+
+    def getStatistics(self):
+        """
+        Returns a dictionary with the counters of the fleet and the latencies in ms
+        """
+        duration = time.perf_counter() - self.startTime
+        return {
+            "puzzles": len(self.puzzles),
+            "initialized": sum([1 for node in self.nodesByTopic.values() if node.isInitialized]),
+            "finished": sum([1 for node in self.nodesByTopic.values() if node.isFinished]),
+            "durationS": duration,
+            "published": self.published,
+            "publishedPerS": self.published / duration if duration > 0 else 0,
+            "received": self.received,
+            "droppedInitialize": self.droppedInitialize,
+            "duplicated": self.duplicated,
+            "malformed": self.malformedSent,
+            "finishAckRoundTripMs": getPercentiles([t * 1000 for t in self.ackRoundTrips]),
+            **self.latencyTracker.getStatistics(),
+        }
+
+    # Executed in the event loop of the connection
+    def onConnect(self, code):
+        """
+        Internal function needed for the CommunicationManager
+        """
+        for topic in self.nodesByTopic.keys():
+            self.communicationManager.subscribe(topic)
+        if self.publishStatus:
+            for node in self.nodesByTopic.values():
+                self._publish(node.puzzle.mqttTopicStatus, onlineMessage)
+
+    def _publish(self, topic: str, message, event: str | None = None, puzzleName: str | None = None):
+        """
+        Internal function which publishes the message, sends it a second time if a duplicate is injected
+        and registers the state change it should cause in the base station
+        """
+        if event is not None:
+            self.latencyTracker.expect(event, puzzleName)
+
+        self.communicationManager.publish(topic, message)
+        self.published += 1
+        if self.random.random() < self.duplicate:
+            self.communicationManager.publish(topic, message)
+            self.published += 1
+            self.duplicated += 1
+
+    def _startReceiving(self):
+        """
+        Internal function which starts the task handling the received messages, must be called in the event loop
+        """
+        self.receiveTask = asyncio.get_running_loop().create_task(self._receive())
+
+    def _cancelTasks(self):
+        """
+        Internal function which cancels all tasks of the fleet, must be called in the event loop
+        """
+        if self.receiveTask is not None:
+            self.receiveTask.cancel()
+        for node in self.nodesByTopic.values():
+            if node.playTask is not None:
+                node.playTask.cancel()
+
+    async def _receive(self):
+        """
+        Internal coroutine which answers the messages of the base station
+        """
+        async for topic, payload in self.communicationManager.messages():
+            node = self.nodesByTopic.get(topic)
+            if node is None:
+                continue
+
+            # The own messages are also received, because the puzzles subscribe to the topic they publish on
+            if payload == initializeMessage:
+                self.received += 1
+                self._onInitialize(node)
+            elif payload == finishMessageAck:
+                self.received += 1
+                self._onFinishAck(node)
+
+    def _onInitialize(self, node: VirtualPuzzle):
+        """
+        Internal function which acknowledges the initialization and starts playing the puzzle
+        """
+        if self.random.random() < self.dropInitialize:
+            self.droppedInitialize += 1
+            return
+
+        if node.isInitialized:
+            self._publish(node.puzzle.mqttTopicGeneral, initializeMessageAck)
+            return
+
+        node.isInitialized = True
+        self._publish(node.puzzle.mqttTopicGeneral, initializeMessageAck, "initialized", node.puzzle.name)
+        node.playTask = asyncio.get_running_loop().create_task(self._play(node))
+
+    def _onFinishAck(self, node: VirtualPuzzle):
+        """
+        Internal function which stops resending the finished message
+        """
+        if node.isFinished or node.finishSentAt is None:
+            return
+        node.isFinished = True
+        self.ackRoundTrips.append(time.perf_counter() - node.finishSentAt)
+
+    async def _play(self, node: VirtualPuzzle):
+        """
+        Internal coroutine which sends points until the puzzle is solved and then the finished message until it is acknowledged
+        """
+        puzzle = node.puzzle
+        solvedAt = time.perf_counter() + self.solveTime * self.random.uniform(0.5, 1.5)
+
+        while self.pointsRate > 0:
+            delay = self.random.expovariate(self.pointsRate)
+            if time.perf_counter() + delay >= solvedAt:
+                break
+            await asyncio.sleep(delay)
+
+            if self.random.random() < self.malformed:
+                self.malformedSent += 1
+                self._publish(puzzle.mqttTopicPoints, "not a number")
+            else:
+                self._publish(puzzle.mqttTopicPoints, self.random.randint(1, 5), "points", puzzle.name)
+
+        await asyncio.sleep(max(0, solvedAt - time.perf_counter()))
+
+        node.finishSentAt = time.perf_counter()
+        self._publish(puzzle.mqttTopicGeneral, finishMessage, "completed", puzzle.name)
+        while True:
+            await asyncio.sleep(self.finishRetryInterval)
+            if node.isFinished:
+                return
+            self._publish(puzzle.mqttTopicGeneral, finishMessage)
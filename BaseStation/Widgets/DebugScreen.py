@@ -1,16 +1,29 @@
-from PySide6.QtWidgets import QWidget, QLabel, QPushButton, QHBoxLayout, QVBoxLayout, QGroupBox, QLineEdit, QListWidget, QListWidgetItem
+from PySide6.QtWidgets import QWidget, QLabel, QPushButton, QHBoxLayout, QVBoxLayout, QGroupBox, QLineEdit, QTableWidget, QTableWidgetItem
+from PySide6.QtCore import QTimer, Signal
 from typing import List
+from datetime import datetime
+from pathlib import Path
 
 from .GameWidget import GameWidget
+from .MessageLogView import MessageLogView
 from Classes.CommunicationManager import CommunicationManager, initializeMessage, initializeMessageAck, finishMessage, finishMessageAck
 from Classes.Puzzle import Puzzle
 from Classes.Log import log
 
 
+telemetryColumns = ["Topic", "Sent", "Received", "Round trip p50", "Round trip p99", "Handling p50", "Broker p50", "Broker p99", "Ambiguous"]
+
 class DebugScreen(GameWidget):
-    def __init__(self, puzzles: List[Puzzle]):
+
+    # Signal needed to be thread save because the communicationManager runs in a different thread
+    puzzleInitializedSignal = Signal(QGroupBox) # Emitted with the group box of a puzzle which sent initialize
+
+    def __init__(self, puzzles: List[Puzzle], telemetryManager: CommunicationManager | None = None):
         """
         Setup the UI and place the widgets on the screen
+
+        The telemetry panel shows the latencies of the telemetryManager, e.g. the manager of the MainScreen,
+        or of the own manager if it is not set
         """
         super().__init__()
         self.puzzles = puzzles
@@ -21,6 +34,8 @@ class DebugScreen(GameWidget):
         self.communicationManager.onMessage = self.onMessage
         self.communicationManager.start()
 
+        self.telemetryManager = telemetryManager if telemetryManager is not None else self.communicationManager
+
         # UI
         self.puzzleGroupBoxes = []
         puzzle: Puzzle
@@ -55,8 +70,77 @@ class DebugScreen(GameWidget):
         
         self.mainLayout.addStretch()
         
-        self.logBox = QListWidget()
-        self.mainLayout.addWidget(self.logBox)
+        self.logView = MessageLogView()
+        self.mainLayout.addWidget(self.logView)
+
+        # Telemetry panel
+        gb = QGroupBox("Network telemetry [ms]")
+        vl = QVBoxLayout()
+        gb.setLayout(vl)
+
+        self.ratesLabel = QLabel()
+        vl.addWidget(self.ratesLabel)
+
+        self.telemetryTable = QTableWidget(0, len(telemetryColumns))
+        self.telemetryTable.setHorizontalHeaderLabels(telemetryColumns)
+        self.telemetryTable.verticalHeader().setVisible(False)
+        vl.addWidget(self.telemetryTable)
+
+        b = QPushButton("Export telemetry")
+        b.clicked.connect(self.exportTelemetry)
+        vl.addWidget(b)
+
+        self.mainLayout.addWidget(gb)
+
+        # The panel is only updated while the screen is shown
+        self.telemetryTimer = QTimer()
+        self.telemetryTimer.timeout.connect(self.updateTelemetry)
+
+        self.puzzleInitializedSignal.connect(lambda groupBox: groupBox.setEnabled(True))
+
+    def showEvent(self, event):
+        self.updateTelemetry()
+        self.telemetryTimer.start(1000)
+        event.accept()
+
+    def hideEvent(self, event):
+        self.telemetryTimer.stop()
+        event.accept()
+
+    def updateTelemetry(self):
+        """
+        Internal function which shows the current telemetry in the panel
+        """
+        telemetry = self.telemetryManager.getTelemetry()
+        rates = telemetry["rates"]
+        self.ratesLabel.setText(f"Sent: {rates['sent']} ({rates['sentPerS']:.1f}/s), received: {rates['received']} ({rates['receivedPerS']:.1f}/s)")
+
+        rows = [("All topics", None, telemetry["all"])] + [(topic, t, t) for topic, t in sorted(telemetry["topics"].items())]
+        self.telemetryTable.setRowCount(len(rows))
+        formatMs = lambda value: "-" if value is None else f"{value:.1f}"
+        for row, (topic, counters, latencies) in enumerate(rows):
+            values = [
+                topic,
+                "" if counters is None else str(counters["sent"]),
+                "" if counters is None else str(counters["received"]),
+                formatMs(latencies["roundTrip"]["p50"]),
+                formatMs(latencies["roundTrip"]["p99"]),
+                formatMs(latencies["handling"]["p50"]),
+                formatMs(latencies["broker"]["p50"]),
+                formatMs(latencies["broker"]["p99"]),
+                "" if counters is None else str(counters["ambiguous"]),
+            ]
+            for column, value in enumerate(values):
+                self.telemetryTable.setItem(row, column, QTableWidgetItem(value))
+        self.telemetryTable.resizeColumnsToContents()
+
+    def exportTelemetry(self):
+        """
+        Internal function which writes the telemetry with the latency histograms to a JSON file
+        """
+        path = Path(".", f"telemetry_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+        self.telemetryManager.exportTelemetry(path)
+        log(f"Exported telemetry to {path}")
     
     def initializeAll(self):
         """
@@ -74,11 +158,11 @@ class DebugScreen(GameWidget):
         """
         groupBox: QGroupBox
         puzzle: Puzzle
-        self.logBox.insertItem(0, f"{topic} - {payload}")
+        self.logView.append(topic, payload)
         for groupBox, puzzle in self.puzzleGroupBoxes:
             if topic == puzzle.mqttTopicGeneral:
                 if payload == initializeMessage:
-                    groupBox.setEnabled(True)
+                    self.puzzleInitializedSignal.emit(groupBox)
 
     def onConnect(self, code):
         """
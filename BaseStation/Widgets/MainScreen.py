@@ -1,84 +1,55 @@
 from PySide6.QtWidgets import QLabel, QPushButton
-from PySide6.QtCore import Qt, QTimer, QThread, Signal
+from PySide6.QtCore import Qt
 from typing import List
+from datetime import datetime
 
 import time
 
 from .GameWidget import GameWidget
-from .PuzzleDetailScreen import PuzzleDetailScreen
-from .FinishScreen import FinishScreen
-from .DebugScreen import DebugScreen
 
-from Classes.CommunicationManager import CommunicationManager, initializeMessage, initializeMessageAck, finishMessage, finishMessageAck
-from Classes.Puzzle import Puzzle, checkAllPuzzlesCompleted, checkAllPuzzlesInitialized
+from Classes.GameEngine import GameSnapshot
+from Classes.GameSession import GameSession
+from Classes.Puzzle import Puzzle
+from Classes.Journal import JournalState
 from Classes.Log import log
+from Classes.PresenceTracker import PresenceTracker
 from Classes.PointTracker import PointTracker
-
-gameTime = 60*60
-startPoints = 100
-
-class PuzzleInitializeThread(QThread):
-    """
-    Thread which periodically sends initialize messages to the puzzles until stopped via Thread.terminate()
-    """
-    def __init__(self, communicationManager: CommunicationManager, puzzles: List[Puzzle]):
-        super().__init__()
-        self.communicationManager = communicationManager
-        self.puzzles = puzzles
-    
-    def run(self):
-        while True:
-            for puzzle in self.puzzles:
-                if not puzzle.isInitialized:
-                    log(f"Sending activation message to: '{puzzle.name}'")
-                    self.communicationManager.publish(puzzle.mqttTopicGeneral, initializeMessage)
-                    time.sleep(0.5)
-            time.sleep(3)
+from Classes.UiUpdateCoalescer import UiUpdateCoalescer
 
 class MainScreen(GameWidget):
     """
     Class representing the main screen where the time, the points and the puzzles can be seen
     """
 
-    # Signals needed to be thread save because the communicationManager runs in a different thread
-    timerStartSignal = Signal() # Connect a function to the signal which will be called when the timer should be started
-    timerStopSignal = Signal() # Connect a function to the signal which will be called when the timer should be stopped
-    showFinishScreenSignal = Signal()  # Connect a function to the signal which will be called when the finish screen should be shown
-    setButtonFinishedSignal = Signal(QPushButton, Puzzle) # Connect a function to the signal which will be called when the button for the puzzle should be deactivated
-    setButtonInitializedSignal = Signal(QPushButton, Puzzle) # Connect a function to the signal which will be called when the button for the puzzle should be activated
-
-    def __init__(self, puzzles: List[Puzzle]):
+    def __init__(self, puzzles: List[Puzzle], resumeState: JournalState | None = None, presence: PresenceTracker | None = None):
         """
         Setup the UI and place the widgets on the screen
+
+        Pass the state replayed from the journal to resume a game, and the PresenceTracker of the start screen
         """
         super().__init__()
 
         self.puzzles = puzzles
+        self.resumeState = resumeState
 
-        self.debugScreen = DebugScreen(self.puzzles)
-        self.debugScreen.setWindowFlags(Qt.WindowType.WindowStaysOnTopHint)
+        self.onStateChange = None # Callback function called with the event and its data after every state transition, e.g. by the load test
 
-        self.communicationManager: CommunicationManager = CommunicationManager()
-        self.communicationManager.onConnect = self.onConnect
-        self.communicationManager.onDisconnect = self.onDisconnect
-        self.communicationManager.onMessage = self.onMessage
+        # The game itself runs without UI in the session, the screen only shows its changes
+        self.session = GameSession(self.puzzles, self.resumeState, presence=presence)
+        self.session.addListener(self.onGameChange)
+        self.session.presence.addListener(self.onPresenceChange)
+        self.engine = self.session.engine
+        self.communicationManager = self.session.communicationManager
+        self.shownSeconds: int | None = None # Remaining time posted to the timer label, only used on the engine thread
 
-        self.pointTracker = PointTracker()
-
-        self.puzzleInitializeThread: PuzzleInitializeThread = PuzzleInitializeThread(self.communicationManager, self.puzzles)
-        self.allInitialized: bool = False
-        self.secondsLeft: int = gameTime
-        self.points: int = 0
+        self.debugScreen = None # Created when it is opened for the first time
+        self.finishScreen = None # Created when the game is finished
 
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.updateTime)
+        self.pointTracker = PointTracker()
 
-        # Signal handling to be thread safe
-        self.timerStartSignal.connect(lambda: self.timer.start(1000))
-        self.timerStopSignal.connect(lambda: self.timer.stop())
-        self.showFinishScreenSignal.connect(self.showFinishScreen)
-        self.setButtonFinishedSignal.connect(self.setButtonFinished)
-        self.setButtonInitializedSignal.connect(self.setButtonInitialized)
+        # The session runs in different threads, so the widgets are only changed by posting updates,
+        # which are applied together in the GUI thread up to 30 times per second
+        self.uiUpdater = UiUpdateCoalescer()
 
         # UI        
         l = QLabel("Time left")
@@ -100,175 +71,176 @@ class MainScreen(GameWidget):
         self.mainLayout.addStretch()
 
         self.puzzleButtons = [] # Tuple of button and corresponing puzzle
+        self.buttonsByName = {} # Tuple of button and puzzle by puzzle name
         for puzzle in self.puzzles:
             b = QPushButton(f"Initializing '{puzzle.name}' ...")
             b.setEnabled(False)
             b.clicked.connect(lambda _, p=puzzle: self.showPuzzleDetails(p))
             self.puzzleButtons.append((b, puzzle))
+            self.buttonsByName[puzzle.name] = (b, puzzle)
             self.mainLayout.addWidget(b)
 
-    def showEvent(self, event):
-        self.communicationManager.start()
-        self.setTime(self.secondsLeft)
-        self.setPoints(startPoints, "Start")
-        self.puzzleInitializeThread.start()
+        if self.resumeState is not None:
+            self.restoreState(self.resumeState)
 
+    def showEvent(self, event):
+        self.showTime(self.session.getSnapshot().secondsLeft)
+        self.session.start()
         event.accept()
+
+    def restoreState(self, state: JournalState):
+        """
+        Internal function which restores the points, the time and the buttons of a game replayed from the journal
+        """
+        log(f"Resuming game with {state.secondsLeft} seconds and {state.points} points left")
+
+        for timestamp, points, event in state.pointsHistory:
+            self.pointTracker.setPoints(points, event, datetime.fromtimestamp(timestamp))
+        self.showPoints(state.points)
+
+        for button, puzzle in self.puzzleButtons:
+            if puzzle.isCompleted:
+                self.markButtonCompleted(button, puzzle)
+            elif puzzle.isInitialized:
+                button.setText(puzzle.name)
+                button.setEnabled(state.allInitialized)
     
     def keyPressEvent(self, event):
         # Open the debug window if the "d" key is pressed
         if event.key() == Qt.Key.Key_D:
+            if self.debugScreen is None:
+                from .DebugScreen import DebugScreen
+                self.debugScreen = DebugScreen(self.puzzles, self.communicationManager)
+                self.debugScreen.setWindowFlags(Qt.WindowType.WindowStaysOnTopHint)
             self.debugScreen.show()
             log("Opening debug widget")
         event.accept()
     
     def showPuzzleDetails(self, puzzle):
+        from .PuzzleDetailScreen import PuzzleDetailScreen
         self.puzzleDetailScreen = PuzzleDetailScreen(puzzle, self)
         self.puzzleDetailScreen.show()
 
-    def setPoints(self, points: int, event=None):
+    def showPoints(self, points: int):
         """
-        Call this function to update the points and to register an event on the pointTracker
+        Internal function which shows the points
         """
-        self.points = points
-        
-        pointsString = f"{self.points}"
-        self.pointsLabel.setText(pointsString)
+        self.pointsLabel.setText(f"{points}")
 
-        self.pointTracker.setPoints(points, event)
-    
-    def addPoints(self, points: int, event=None):
+    def showTime(self, seconds: int):
         """
-        Call this function to add points and to register an event on the pointTracker
+        Internal function which shows the remaining time in seconds
         """
-        self.setPoints(self.points + points, event)
-    
-    def subtractPoints(self, points: int, event=None):
-        """
-        Call this function to subtract points and to register an event on the pointTracker
-        """
-        self.setPoints(self.points - points, event)
-    
-    def setTime(self, seconds: int):
+        timeString = time.strftime('%H:%M:%S', time.gmtime(max(0, seconds)))
+        self.timerLabel.setText(timeString)
+
+    # Be carefull
+    # This is executed in the thread of the engine
+    def onGameChange(self, snapshot: GameSnapshot, events):
         """
-        Call this function to set the remaining time in seconds
+        Internal function needed for the GameSession
+
+        It posts the UI updates for the state transitions of the game
         """
-        self.secondsLeft = seconds
+        for event, data in events:
+            if self.onStateChange is not None:
+                self.onStateChange(event, data)
 
-        timeString = time.strftime('%H:%M:%S', time.gmtime(self.secondsLeft))
-        self.timerLabel.setText(timeString)
+            if event == "initialized":
+                button, puzzle = self.buttonsByName[data["puzzle"]]
+                # Posted for thread safety because layout can be changed here
+                self.uiUpdater.post(None, self.setButtonInitialized, button, puzzle)
+
+            elif event == "allInitialized":
+                # Enable all puzzle buttons when every puzzle is initialized
+                for button, _ in self.puzzleButtons:
+                    self.uiUpdater.post(None, button.setEnabled, True)
+
+            elif event == "completed":
+                button, puzzle = self.buttonsByName[data["puzzle"]]
+                # Posted for thread safety because layout can be changed here
+                self.uiUpdater.post(None, self.setButtonFinished, button, puzzle)
 
-    def updateTime(self):
+            elif event == "points":
+                self.pointTracker.setPoints(data["points"], data["label"])
+                self.uiUpdater.post("points", self.showPoints, snapshot.points)
+
+            elif event == "finished":
+                self.uiUpdater.post(None, self.showFinishScreen)
+
+        if snapshot.secondsLeft != self.shownSeconds:
+            self.shownSeconds = snapshot.secondsLeft
+            self.uiUpdater.post("time", self.showTime, snapshot.secondsLeft)
+
+    # Be carefull
+    # This is executed in another thread
+    def onPresenceChange(self, puzzleName: str, presence: dict):
         """
-        Function will be called by a timer timeout event to update the remaining time every second
+        Internal function needed for the PresenceTracker
         """
-        self.setTime(self.secondsLeft - 1)
+        if puzzleName in self.buttonsByName:
+            button, puzzle = self.buttonsByName[puzzleName]
+            self.uiUpdater.post(None, self.showPresence, button, puzzle, presence["status"])
 
-        if self.secondsLeft < 0:
-            self.showFinishScreen()
-    
     def showFinishScreen(self):
         """
         Call this function to show the finish screen and end the escape
         """
-        self.timerStopSignal.emit()
-        self.communicationManager.stop()
+        self.uiUpdater.stop()
+        self.session.stop()
         self.close()
 
-        if self.secondsLeft < 0:
-            self.finishScreen = FinishScreen(self.pointTracker, self.puzzles, self.points, 0)
-        else:
-            self.finishScreen = FinishScreen(self.pointTracker, self.puzzles, self.points, self.secondsLeft)
+        from .FinishScreen import FinishScreen
+        snapshot = self.session.getSnapshot()
+        self.finishScreen = FinishScreen(self.pointTracker, self.puzzles, snapshot.points, max(0, snapshot.secondsLeft))
         self.finishScreen.show()
 
-    # Be carefull
-    # This is executed in another thread
-    def onMessage(self, topic: str, payload: str):
+    def shutdown(self):
         """
-        Internal function needed for the CommunicationManager
+        Stops the game and closes this screen and the screens opened from it, e.g. before the application exits
 
-        It receives the messages sent by the puzzles and updates the corresponding UI elements
+        The widgets are deleted by the event loop, so the QApplication must process its events afterwards
         """
-        button: QPushButton
-        puzzle: Puzzle
-        for button, puzzle in self.puzzleButtons:
-
-            if topic == puzzle.mqttTopicGeneral:
-                if payload == initializeMessageAck:
-                    if not puzzle.isCompleted and not puzzle.isInitialized:
-                        # Signals for thread safety because layout can be changed here
-                        self.setButtonInitializedSignal.emit(button, puzzle)
-                        puzzle.isInitialized = True
-
-                elif payload == finishMessage:
-                    self.communicationManager.publish(puzzle.mqttTopicGeneral, finishMessageAck)
-                    if not puzzle.isCompleted and self.allInitialized:
-                        # Signals for thread safety because layout can be changed here
-                        self.setButtonFinishedSignal.emit(button, puzzle)
-                        puzzle.isCompleted = True
-            
-            elif topic == puzzle.mqttTopicPoints:
-                if not puzzle.isCompleted and puzzle.isInitialized:
-                    try:
-                        points = int(payload)
-                        self.subtractPoints(points)
-                    except:
-                        log(f"Cannot convert payload to int: {topic} {payload}")
-        
-        if not self.allInitialized: # Only do this once
-            if checkAllPuzzlesInitialized(self.puzzles):
-                log("All puzzles initialized")
-                self.puzzleInitializeThread.terminate()
-                log("Terminated puzzleInitializeThread")
-                self.timerStartSignal.emit()
-                log("Sending timer start signal")
-
-                # Enable all puzzle buttons when every puzzle is initialized
-                for button, _ in self.puzzleButtons:
-                    button.setEnabled(True)
-
-                self.allInitialized = True
+        self.uiUpdater.stop()
+        self.session.stop()
+        for screen in [self.debugScreen, self.finishScreen]:
+            if screen is not None:
+                screen.close()
+                screen.deleteLater()
+        self.debugScreen = None
+        self.finishScreen = None
+        self.close()
+        self.deleteLater()
 
-        if checkAllPuzzlesCompleted(self.puzzles):
-            self.showFinishScreenSignal.emit()
-    
     def setButtonInitialized(self, button: QPushButton, puzzle: Puzzle):
         """
         Internal function to set the text of the button
         """
-        log(f"Initialization done: '{puzzle.name}'")
         button.setText(puzzle.name)
 
+    def showPresence(self, button: QPushButton, puzzle: Puzzle, status: str):
+        """
+        Internal function to mark the button of a puzzle which is offline
+        """
+        # The button of a completed puzzle may already be replaced
+        if puzzle.isCompleted:
+            return
+        text = puzzle.name if puzzle.isInitialized else f"Initializing '{puzzle.name}' ..."
+        button.setText(f"{text} (offline)" if status == "offline" else text)
+
     def setButtonFinished(self, button: QPushButton, puzzle: Puzzle):
         """
         Internal function to set the text of the button after a puzzle is finishd or to show the hint the puzzle reveled
         """
-        log(f"Puzzle complete: '{puzzle.name}'")
-        self.addPoints(puzzle.points, puzzle.name)
+        self.markButtonCompleted(button, puzzle)
 
+    def markButtonCompleted(self, button: QPushButton, puzzle: Puzzle):
+        """
+        Internal function to deactivate the button of a completed puzzle
+        """
         button.setEnabled(False)
         if puzzle.revealAfterFinish is not None:
             self.mainLayout.replaceWidget(button, QLabel(f"Completing {puzzle.name} revealed: {puzzle.revealAfterFinish}"))
             button.deleteLater()
         else:
             button.setText("Completed")
-            
-
-    # Be carefull
-    # This is executed in another thread
-    def onConnect(self, code):
-        """
-        Internal function needed for the CommunicationManager
-        """
-        log(f"Connected with result code: {code} to MQTT Broker")
-
-        for puzzle in self.puzzles:
-            self.communicationManager.subscribe(f"{puzzle.mqttTopic}/#")
-    
-    # Be carefull
-    # This is executed in another thread
-    def onDisconnect(self, code):
-        """
-        Internal function needed for the CommunicationManager
-        """
-        log(f"Disconnected with result code: {code}")
\ No newline at end of file
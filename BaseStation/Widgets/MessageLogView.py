@@ -0,0 +1,196 @@
+from PySide6.QtWidgets import QWidget, QLabel, QPushButton, QHBoxLayout, QVBoxLayout, QLineEdit, QListView
+from PySide6.QtCore import Qt, QAbstractListModel, QModelIndex, QSortFilterProxyModel, QTimer
+from datetime import datetime
+
+import paho.mqtt.client as mqtt
+
+from Classes.MessageLog import MessageLog
+
+topicRole = Qt.ItemDataRole.UserRole
+payloadRole = Qt.ItemDataRole.UserRole + 1
+
+class MessageLogModel(QAbstractListModel):
+    """
+    List model of a MessageLog, the newest message in the first row
+
+    The pending messages of the log are only added to the model by addPending(), so the rows are inserted
+    in batches on the UI thread instead of one by one for every message
+    """
+    def __init__(self, messageLog: MessageLog):
+        super().__init__()
+        self.messageLog = messageLog
+        self.paused: bool = False
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.messageLog)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.messageLog):
+            return None
+        receivedTime, topic, payload = self.messageLog.get(index.row())
+        if role == Qt.ItemDataRole.DisplayRole:
+            return f"{datetime.fromtimestamp(receivedTime).strftime('%H:%M:%S.%f')[:-3]}  {topic} - {payload}"
+        if role == topicRole:
+            return topic
+        if role == payloadRole:
+            return payload
+        return None
+
+    def addPending(self):
+        """
+        Adds the pending messages of the log, unless the model is paused, and returns the number of added rows
+        """
+        if self.paused:
+            return 0
+        entries = self.messageLog.takePending()
+        if len(entries) == 0:
+            return 0
+
+        overflow = self.messageLog.getOverflow(len(entries))
+        if overflow > 0:
+            rowCount = len(self.messageLog)
+            self.beginRemoveRows(QModelIndex(), rowCount - overflow, rowCount - 1)
+            self.messageLog.removeOldest(overflow)
+            self.endRemoveRows()
+
+        self.beginInsertRows(QModelIndex(), 0, len(entries) - 1)
+        self.messageLog.extend(entries)
+        self.endInsertRows()
+        return len(entries)
+
+    def clear(self):
+        """
+        Removes all shown messages
+        """
+        self.beginResetModel()
+        self.messageLog.clear()
+        self.endResetModel()
+
+class MessageLogFilter(QSortFilterProxyModel):
+    """
+    Proxy model which only accepts the messages matching the topic filter and containing the payload filter
+
+    The topic filter is an MQTT topic filter if it contains a wildcard (+ or #), otherwise it must be part of the topic
+    """
+    def __init__(self):
+        super().__init__()
+        self.topicFilter: str = ""
+        self.payloadFilter: str = ""
+
+    def setFilters(self, topicFilter: str, payloadFilter: str):
+        self.topicFilter = topicFilter.strip()
+        self.payloadFilter = payloadFilter.strip().lower()
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, sourceRow, sourceParent):
+        if self.topicFilter == "" and self.payloadFilter == "":
+            return True
+
+        model = self.sourceModel()
+        index = model.index(sourceRow, 0, sourceParent)
+        if self.topicFilter != "":
+            topic = model.data(index, topicRole)
+            if "+" in self.topicFilter or "#" in self.topicFilter:
+                if not mqtt.topic_matches_sub(self.topicFilter, topic):
+                    return False
+            elif self.topicFilter not in topic:
+                return False
+        if self.payloadFilter != "" and self.payloadFilter not in model.data(index, payloadRole).lower():
+            return False
+        return True
+
+class MessageLogView(QWidget):
+    """
+    Widget which shows the last capacity received messages with filters for the topic and the payload
+
+    append() can be called from any thread. Only the rows which are visible are rendered and the new messages
+    are added every updateInterval ms while the widget is shown, so the cost per message and the memory stay
+    the same no matter how long the game runs.
+    """
+
+    updateInterval: int = 100 # ms between two updates of the list
+
+    def __init__(self, capacity: int = 10000):
+        super().__init__()
+        self.messageLog = MessageLog(capacity)
+        self.model = MessageLogModel(self.messageLog)
+        self.filterModel = MessageLogFilter()
+        self.filterModel.setSourceModel(self.model)
+
+        vl = QVBoxLayout()
+        vl.setContentsMargins(0, 0, 0, 0)
+        self.setLayout(vl)
+
+        hl = QHBoxLayout()
+        self.topicFilterEdit = QLineEdit()
+        self.topicFilterEdit.setPlaceholderText("Filter topic (e.g. +/points)")
+        self.topicFilterEdit.textChanged.connect(self.updateFilters)
+        hl.addWidget(self.topicFilterEdit)
+
+        self.payloadFilterEdit = QLineEdit()
+        self.payloadFilterEdit.setPlaceholderText("Filter payload")
+        self.payloadFilterEdit.textChanged.connect(self.updateFilters)
+        hl.addWidget(self.payloadFilterEdit)
+
+        self.pauseButton = QPushButton("Pause")
+        self.pauseButton.setCheckable(True)
+        self.pauseButton.toggled.connect(self.setPaused)
+        hl.addWidget(self.pauseButton)
+
+        b = QPushButton("Clear")
+        b.clicked.connect(self.model.clear)
+        hl.addWidget(b)
+        vl.addLayout(hl)
+
+        self.listView = QListView()
+        self.listView.setModel(self.filterModel)
+        self.listView.setUniformItemSizes(True) # Row heights are not measured, only the visible rows are rendered
+        vl.addWidget(self.listView)
+
+        self.statisticsLabel = QLabel()
+        vl.addWidget(self.statisticsLabel)
+
+        self.updateTimer = QTimer()
+        self.updateTimer.timeout.connect(self.refresh)
+
+    def append(self, topic: str, payload: str):
+        """
+        Adds a received message, can be called from any thread
+        """
+        self.messageLog.append(topic, payload)
+
+    def showEvent(self, event):
+        self.refresh()
+        self.updateTimer.start(self.updateInterval)
+        event.accept()
+
+    def hideEvent(self, event):
+        self.updateTimer.stop()
+        event.accept()
+
+    def refresh(self):
+        """
+        Internal function which adds the pending messages to the list and shows the counters
+        """
+        self.model.addPending()
+        s = self.messageLog.getStatistics()
+        text = f"Showing {self.filterModel.rowCount()} of {s['stored']} messages, received {s['received']}, dropped {s['dropped']}"
+        if self.model.paused:
+            text += f", paused with {s['pending']} new messages"
+        self.statisticsLabel.setText(text)
+
+    def setPaused(self, paused: bool):
+        """
+        Internal function which stops or continues adding new messages to the list
+        """
+        self.model.paused = paused
+        self.pauseButton.setText("Resume" if paused else "Pause")
+        self.refresh()
+
+    def updateFilters(self):
+        """
+        Internal function which applies the text of the filter fields
+        """
+        self.filterModel.setFilters(self.topicFilterEdit.text(), self.payloadFilterEdit.text())
@@ -57,10 +57,8 @@ class PuzzleDetailScreen(GameWidget):
         """
         Internal function used to display a bought hint and deduct points
         """
-        # Only allow to buy a hint if the user has enough points
-        if self.mainScreen.points - hint.points >= 0:
-            hint.isUsed = True
-            self.puzzle.nextHint += 1
+        # The engine only sells the hint if the user has enough points, it also subtracts the points
+        if self.mainScreen.session.buyHint(self.puzzle.name).result():
             b: QPushButton
             for count, b in enumerate(self.buttons):
                 if count+1 == self.puzzle.nextHint:
@@ -72,5 +70,4 @@ class PuzzleDetailScreen(GameWidget):
                     child.deleteLater()
             
             l = QLabel(hint.text)
-            groupBoxLayout.addWidget(l)
-            self.mainScreen.subtractPoints(hint.points, f"Hint used\n{self.puzzle.name}")
\ No newline at end of file
+            groupBoxLayout.addWidget(l)
\ No newline at end of file
@@ -1,11 +1,11 @@
 from PySide6.QtWidgets import QLabel, QPushButton, QCheckBox, QGroupBox, QVBoxLayout
-from PySide6.QtCore import Qt
+from PySide6.QtCore import Qt, Signal, QTimer
 from typing import List
 
 from .GameWidget import GameWidget
-from .MainScreen import MainScreen
 from Classes.Log import log
 from Classes.Puzzle import Puzzle
+from Classes.PuzzleCatalog import PuzzleCatalog
 
 story = """
 Prof. L. Toiz took over the lecture for Nonlinear electrical systems (NES) two years ago, since then not a single student passed its crazy difficult final exam. You are a group of students who tried it the fifth time this morning, the last possible time before you would be exmatriculated forever.
@@ -23,13 +23,26 @@ class StartScreen(GameWidget):
     """
     Class representing the start screen widget, where the puzzles can be selected which are beeing played
     """
-        
-    def __init__(self, puzzles: List[Puzzle]):
+
+    puzzlesChangedSignal = Signal(list) # Emitted by the watcher thread of the catalog when the puzzle configs changed
+    presenceChangedSignal = Signal(str, dict) # Emitted by the PresenceTracker when a puzzle went online or offline
+
+    presenceDelay: int = 200 # ms after the screen is shown until the connection to the broker is started
+
+    def __init__(self, puzzles: List[Puzzle], catalog: PuzzleCatalog | None = None):
         """
         Setup the UI and place the widgets on the screen
+
+        If a catalog is passed, its folder is watched while the screen is shown and the list of puzzles is updated.
+        Whether the puzzles are online is shown next to their names, from their retained status messages
         """
         super().__init__()
         self.puzzles = puzzles
+        self.catalog = catalog
+        self.puzzlesChangedSignal.connect(self.setPuzzles)
+        self.presenceChangedSignal.connect(self.showPresence)
+        self.presence = None # Started after the screen is shown, so the broker connection does not delay the start
+        self.presenceListener = lambda name, presence: self.presenceChangedSignal.emit(name, presence)
 
         l = QLabel(f"Welcome to the escape from the\n'Crazy Professor'")
         l.setStyleSheet(f"font-size: {self.fontSizeLarge}px")
@@ -47,19 +60,67 @@ class StartScreen(GameWidget):
         self.mainLayout.addWidget(l)
 
         gb = QGroupBox("Available puzzles")
-        gbl = QVBoxLayout()
-        gb.setLayout(gbl)
+        self.puzzleLayout = QVBoxLayout()
+        gb.setLayout(self.puzzleLayout)
         self.puzzleCheckBoxes = []
-        for puzzle in self.puzzles:
-            c = QCheckBox(puzzle.name)
-            c.setChecked(True)
-            self.puzzleCheckBoxes.append((c, puzzle))
-            gbl.addWidget(c)
+        self.setPuzzles(self.puzzles)
         self.mainLayout.addWidget(gb)
 
         b = QPushButton("Start")
         b.clicked.connect(self.startGame)
         self.mainLayout.addWidget(b)
+
+    def showEvent(self, event):
+        if self.catalog is not None:
+            self.catalog.onChange = self.puzzlesChangedSignal.emit
+            self.catalog.start()
+        if self.presence is None:
+            QTimer.singleShot(self.presenceDelay, self.startPresence)
+        event.accept()
+
+    def startPresence(self):
+        """
+        Starts tracking whether the puzzles are online
+        """
+        # The game may have been started before the timer fired
+        if self.presence is not None or not self.isVisible():
+            return
+
+        # Imported here, so the communication is only loaded after the screen is shown
+        from Classes.PresenceTracker import PresenceTracker
+        self.presence = PresenceTracker(self.puzzles)
+        self.presence.addListener(self.presenceListener)
+        self.presence.start()
+
+    def setPuzzles(self, puzzles: List[Puzzle]):
+        """
+        Shows a checkbox for every puzzle, puzzles which were deselected before stay deselected
+        """
+        deselected = [puzzle.name for c, puzzle in self.puzzleCheckBoxes if not c.isChecked()]
+        for c, _ in self.puzzleCheckBoxes:
+            self.puzzleLayout.removeWidget(c)
+            c.deleteLater()
+
+        self.puzzles = puzzles
+        self.puzzleCheckBoxes = []
+        for puzzle in self.puzzles:
+            c = QCheckBox(puzzle.name)
+            c.setChecked(puzzle.name not in deselected)
+            self.puzzleCheckBoxes.append((c, puzzle))
+            self.puzzleLayout.addWidget(c)
+
+        if self.presence is not None:
+            self.presence.setPuzzles(self.puzzles)
+            for name, presence in self.presence.getAll().items():
+                self.showPresence(name, presence)
+
+    def showPresence(self, puzzleName: str, presence: dict):
+        """
+        Shows whether the puzzle is online next to its name
+        """
+        for c, puzzle in self.puzzleCheckBoxes:
+            if puzzle.name == puzzleName:
+                c.setText(puzzle.name if presence["status"] == "unknown" else f"{puzzle.name} ({presence['status']})")
     
     def startGame(self):
         """
@@ -76,7 +137,18 @@ class StartScreen(GameWidget):
         
         log(f"Selected puzzle: '{[p.name for p in selectedPuzzles]}' for play")
 
+        # The puzzles of a running game are not changed anymore
+        if self.catalog is not None:
+            self.catalog.stop()
+            self.catalog.onChange = None
+
+        # The session continues with the presence known so far
+        if self.presence is not None:
+            self.presence.removeListener(self.presenceListener)
+
         self.close()
 
-        self.mainScreen = MainScreen(selectedPuzzles)
+        # Imported here, so the other screens are only loaded when the game starts
+        from .MainScreen import MainScreen
+        self.mainScreen = MainScreen(selectedPuzzles, presence=self.presence)
         self.mainScreen.show()
\ No newline at end of file
@@ -0,0 +1,84 @@
+"""
+Runs the base station without UI, e.g. on the monitoring station of the game master
+
+The game is the same as in main.py, but instead of the Qt screens a web dashboard shows the time, the points
+and the state of the puzzles and can buy hints. Any number of browsers can open the dashboard.
+Qt is not imported, so PySide6 does not need to be installed.
+
+An unfinished game in the journal is resumed like in main.py.
+
+Usage:
+    python headless.py                                  # All puzzles of the Puzzles folder
+    python headless.py --puzzles "Tilt Maze" "Rotary Phone" --port 8080
+"""
+
+import argparse
+import os
+import sys
+from pathlib import Path
+from dotenv import load_dotenv
+
+from Classes.DashboardServer import DashboardHub, DashboardServer
+from Classes.GameSession import GameSession
+from Classes.Journal import replayJournal, defaultJournalPath
+from Classes.Log import log, initLogger
+from Classes.MqttBroker import startEmbeddedBroker
+from Classes.PuzzleCatalog import PuzzleCatalog
+
+def main():
+    parser = argparse.ArgumentParser(description="Base station without UI, with a web dashboard")
+    parser.add_argument("--puzzles", nargs="+", default=None, help="Names of the puzzles to play, all puzzles if not set")
+    parser.add_argument("--host", default="0.0.0.0", help="Address of the dashboard")
+    parser.add_argument("--port", type=int, default=8080, help="Port of the dashboard")
+    parser.add_argument("--exit-when-finished", action="store_true", help="Stop the dashboard when the game is finished")
+    args = parser.parse_args()
+
+    initLogger(Path(".", "log.jsonl"))
+    log("Starting headless base station ...")
+    load_dotenv() # MQTT_BROKER, MQTT_PORT, MQTT_USER and MQTT_PW are read by the MqttConnection
+    broker = startEmbeddedBroker() if os.getenv("MQTT_EMBEDDED_BROKER", "0") == "1" else None
+
+    catalog = PuzzleCatalog(Path(".", "Puzzles"))
+    puzzles = catalog.load()
+
+    resumeState = replayJournal(defaultJournalPath)
+    if resumeState is not None:
+        selectedPuzzles = [p for p in puzzles if p.name in resumeState.puzzleNames]
+    elif args.puzzles is not None:
+        selectedPuzzles = [p for p in puzzles if p.name in args.puzzles]
+        unknown = set(args.puzzles) - set([p.name for p in selectedPuzzles])
+        if len(unknown) > 0:
+            print(f"Unknown puzzles: {', '.join(sorted(unknown))}")
+            sys.exit(1)
+    else:
+        selectedPuzzles = puzzles
+
+    for puzzle in selectedPuzzles:
+        puzzle.isSelectedForPlay = True
+    log(f"{'Resuming' if resumeState is not None else 'Starting'} game with puzzles: '{[p.name for p in selectedPuzzles]}'")
+
+    session = GameSession(selectedPuzzles, resumeState)
+    hub = DashboardHub(selectedPuzzles, session.getSnapshot())
+    session.addListener(hub.update)
+    server = DashboardServer(hub, session, args.host, args.port)
+    server.start()
+    session.start()
+
+    try:
+        while not session.waitUntilFinished(1):
+            pass
+        if not args.exit_when_finished:
+            log("Game finished, the dashboard keeps running until Ctrl+C is pressed")
+            while True:
+                session.finished.wait(60)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        session.stop()
+        server.stop()
+        if broker is not None:
+            broker.stop()
+        log("Leaving headless base station ...")
+
+if __name__ == "__main__":
+    main()
@@ -1,32 +1,54 @@
-import sys
 import os
+import sys
+import time
 from pathlib import Path
 from dotenv import load_dotenv
 
-from Classes.Puzzle import getAllPuzzlesFromFolder
+from Classes.PuzzleCatalog import PuzzleCatalog
 from Classes.Log import log, initLogger
+from Classes.Journal import replayJournal, defaultJournalPath
 from PySide6.QtWidgets import QApplication
 from Widgets.StartScreen import StartScreen
-from Classes.CommunicationManager import CommunicationManager
 
-initLogger(Path(".", "log.txt"))
+initLogger(Path(".", "log.jsonl"))
 log("Starting Application ...")
 
 log("Loading environment variables")
-load_dotenv()
-CommunicationManager.mqttBroker = os.getenv("MQTT_BROKER", "mqtt.eclipseprojects.io")
-CommunicationManager.mqttPort = int(os.getenv("MQTT_PORT", "1883"))
-CommunicationManager.mqttUser = os.getenv("MQTT_USER", "")
-CommunicationManager.mqttPw = os.getenv("MQTT_PW", "")
+load_dotenv() # MQTT_BROKER, MQTT_PORT, MQTT_USER and MQTT_PW are read by the MqttConnection when the game starts
+
+broker = None
+if os.getenv("MQTT_EMBEDDED_BROKER", "0") == "1":
+    log("Starting the embedded MQTT broker")
+    from Classes.MqttBroker import startEmbeddedBroker
+    broker = startEmbeddedBroker()
 
 log("Getting available puzzles from folder")
-puzzles = getAllPuzzlesFromFolder(Path(".", "Puzzles"))
+catalog = PuzzleCatalog(Path(".", "Puzzles"))
+puzzles = catalog.load()
+
+log("Checking the journal for a game to resume")
+replayStart = time.perf_counter()
+resumeState = replayJournal(defaultJournalPath)
+log(f"Replayed journal in {(time.perf_counter() - replayStart) * 1000:.1f} ms")
 
 log("Creating QApplication")
 app = QApplication(sys.argv)
 
-startScreen = StartScreen(puzzles)
-startScreen.show()
+if resumeState is None:
+    startScreen = StartScreen(puzzles, catalog)
+    startScreen.show()
+else:
+    from Widgets.MainScreen import MainScreen
+
+    selectedPuzzles = [p for p in puzzles if p.name in resumeState.puzzleNames]
+    for puzzle in selectedPuzzles:
+        puzzle.isSelectedForPlay = True
+    log(f"Resuming game with puzzles: '{[p.name for p in selectedPuzzles]}'")
+
+    mainScreen = MainScreen(selectedPuzzles, resumeState)
+    mainScreen.show()
 
 app.exec() # UI loop, lines after this are only executed when all windows are closed
+if broker is not None:
+    broker.stop()
 log("Leaving Application ...")
\ No newline at end of file
@@ -0,0 +1,80 @@
+"""
+Runs several escape rooms from one base station, each room in its own worker process
+
+The rooms are read from a JSON file with the names of the puzzles by room name:
+
+    {"red": ["Tilt Maze", "Rotary Phone"], "blue": ["Tilt Maze"]}
+
+The puzzles of a room use the topics rooms/<room>/<topic of the puzzle>, e.g. rooms/red/tilt_maze/general.
+Unfinished games are resumed from the journals in the journals folder.
+The health of the rooms is served as JSON on port 8090, see SupervisorServer in Classes/RoomSupervisor.py.
+
+Usage:
+    python supervisor.py rooms.json
+    python supervisor.py rooms.json --workers 2 --port 8090
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from dotenv import load_dotenv
+
+from Classes.Log import log, initLogger
+from Classes.MqttBroker import startEmbeddedBroker
+from Classes.PuzzleCatalog import PuzzleCatalog
+from Classes.RoomSupervisor import RoomSupervisor, SupervisorServer, getRoomPuzzles
+
+def main():
+    parser = argparse.ArgumentParser(description="Base station for several rooms, with the health of the rooms as JSON")
+    parser.add_argument("rooms", type=Path, help="JSON file with the names of the puzzles by room name")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes, by default one per room up to the number of CPUs")
+    parser.add_argument("--journals", type=Path, default=Path(".", "journals"), help="Folder of the journals of the rooms")
+    parser.add_argument("--host", default="0.0.0.0", help="Address of the health server")
+    parser.add_argument("--port", type=int, default=8090, help="Port of the health server")
+    args = parser.parse_args()
+
+    initLogger(Path(".", "log.jsonl"))
+    log("Starting room supervisor ...")
+    load_dotenv() # MQTT_BROKER, MQTT_PORT, MQTT_USER and MQTT_PW are read by the MqttConnection
+    broker = startEmbeddedBroker() if os.getenv("MQTT_EMBEDDED_BROKER", "0") == "1" else None
+
+    with open(args.rooms) as f:
+        roomConfig = json.load(f)
+
+    catalog = PuzzleCatalog(Path(".", "Puzzles"))
+    puzzlesByName = {p.name: p for p in catalog.load()}
+
+    rooms = {}
+    for roomName, puzzleNames in roomConfig.items():
+        unknown = [name for name in puzzleNames if name not in puzzlesByName]
+        if len(unknown) > 0:
+            print(f"Unknown puzzles in room '{roomName}': {', '.join(unknown)}")
+            sys.exit(1)
+        try:
+            rooms[roomName] = getRoomPuzzles([puzzlesByName[name] for name in puzzleNames], roomName)
+        except ValueError as ex:
+            print(ex)
+            sys.exit(1)
+
+    supervisor = RoomSupervisor(rooms, args.workers, args.journals, Path("."))
+    server = SupervisorServer(supervisor, args.host, args.port)
+    supervisor.start()
+    server.start()
+
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        supervisor.stop()
+        if broker is not None:
+            broker.stop()
+        log("Leaving room supervisor ...")
+
+if __name__ == "__main__":
+    main()
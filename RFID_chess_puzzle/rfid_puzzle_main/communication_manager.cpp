@@ -11,10 +11,11 @@ void client_reconnect() {
 
   bool return_value;
   while (!client.connected()) {
+    // The broker publishes the retained will "offline" at the status topic when the connection is lost
     #if MQTT_NEEDS_USER == 1
-      return_value = client.connect(client_id, mqtt_username, mqtt_password);
+      return_value = client.connect(client_id, mqtt_username, mqtt_password, mqtt_topic_status, 1, true, "offline");
     #else
-      return_value = client.connect(client_id);
+      return_value = client.connect(client_id, mqtt_topic_status, 1, true, "offline");
     #endif
 
     if (return_value) {
@@ -39,6 +40,9 @@ void client_reconnect() {
       Serial.println(mqtt_topic_general);
     }
   #endif
+
+  // Retained, so the base station knows that the puzzle is online without asking it
+  client.publish(mqtt_topic_status, "online", true);
 }
 
 void setup_communication() {
@@ -73,14 +77,13 @@ void setup_communication() {
   #endif
 
   // Setup MQTT parameter
-  client.setKeepAlive(90);
+  // The broker publishes the will after 1.5 times the keep alive without a packet
+  client.setKeepAlive(30);
   client.setServer(mqtt_broker, mqtt_port);
   client.setCallback(mqtt_callback);
 
   // Use defined function to connect to MQTT server
   client_reconnect();
-  // Publish a hello message
-  client.publish(mqtt_topic_general, "I am online");
 }
 
 void loop_communication() {
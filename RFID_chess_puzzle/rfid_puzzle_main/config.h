@@ -23,6 +23,7 @@ static const char* mqtt_username = "user";
 static const char* mqtt_password = "user";
 static const char* mqtt_topic_general = "rfid/puz2/general";
 static const char* mqtt_topic_points = "rfid/puz2/points";
+static const char* mqtt_topic_status = "rfid/puz2/status";
 
 /*
  * Enables or disables debug output via Serial.
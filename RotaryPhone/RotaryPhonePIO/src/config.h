@@ -25,6 +25,24 @@ static const char* mqtt_username = MQTT_USERNAME;
 static const char* mqtt_password = MQTT_PASSWORD;
 static const char* mqtt_topic_general = MQTT_TOPIC_GENERAL;
 static const char* mqtt_topic_points = MQTT_TOPIC_POINTS;
+#ifdef MQTT_TOPIC_STATUS
+static const char* mqtt_topic_status = MQTT_TOPIC_STATUS;
+#else
+/*
+ * Older credentials.h files have no MQTT_TOPIC_STATUS, the status topic is derived from the general topic
+ * like the base station does: <topic>/general -> <topic>/status
+*/
+#include <stdio.h>
+#include <string.h>
+static const char* derive_status_topic(const char* general_topic) {
+  static char topic[128];
+  const char* slash = strrchr(general_topic, '/');
+  int base_length = slash != NULL ? (int)(slash - general_topic) : (int)strlen(general_topic);
+  snprintf(topic, sizeof(topic), "%.*s/status", base_length, general_topic);
+  return topic;
+}
+static const char* mqtt_topic_status = derive_status_topic(MQTT_TOPIC_GENERAL);
+#endif
 
 /*
  * Enables or disables debug output via Serial.
@@ -10,5 +10,6 @@
 #define MQTT_PASSWORD "user"
 #define MQTT_TOPIC_GENERAL "topic/general"
 #define MQTT_TOPIC_POINTS "topic/points"
+#define MQTT_TOPIC_STATUS "topic/status"
 
 #endif // CREDENTIALS_H
\ No newline at end of file
@@ -23,6 +23,7 @@ static const char* mqtt_username = "TODO";
 static const char* mqtt_password = "TODO";
 static const char* mqtt_topic_general = "TODO";
 static const char* mqtt_topic_points = "TODO";
+static const char* mqtt_topic_status = "TODO";
 
 /*
  * GPIO Settings
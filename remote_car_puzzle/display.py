@@ -1,60 +1,551 @@
-from picamera2 import Picamera2
 import cv2
 from pyzbar.pyzbar import decode
 import time
 import numpy as np
 import threading
+from frame_source import PicameraSource
 
-class CameraStreamer:
+def decode_codes(img, scale=1.0):
+    """
+    Decodes the QR codes in a BGR or grayscale frame on a grayscale copy scaled by scale,
+    returns a list of (data, polygon) with the polygon in the coordinates of the frame.
+    """
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    if scale != 1.0:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    codes = []
+    for obj in decode(gray):
+        pts = obj.polygon
+        polygon = [(int(pt.x / scale), int(pt.y / scale)) for pt in pts] if pts and len(pts) == 4 else None
+        codes.append((obj.data.decode('utf-8'), polygon))
+    return codes
+
+def polygon_bounds(polygon):
+    """Returns the bounding rectangle (x, y, w, h) of a polygon."""
+    xs = [x for x, _ in polygon]
+    ys = [y for _, y in polygon]
+    return (min(xs), min(ys), max(xs) - min(xs), max(ys) - min(ys))
+
+class RegionTracker:
+    """
+    Finds the regions of a frame which need decoding.
+
+    Every frame is reduced to a small grayscale thumbnail and compared with the thumbnail of the last frame
+    which changed. Only where the picture changed a new code can have appeared, so an unchanged frame needs
+    no decode at all and a small change only the regions around it, together with the regions of the known
+    codes the change touches, so their overlays follow them. A change within the region of a code which was
+    decoded a moment ago is only the code moving, it is decoded again after recheck_interval.
+    Slow changes add up until they are noticed, as the reference thumbnail is only replaced by a frame which changed.
+    """
+    thumbnail_size = (80, 60)  # One thumbnail pixel is the average of 8x8 pixels, which hides the sensor noise
+    threshold = 12  # Gray levels a thumbnail pixel must change to count as motion
+    margin = 24  # Pixels added around every region, so a code at the border of a region is not cut
+    code_timeout = 5.0  # Seconds the region of a decoded code is tracked
+    recheck_interval = 0.25  # Seconds until a moving known code is decoded again, shorter than the overlay timeout
+
+    def __init__(self, size):
+        self.size = size
+        self.reference = None
+        self.moved = False  # Whether the last frame changed, even if only known codes moved
+        self.codes = {}  # (bounding rectangle, time last decoded) by data
+
+    def changed_regions(self, gray):
+        """
+        Returns the rectangles (x, y, w, h) of the frame which changed, merged and with margin,
+        [] if nothing changed and None for the first frame, which must be decoded completely.
+        """
+        thumbnail = cv2.resize(gray, self.thumbnail_size, interpolation=cv2.INTER_AREA)
+        if self.reference is None:
+            self.reference = thumbnail
+            self.moved = True
+            return None
+        mask = (cv2.absdiff(thumbnail, self.reference) > self.threshold).astype(np.uint8)
+        self.moved = bool(mask.any())
+        if not self.moved:
+            return []
+        self.reference = thumbnail
+
+        now = time.perf_counter()
+        for data, (rect, seen) in list(self.codes.items()):
+            if now - seen > self.code_timeout:
+                del self.codes[data]
+        # The quiet zone and the paper around a code move with it, so the motion of a code covers more than its polygon
+        recent = [self._expand(rect, max(rect[2], rect[3]) // 2) for rect, seen in self.codes.values()
+                  if now - seen < self.recheck_interval]
+
+        fx = self.size[0] / self.thumbnail_size[0]
+        fy = self.size[1] / self.thumbnail_size[1]
+        count, _, components, _ = cv2.connectedComponentsWithStats(cv2.dilate(mask, np.ones((3, 3), np.uint8)))
+        regions = []
+        for x, y, w, h, _ in components[1:count]:
+            rect = (x * fx, y * fy, w * fx, h * fy)
+            if not any(self._contains(known, rect) for known in recent):
+                regions.append(self._expand(rect))
+        for rect, _ in self.codes.values():
+            if any(self._overlap(rect, region) for region in regions):
+                regions.append(self._expand(rect))
+        return self._merge(regions)
+
+    def code_seen(self, data, polygon):
+        self.codes[data] = (polygon_bounds(polygon), time.perf_counter())
+
+    def _expand(self, rect, margin=None):
+        margin = self.margin if margin is None else margin
+        x, y, w, h = rect
+        left = max(0, int(x) - margin)
+        top = max(0, int(y) - margin)
+        right = min(self.size[0], int(x + w) + margin)
+        bottom = min(self.size[1], int(y + h) + margin)
+        return (left, top, right - left, bottom - top)
+
+    @staticmethod
+    def _contains(outer, inner):
+        return (outer[0] <= inner[0] and outer[1] <= inner[1]
+                and inner[0] + inner[2] <= outer[0] + outer[2] and inner[1] + inner[3] <= outer[1] + outer[3])
+
+    @staticmethod
+    def _overlap(a, b):
+        return a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and a[1] < b[1] + b[3] and b[1] < a[1] + a[3]
+
+    @classmethod
+    def _merge(cls, regions):
+        """Merges overlapping rectangles until none overlap, so no part of the frame is decoded twice."""
+        merged = []
+        for region in regions:
+            while True:
+                other = next((m for m in merged if cls._overlap(m, region)), None)
+                if other is None:
+                    break
+                merged.remove(other)
+                left = min(region[0], other[0])
+                top = min(region[1], other[1])
+                right = max(region[0] + region[2], other[0] + other[2])
+                bottom = max(region[1] + region[3], other[1] + other[3])
+                region = (left, top, right - left, bottom - top)
+            merged.append(region)
+        return merged
+
+class FramePool:
+    """
+    Reusable frame buffers, so capturing a frame does not allocate a new 900 kB array every time.
+    Every holder of a buffer (the capture, the FrameSlot and every stage working on it) holds one reference
+    and releases it when done, the buffer is reused after the last release. When all buffers are in use,
+    e.g. while a stage is slow, another buffer is allocated and kept in the pool.
+    """
+    def __init__(self, shape, count=4):
+        self.lock = threading.Lock()
+        self.shape = shape
+        self.free = [np.empty(shape, np.uint8) for _ in range(count)]
+        self.references = {}  # Reference count by id of the buffers in use
+        self.allocated = count
+        self.acquired = 0
+
+    def acquire(self):
+        """Returns a buffer with one reference, its content is the frame it held before."""
+        with self.lock:
+            self.acquired += 1
+            if len(self.free) > 0:
+                buffer = self.free.pop()
+            else:
+                buffer = np.empty(self.shape, np.uint8)
+                self.allocated += 1
+            self.references[id(buffer)] = 1
+            return buffer
+
+    def retain(self, buffer):
+        with self.lock:
+            self.references[id(buffer)] += 1
+
+    def release(self, buffer):
+        with self.lock:
+            self.references[id(buffer)] -= 1
+            if self.references[id(buffer)] == 0:
+                del self.references[id(buffer)]
+                self.free.append(buffer)
+
+    def get_stats(self):
+        """Returns the number and size of the buffers, the buffers in use and the frames captured into them."""
+        with self.lock:
+            return {"buffers": self.allocated, "buffer_kb": int(np.prod(self.shape)) / 1000,
+                    "in_use": len(self.references), "frames": self.acquired}
+
+class FrameSlot:
+    """
+    Holds only the latest item of a pipeline stage, numbered with a sequence number.
+    A slow consumer skips the items it missed instead of queuing them.
+    With retain and release the items are reference counted: the slot holds one reference to its item and
+    get() returns a new one, which the consumer must release.
+    """
+    def __init__(self, retain=None, release=None):
+        self.condition = threading.Condition()
+        self.item = None
+        self.seq = 0
+        self.closed = False
+        self.retain = retain
+        self.release = release
+
+    def put(self, item):
+        """Stores the item, the slot takes over the reference of the caller."""
+        with self.condition:
+            replaced = self.item
+            self.item = item
+            self.seq += 1
+            self.condition.notify_all()
+        if replaced is not None and self.release is not None:
+            self.release(replaced)
+
+    def get(self, last_seq, timeout=None):
+        """Waits for an item newer than last_seq, returns (seq, item) or (last_seq, None) on timeout or close."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.seq > last_seq or self.closed, timeout)
+            if self.seq <= last_seq:
+                return last_seq, None
+            if self.retain is not None:
+                self.retain(self.item)
+            return self.seq, self.item
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+class StageStats:
+    """Counts the frames and the time of a pipeline stage."""
     def __init__(self):
-        self.picam2 = Picamera2()
-        self.picam2.configure(self.picam2.create_preview_configuration(main={"format": "RGB888", "size": (640, 480)}))
-        self.picam2.start()
-        self.frame = None
+        self.lock = threading.Lock()
+        self.start_time = time.perf_counter()
+        self.count = 0
+        self.skipped = 0  # Frames which were replaced before the stage got to them
+        self.total = 0.0
+        self.last = 0.0
+        self.max = 0.0
+        self.latency_total = 0.0  # Seconds from the capture until the stage was done with the frame
+        self.latency_max = 0.0
+
+    def record(self, seconds, skipped=0, latency=0.0):
+        with self.lock:
+            self.count += 1
+            self.skipped += skipped
+            self.total += seconds
+            self.last = seconds
+            self.max = max(self.max, seconds)
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+
+    def get_stats(self):
+        with self.lock:
+            duration = time.perf_counter() - self.start_time
+            return {
+                "frames": self.count,
+                "skipped": self.skipped,
+                "fps": self.count / duration if duration > 0 else 0,
+                "avg_ms": self.total / self.count * 1000 if self.count > 0 else 0,
+                "last_ms": self.last * 1000,
+                "max_ms": self.max * 1000,
+                "latency_ms": self.latency_total / self.count * 1000 if self.count > 0 else 0,
+                "max_latency_ms": self.latency_max * 1000,
+            }
+
+class FrameBroadcast:
+    """
+    Hands every encoded frame to all viewers of the video.
+    The JPEG bytes of a frame are shared by all viewers and sent between constant multipart headers, so a frame
+    is never copied for a viewer. Every viewer waits until a newer frame than its last one exists, a slow viewer
+    skips the frames it missed instead of queuing them.
+    """
+    part_header = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
+    # Ends a part and starts the next one, sent right after the frame, so the browser shows it without waiting
+    part_separator = b'\r\n' + part_header
+
+    def __init__(self):
+        self.slot = FrameSlot()
+        self.lock = threading.Lock()
+        self.viewers = {}  # Stats by viewer id
+        self.next_id = 1
+
+    def publish(self, jpeg):
+        self.slot.put((jpeg, time.perf_counter()))
+
+    def get_latest(self):
+        """Returns the JPEG bytes of the latest frame, or None before the first frame."""
+        with self.slot.condition:
+            return self.slot.item[0] if self.slot.item is not None else None
+
+    def close(self):
+        self.slot.close()
+
+    def subscribe(self, name=""):
+        """
+        Generator of the multipart stream for one viewer, ends when the broadcast is closed.
+        Yields the header of the first part, then for every frame its JPEG bytes and the separator to the next part.
+        """
+        with self.lock:
+            viewer_id = self.next_id
+            self.next_id += 1
+            stats = {"name": name, "connected": time.perf_counter(), "frames": 0, "skipped": 0, "lag": 0.0, "max_lag": 0.0}
+            self.viewers[viewer_id] = stats
+        try:
+            yield self.part_header
+            seq = 0
+            while not self.slot.closed:
+                last_seq = seq
+                seq, item = self.slot.get(seq, timeout=1)
+                if item is None:
+                    continue
+                jpeg, encoded_at = item
+                lag = time.perf_counter() - encoded_at
+                with self.lock:
+                    stats["frames"] += 1
+                    stats["skipped"] += seq - last_seq - 1 if last_seq > 0 else 0
+                    stats["lag"] = lag
+                    stats["max_lag"] = max(stats["max_lag"], lag)
+                # Returns when the server wants the next chunk, i.e. after this one was written
+                yield jpeg
+                yield self.part_separator
+        finally:
+            # Also executed when the viewer disconnects and the server closes the generator
+            with self.lock:
+                del self.viewers[viewer_id]
+
+    def get_stats(self):
+        """Returns the frames per second, the skipped frames and the lag behind the encoder of every viewer."""
+        now = time.perf_counter()
+        with self.lock:
+            return [{
+                "id": viewer_id,
+                "name": stats["name"],
+                "connected_s": now - stats["connected"],
+                "frames": stats["frames"],
+                "skipped": stats["skipped"],
+                "fps": stats["frames"] / (now - stats["connected"]),
+                "lag_ms": stats["lag"] * 1000,
+                "max_lag_ms": stats["max_lag"] * 1000,
+            } for viewer_id, stats in self.viewers.items()]
+
+class CameraStreamer:
+    """
+    Streams the camera as JPEG and decodes the QR codes in the pictures.
+
+    Capture, QR decoding and JPEG encoding run on their own threads, connected by FrameSlots which only hold
+    the latest frame. The video never waits for the decoder: the encoder draws the last decoded codes onto
+    every new frame, while the decoder works on a downscaled grayscale copy at its own rate.
+    Frames which did not change are not decoded and of the others only the changed regions, see RegionTracker,
+    a code is printed once when it is added to the set.
+    Every frame is encoded once for all viewers, see FrameBroadcast.
+    The frames come from the camera module, or from any other FrameSource, e.g. to run the pipeline without a Pi.
+    They are captured into the buffers of a FramePool and the decoder and the encoder work in preallocated
+    buffers, so the only arrays allocated for a frame are the JPEG and its bytes for the server.
+    """
+    jpeg_quality = 65
+    decode_scale = 0.5  # The decoder sees 320x240, which is enough for a code filling a tenth of the picture
+    decode_load = 0.5  # Share of one CPU core the decoder may use, it waits accordingly after every decode
+    min_decode_interval = 0.05  # Seconds
+    overlay_timeout = 0.5  # Seconds a decoded code stays drawn on the video
+    motion_gating = True  # Decode only frames and regions which changed, see RegionTracker
+    max_region_share = 0.4  # If the changed regions cover more of the frame, e.g. while the car drives, the whole frame is decoded
+    full_decode_interval = 2.0  # Seconds, while the picture changes the whole frame is still decoded at least this often
+
+    def __init__(self, source=None):
+        self.source = source if source is not None else PicameraSource()
+        self.source.start()
+        self.on_new_code = None  # Called with the data of a code when it is added to the set, on the decode thread
+        self.broadcast = FrameBroadcast()
         self.lock = threading.Lock()
         self.running = True
-        threading.Thread(target=self._capture_loop, daemon=True).start()
         self.qr_set = set()  # To store unique QR codes
+        self.overlays = []  # (data, polygon) of the last decoded frame, in full resolution
+        self.overlay_time = 0.0
+        self.regions = RegionTracker(self.source.size)
+        self.decode_all = False  # Set to decode the next frame completely, even if it did not change
+        self.decode_counts = {"full": 0, "regions": 0, "settle": 0, "tracked": 0, "still": 0, "pixels": 0}
+
+        width, height = self.source.size
+        self.frames = FramePool((height, width, 3))
+        self.gray = np.empty((height, width), np.uint8)  # Only used by the decoder
+        self.overlay_frame = np.empty((height, width, 3), np.uint8)  # Only used by the encoder
+        self.encoded_bytes = 0  # Bytes of the JPEG arrays and their copies for the server
+
+        self.captured = FrameSlot(retain=lambda item: self.frames.retain(item[0]),
+                                  release=lambda item: self.frames.release(item[0]))
+        self.stats = {"capture": StageStats(), "decode": StageStats(), "encode": StageStats()}
+        self.threads = [
+            threading.Thread(target=self._capture_loop, name="capture", daemon=True),
+            threading.Thread(target=self._decode_loop, name="decode", daemon=True),
+            threading.Thread(target=self._encode_loop, name="encode", daemon=True),
+        ]
+        for thread in self.threads:
+            thread.start()
 
     def _capture_loop(self):
         while self.running:
-            img = self.picam2.capture_array()
-            decoded_objects = decode(img)
-            for obj in decoded_objects:
-                qr_data = obj.data.decode('utf-8')
+            start = time.perf_counter()
+            img = self.frames.acquire()
+            try:
+                self.source.capture_into(img)
+            except EOFError as e:
+                self.frames.release(img)
+                print(f"[Camera] {e}")
+                return
+            captured_at = time.perf_counter()
+            self.stats["capture"].record(captured_at - start)
+            self.captured.put((img, captured_at))  # The slot takes over the reference of the capture
+
+    def _plan_decode(self, gray, settle_regions, last_full_decode):
+        """Returns the kind of decode and the regions to decode, None for the whole frame."""
+        if not self.motion_gating or self.decode_all:
+            self.decode_all = False
+            return "full", None
+        regions = self.regions.changed_regions(gray)
+        if regions is None:
+            return "full", None
+        if len(regions) == 0 and self.regions.moved:
+            return "tracked", []
+        if len(regions) == 0:
+            # The first unchanged frame after a change is decoded once more, it is sharper than the moving ones
+            return ("settle", settle_regions) if settle_regions != [] else ("still", [])
+        height, width = gray.shape
+        if (sum(w * h for _, _, w, h in regions) > self.max_region_share * width * height
+                or time.perf_counter() - last_full_decode > self.full_decode_interval):
+            return "full", None
+        return "regions", regions
+
+    def _decode_regions(self, gray, regions):
+        """
+        Decodes the regions with decode_scale like the whole frame, so a code is found as early as before,
+        returns the codes in the coordinates of the frame.
+        """
+        if regions is None:
+            self.decode_counts["pixels"] += int(gray.size * self.decode_scale ** 2)
+            return decode_codes(gray, self.decode_scale)
+        codes = []
+        for x, y, w, h in regions:
+            self.decode_counts["pixels"] += int(w * h * self.decode_scale ** 2)
+            for qr_data, polygon in decode_codes(gray[y:y + h, x:x + w], self.decode_scale):
+                codes.append((qr_data, [(px + x, py + y) for px, py in polygon] if polygon is not None else None))
+        return codes
+
+    def _decode_loop(self):
+        seq = 0
+        settle_regions = []  # Regions of the last decode of a changed frame, [] if already settled
+        last_full_decode = 0.0
+        while self.running:
+            last_seq = seq
+            seq, item = self.captured.get(seq, timeout=1)
+            if item is None:
+                continue
+            img, captured_at = item
+
+            start = time.perf_counter()
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, dst=self.gray)
+            self.frames.release(img)
+            kind, regions = self._plan_decode(gray, settle_regions, last_full_decode)
+            self.decode_counts[kind] += 1
+            codes = []
+            if kind == "still":
+                # Nothing changed, so the codes drawn on the video are still where they are
+                with self.lock:
+                    if len(self.overlays) > 0 and start - self.overlay_time < self.overlay_timeout:
+                        self.overlay_time = start
+            elif kind != "tracked":
+                codes = self._decode_regions(gray, regions)
+                settle_regions = regions if kind != "settle" else []
+                if kind == "full":
+                    last_full_decode = start
+
+            new_codes = []
+            for qr_data, polygon in codes:
+                if polygon is not None:
+                    self.regions.code_seen(qr_data, polygon)
+                with self.lock:
+                    if qr_data not in self.qr_set:
+                        new_codes.append(qr_data)
+                    self.qr_set.add(qr_data)  # Store unique QR codes
+            for qr_data in new_codes:
                 print("QR Code Data:", qr_data)
-                self.qr_set.add(qr_data)  # Store unique QR codes
-                # Draw rectangle and label on image
-                pts = obj.polygon
-                if pts and len(pts) == 4:
-                    pts = [(pt.x, pt.y) for pt in pts]
+            found = [(qr_data, polygon) for qr_data, polygon in codes if polygon is not None]
+            if len(found) > 0:
+                with self.lock:
+                    # Codes outside of the decoded regions were not looked for, so they stay drawn
+                    kept = [] if regions is None else [(qr_data, polygon) for qr_data, polygon in self.overlays
+                                                       if not any(RegionTracker._overlap(polygon_bounds(polygon), r) for r in regions)]
+                    self.overlays = kept + found
+                    self.overlay_time = time.perf_counter()
+            end = time.perf_counter()
+            self.stats["decode"].record(end - start, seq - last_seq - 1, end - captured_at)
+            if self.on_new_code is not None:
+                for qr_data in new_codes:
+                    self.on_new_code(qr_data)
+            duration = end - start
+
+            # A slow decode waits longer, so decoding never takes more than decode_load of a core from the video
+            time.sleep(max(self.min_decode_interval, duration * (1 - self.decode_load) / self.decode_load))
+
+    def _encode_loop(self):
+        seq = 0
+        while self.running:
+            last_seq = seq
+            seq, item = self.captured.get(seq, timeout=1)
+            if item is None:
+                continue
+            img, captured_at = item
+
+            start = time.perf_counter()
+            with self.lock:
+                overlays = self.overlays if start - self.overlay_time < self.overlay_timeout else []
+            frame = img
+            if len(overlays) > 0:
+                # The decoder may still read the captured frame
+                img = self.overlay_frame
+                np.copyto(img, frame)
+                for qr_data, pts in overlays:
+                    # Draw rectangle and label on image
                     cv2.polylines(img, [np.array(pts)], isClosed=True, color=(0, 255, 0), thickness=2)
                     cv2.putText(img, qr_data, (pts[0][0], pts[0][1] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255,0,0), 2)
-            _, buffer = cv2.imencode('.jpg', img, [int(cv2.IMWRITE_JPEG_QUALITY), 65])
-            with self.lock:
-                self.frame = buffer.tobytes()
-            time.sleep(0.05)  # ~20 fps
+            _, buffer = cv2.imencode('.jpg', img, [int(cv2.IMWRITE_JPEG_QUALITY), self.jpeg_quality])
+            self.frames.release(frame)
+            # The server only writes bytes, so the JPEG is copied once and the bytes are shared by all viewers
+            jpeg = buffer.tobytes()
+            self.encoded_bytes += buffer.nbytes + len(jpeg)
+            self.broadcast.publish(jpeg)
+            end = time.perf_counter()
+            self.stats["encode"].record(end - start, seq - last_seq - 1, end - captured_at)
 
     def get_jpeg_frame(self):
-        with self.lock:
-            return (b'--frame\r\n'
-                b'Content-Type: image/jpeg\r\n\r\n' + self.frame + b'\r\n')
+        """Returns the JPEG bytes of the latest frame, or None before the first frame."""
+        return self.broadcast.get_latest()
 
-    def generate_frames(self):
-        while True:
-            frame = self.get_jpeg_frame()
-            if frame:
-                yield frame
-            time.sleep(0.05)  # control frame rate
+    def generate_frames(self, name=""):
+        """Generator of the multipart stream for one viewer, each frame is sent once as soon as it is encoded."""
+        return self.broadcast.subscribe(name)
 
     def stop(self):
         self.running = False
-        self.picam2.stop()
+        self.captured.close()
+        self.broadcast.close()
+        for thread in self.threads:
+            thread.join(timeout=2)
+        self.source.stop()
 
     def get_qr_count(self):
         """Returns the count of unique QR codes detected."""
-        return len(self.qr_set)
+        with self.lock:
+            return len(self.qr_set)
 
     def reset_qr_set(self):
         """Resets the set of detected QR codes."""
-        self.qr_set.clear()
+        with self.lock:
+            self.qr_set.clear()
+        self.decode_all = True  # The codes in view are added again, even if the car stands still
+
+    def get_stats(self):
+        """Returns the frames per second and the time per frame of the capture, decode and encode stages, the decoded frames by kind, the buffers and the viewers."""
+        stats = {name: stats.get_stats() for name, stats in self.stats.items()}
+        stats["viewers"] = self.broadcast.get_stats()
+        counts = dict(self.decode_counts)
+        decoded = counts.pop("pixels")
+        counts["pixels_per_frame"] = decoded / self.stats["decode"].count if self.stats["decode"].count > 0 else 0
+        stats["decoder"] = counts
+        encoded = self.stats["encode"].count
+        stats["buffers"] = self.frames.get_stats()
+        stats["buffers"]["encoded_kb_per_frame"] = self.encoded_bytes / encoded / 1000 if encoded > 0 else 0
+        return stats
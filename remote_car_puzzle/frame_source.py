@@ -0,0 +1,182 @@
+import os
+import time
+import cv2
+import numpy as np
+
+class FrameSource:
+    """
+    Interface of the camera backends of the CameraStreamer.
+    capture_array() returns the next frame as a 480x640x3 uint8 array in BGR order, like Picamera2 with the
+    RGB888 format, and blocks until the frame is due. capture_into(out) writes the next frame into an existing
+    array of that shape instead, so a stream of frames needs no new arrays. Backends reading files pace the frames
+    to fps, with fps=None they return the frames as fast as possible.
+    """
+    size = (640, 480)
+
+    def __init__(self, fps=30):
+        self.fps = fps
+        self.next_frame_time = None
+
+    def start(self):
+        pass
+
+    def capture_array(self):
+        return self.capture_into(np.empty((self.size[1], self.size[0], 3), np.uint8))
+
+    def capture_into(self, out):
+        raise NotImplementedError
+
+    def stop(self):
+        pass
+
+    def _wait_for_frame(self):
+        """Sleeps until the next frame is due, without drifting."""
+        if self.fps is None:
+            return
+        now = time.perf_counter()
+        if self.next_frame_time is None or self.next_frame_time < now - 1:
+            self.next_frame_time = now
+        time.sleep(max(0, self.next_frame_time - now))
+        self.next_frame_time += 1 / self.fps
+
+class PicameraSource(FrameSource):
+    """The camera module of the Raspberry Pi, paced by the camera itself."""
+    def __init__(self):
+        super().__init__(fps=None)
+        from picamera2 import Picamera2, MappedArray  # Only installed on the Raspberry Pi
+        self.mapped_array = MappedArray
+        self.picam2 = Picamera2()
+        self.picam2.configure(self.picam2.create_preview_configuration(main={"format": "RGB888", "size": self.size}))
+
+    def start(self):
+        self.picam2.start()
+
+    def capture_array(self):
+        return self.picam2.capture_array()
+
+    def capture_into(self, out):
+        # The buffer of the camera is only mapped and copied into out, it goes back to the camera right after
+        request = self.picam2.capture_request()
+        try:
+            with self.mapped_array(request, "main") as mapped:
+                np.copyto(out, mapped.array)
+        finally:
+            request.release()
+        return out
+
+    def stop(self):
+        self.picam2.stop()
+
+class VideoFileSource(FrameSource):
+    """Frames of a video file, e.g. recorded with the car, started again at the end if loop is set."""
+    def __init__(self, path, fps=30, loop=True):
+        super().__init__(fps)
+        self.path = path
+        self.loop = loop
+        self.capture = cv2.VideoCapture(str(path))
+        if not self.capture.isOpened():
+            raise ValueError(f"Cannot open video file {path}")
+
+    def capture_into(self, out):
+        self._wait_for_frame()
+        ok, img = self.capture.read()
+        if not ok and self.loop:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, img = self.capture.read()
+        if not ok:
+            raise EOFError(f"End of video file {self.path}")
+        if (img.shape[1], img.shape[0]) != self.size:
+            return cv2.resize(img, self.size, dst=out)
+        np.copyto(out, img)
+        return out
+
+    def stop(self):
+        self.capture.release()
+
+class ImageDirectorySource(FrameSource):
+    """The images of a folder in the order of their names, loaded once and repeated."""
+    extensions = (".png", ".jpg", ".jpeg", ".bmp")
+
+    def __init__(self, path, fps=30):
+        super().__init__(fps)
+        names = sorted(name for name in os.listdir(path) if name.lower().endswith(self.extensions))
+        if len(names) == 0:
+            raise ValueError(f"No images in {path}")
+        self.images = [cv2.resize(cv2.imread(os.path.join(path, name)), self.size) for name in names]
+        self.index = 0
+
+    def capture_into(self, out):
+        self._wait_for_frame()
+        np.copyto(out, self.images[self.index % len(self.images)])  # The streamer may draw onto the frame
+        self.index += 1
+        return out
+
+class SyntheticQRSource(FrameSource):
+    """
+    A maze wall scene in which QR codes appear one after another and move across the picture, like when the car drives by.
+
+    The timeline is counted in frames, so every run shows the same pictures. Code i is visible from frame
+    i * period for visible_frames frames, which codes are in the last frame is stored in visible_codes, and the time
+    a code was returned for the first time in first_shown.
+    """
+    def __init__(self, codes=("code-1", "code-2", "code-3"), fps=30, period=60, visible_frames=45,
+                 code_size=160, speed=2, noise=8, seed=1):
+        super().__init__(fps)
+        self.codes = list(codes)
+        self.period = period
+        self.visible_frames = visible_frames
+        self.speed = speed  # Pixels per frame the codes move
+        self.index = 0
+        self.visible_codes = []
+        self.first_shown = {}  # perf_counter time by code
+
+        random = np.random.default_rng(seed)
+        width, height = self.size
+        # Wall with a gradient and texture, so the decoder does not get a perfectly flat background
+        gradient = np.linspace(120, 200, width, dtype=np.float32)[None, :, None]
+        background = np.clip(gradient + random.normal(0, 12, (height, width, 3)), 0, 255).astype(np.int16)
+        # Backgrounds with sensor noise, prepared once and cycled, so generating a frame stays cheap
+        self.backgrounds = [background.astype(np.uint8)] if noise == 0 else [
+            np.clip(background + random.integers(-noise, noise + 1, (height, width, 3), dtype=np.int16), 0, 255).astype(np.uint8)
+            for _ in range(8)]
+
+        encoder = cv2.QRCodeEncoder.create()
+        self.code_images = []
+        for code in self.codes:
+            image = cv2.resize(encoder.encode(code), (code_size, code_size), interpolation=cv2.INTER_NEAREST)
+            self.code_images.append(cv2.cvtColor(image, cv2.COLOR_GRAY2BGR))
+
+    def frames_total(self):
+        """Number of frames until the last code has disappeared."""
+        return (len(self.codes) - 1) * self.period + self.visible_frames
+
+    def render(self, index, out=None):
+        """Returns the frame with the index, drawn into out if given, and the codes visible in it."""
+        background = self.backgrounds[index % len(self.backgrounds)]
+        if out is None:
+            img = background.copy()
+        else:
+            img = out
+            np.copyto(img, background)
+
+        visible = []
+        width, height = self.size
+        for number, (code, image) in enumerate(zip(self.codes, self.code_images)):
+            age = index - number * self.period
+            if age < 0 or age >= self.visible_frames:
+                continue
+            size = image.shape[0]
+            x = (40 + age * self.speed + number * 97) % (width - size)
+            y = (60 + number * 131) % (height - size)
+            img[y:y + size, x:x + size] = image
+            visible.append(code)
+        return img, visible
+
+    def capture_into(self, out):
+        self._wait_for_frame()
+        img, self.visible_codes = self.render(self.index, out)
+        self.index += 1
+        now = time.perf_counter()
+        for code in self.visible_codes:
+            self.first_shown.setdefault(code, now)
+        return img
@@ -11,9 +11,11 @@ MQTT_BROKER = os.getenv("MQTT_BROKER", "localhost")
 MQTT_PORT = int(os.getenv("MQTT_PORT", 1883))
 MQTT_TOPIC_GENERAL = os.getenv("MQTT_TOPIC_GENERAL", "general")
 MQTT_TOPIC_POINTS = os.getenv("MQTT_TOPIC_POINTS", "points")
+MQTT_TOPIC_STATUS = os.getenv("MQTT_TOPIC_STATUS", "status")
 MQTT_USERNAME = os.getenv("MQTT_USERNAME")
 MQTT_PASSWORD = os.getenv("MQTT_PASSWORD")
 MQTT_NEEDS_USER = True  # Set to False if you don't need auth
+MQTT_KEEPALIVE = 30  # The broker publishes the last will after 1.5 times the keep alive without a packet
 DEBUG = True
 
 # Generate unique client ID (like esp32-client-MAC)
@@ -24,6 +26,16 @@ client = mqtt.Client(client_id)
 if MQTT_NEEDS_USER:
     client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
 
+# Published by the broker when the connection is lost, so the base station knows that the puzzle is gone
+client.will_set(MQTT_TOPIC_STATUS, "offline", qos=1, retain=True)
+
+# Called after every (re)connect
+def on_connect(client, userdata, flags, rc):
+    if DEBUG:
+        print(f"[MQTT] Connected with result code {rc}")
+    # Retained, so the base station knows the puzzle is online even if it subscribes later
+    client.publish(MQTT_TOPIC_STATUS, "online", qos=1, retain=True)
+
 # Callback function
 def on_message(client, userdata, msg):
     topic_str = msg.topic
@@ -45,10 +57,11 @@ def setup_communication():
     if DEBUG:
         print(f"[MQTT] Connecting to broker {MQTT_BROKER}...")
 
+    client.on_connect = on_connect
     client.on_message = on_message
     client.reconnect_delay_set(min_delay=2, max_delay=10)
-    client.keep_alive = 90
-    client.connect(MQTT_BROKER, MQTT_PORT, keepalive=90)
+    client.keep_alive = MQTT_KEEPALIVE
+    client.connect(MQTT_BROKER, MQTT_PORT, keepalive=MQTT_KEEPALIVE)
 
     client.loop_start()
 
@@ -62,8 +75,6 @@ def setup_communication():
     if DEBUG:
         print(f"[MQTT] Subscribed to {MQTT_TOPIC_GENERAL}")
 
-    client.publish(MQTT_TOPIC_GENERAL, "I am online")
-
 # Periodically check MQTT connection
 def loop_communication():
     if not client.is_connected():
@@ -83,6 +94,9 @@ def start():
 def stop():
     if DEBUG:
         print("[MQTT] Stopping communication")
+    # The broker does not publish the last will on a clean disconnect
+    if client.is_connected():
+        client.publish(MQTT_TOPIC_STATUS, "offline", qos=1, retain=True).wait_for_publish(timeout=2)
     client.loop_stop()
     client.disconnect()
 
@@ -105,5 +119,4 @@ if __name__ == "__main__":
             time.sleep(1)
     except KeyboardInterrupt:
         print("[MQTT] Shutting down")
-        client.loop_stop()
-        client.disconnect()
+        stop()
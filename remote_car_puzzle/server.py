@@ -15,7 +15,7 @@ def index():
 
 @app.route('/video_feed')
 def video_feed():
-    return Response(camera.generate_frames(),
+    return Response(camera.generate_frames(request.remote_addr),
                     mimetype='multipart/x-mixed-replace; boundary=frame', direct_passthrough=True)
 
 @app.route('/move', methods=['POST'])
@@ -42,6 +42,21 @@ def get_qr_count():
         mqtt.publish_finished()
     return jsonify(count=qr_count)
 
+@app.route('/stats')
+def get_stats():
+    """
+    Returns the statistics of the camera stream as JSON
+        capture, decode, encode  frames, skipped frames, fps, avg_ms, last_ms and max_ms per frame,
+                                 latency_ms and max_latency_ms from the capture until the stage was done
+        decoder                  frames decoded completely (full), in regions, once more after a change (settle),
+                                 not decoded as only known codes moved (tracked) or nothing changed (still),
+                                 and the decoded pixels per frame
+        buffers                  number and size of the frame buffers, buffers in use, frames captured into them
+                                 and kB allocated per encoded frame
+        viewers                  fps, skipped frames and lag behind the encoder of every viewer of /video_feed
+    """
+    return jsonify(camera.get_stats())
+
 @app.route('/reset_qr_set', methods=['POST'])
 def reset_qr_set():
     camera.reset_qr_set()
@@ -0,0 +1,164 @@
+"""
+Benchmark of the camera pipeline of the car, runs on any Linux box without the camera module
+
+Measurements
+    decode    hit rate and time of decode_codes() on every frame of the scene, for every scale of --scales
+    pipeline  the CameraStreamer fed at camera speed with one viewer of the stream: time from the first frame
+              showing a code until the code was decoded, rate and latency of every stage, the fps of the viewer
+              and the frame buffers, once decoding every frame completely and once only the changed frames and
+              regions (motion gating)
+
+By default the scene is a SyntheticQRSource, in which the codes appear one after another. Recordings of the car can
+be measured with --video or --images, then the share of frames with any decoded code is reported instead of the
+hit rate, as there is no ground truth. pyzbar needs the zbar library (sudo apt install libzbar0).
+
+Usage (from the remote_car_puzzle folder):
+    python vision_benchmark.py
+    python vision_benchmark.py --scales 1 0.5 0.35 --duration 20 --json vision.json
+    python vision_benchmark.py --video maze.mp4 --frames 600
+"""
+
+import argparse
+import json
+import threading
+import time
+
+from display import CameraStreamer, decode_codes
+from frame_source import SyntheticQRSource, VideoFileSource, ImageDirectorySource
+
+def percentiles(values):
+    """Returns the count, the 50th, 90th and 99th percentile and the maximum of the values."""
+    if len(values) == 0:
+        return {"count": 0, "p50": None, "p90": None, "p99": None, "max": None}
+    ordered = sorted(values)
+    rank = lambda fraction: ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+    return {"count": len(ordered), "p50": rank(0.5), "p90": rank(0.9), "p99": rank(0.99), "max": ordered[-1]}
+
+def create_source(args, fps):
+    if args.video is not None:
+        return VideoFileSource(args.video, fps=fps)
+    if args.images is not None:
+        return ImageDirectorySource(args.images, fps=fps)
+    return SyntheticQRSource(fps=fps, code_size=args.code_size, speed=args.speed, noise=args.noise, seed=args.seed)
+
+def measure_decode(args, scale):
+    """Decodes every frame of the scene one after another."""
+    source = create_source(args, fps=None)
+    is_synthetic = isinstance(source, SyntheticQRSource)
+    frames = source.frames_total() if is_synthetic else args.frames
+
+    times = []
+    frames_with_codes = 0
+    hits = 0
+    false_codes = 0
+    for _ in range(frames):
+        img = source.capture_array()
+        start = time.perf_counter()
+        codes = set(data for data, _ in decode_codes(img, scale))
+        times.append((time.perf_counter() - start) * 1000)
+
+        visible = set(source.visible_codes) if is_synthetic else codes
+        if len(visible) > 0:
+            frames_with_codes += 1
+            hits += len(codes & visible) == len(visible)
+        false_codes += len(codes - visible)
+    source.stop()
+
+    return {
+        "scale": scale,
+        "frames": frames,
+        "frames_with_codes": frames_with_codes,
+        "hit_rate": hits / frames_with_codes if is_synthetic and frames_with_codes > 0 else None,
+        "decoded_share": frames_with_codes / frames if not is_synthetic else None,
+        "false_codes": false_codes,
+        "decode_ms": percentiles(times),
+    }
+
+def measure_pipeline(args, motion_gating):
+    """Runs the CameraStreamer with one viewer at the frame rate of the camera."""
+    source = create_source(args, fps=args.fps)
+    duration = args.duration
+    if duration is None:
+        duration = source.frames_total() / args.fps + 2 if isinstance(source, SyntheticQRSource) else 10
+
+    detected = {}
+    CameraStreamer.motion_gating = motion_gating
+    streamer = CameraStreamer(source)
+    streamer.on_new_code = lambda data: detected.setdefault(data, time.perf_counter())
+
+    def view():
+        for _ in streamer.generate_frames("benchmark"):
+            pass
+    viewer = threading.Thread(target=view, daemon=True)
+    viewer.start()
+    time.sleep(duration)
+    stats = streamer.get_stats()
+    streamer.stop()
+    viewer.join(timeout=2)
+
+    viewer_frames = stats["viewers"][0]["frames"] if len(stats["viewers"]) > 0 else 0
+    result = {"motion_gating": motion_gating, "duration_s": duration, "stream_fps": viewer_frames / duration, "stages": stats}
+    if isinstance(source, SyntheticQRSource):
+        result["codes"] = len(source.codes)
+        result["detected"] = len(detected)
+        result["time_to_detection_ms"] = percentiles(
+            [(detected[code] - shown) * 1000 for code, shown in source.first_shown.items() if code in detected])
+    return result
+
+def format_ms(summary):
+    if summary["count"] == 0:
+        return f"{'-':>8} {'-':>8} {'-':>8}"
+    return f"{summary['p50']:>8.1f} {summary['p90']:>8.1f} {summary['max']:>8.1f}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Decode hit rate, detection latency and stream fps of the camera pipeline")
+    parser.add_argument("--video", default=None, help="Use the frames of this video file instead of the synthetic scene")
+    parser.add_argument("--images", default=None, help="Use the images of this folder instead of the synthetic scene")
+    parser.add_argument("--frames", type=int, default=300, help="Frames of a recording for the decode measurement")
+    parser.add_argument("--scales", type=float, nargs="+", default=[1.0, 0.5], help="Scales of the decode measurement")
+    parser.add_argument("--fps", type=float, default=30, help="Frame rate of the source in the pipeline measurement")
+    parser.add_argument("--duration", type=float, default=None, help="Seconds of the pipeline measurement, by default until the last code has disappeared")
+    parser.add_argument("--code-size", type=int, default=160, help="Size of the synthetic codes in pixels")
+    parser.add_argument("--speed", type=int, default=2, help="Pixels per frame the synthetic codes move")
+    parser.add_argument("--noise", type=int, default=8, help="Amplitude of the noise of the synthetic scene")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the synthetic scene")
+    parser.add_argument("--json", default=None, help="Write the results to this file")
+    args = parser.parse_args()
+
+    results = {
+        "decode": [measure_decode(args, scale) for scale in args.scales],
+        "pipeline": [measure_pipeline(args, motion_gating) for motion_gating in [False, True]],
+    }
+
+    print()
+    rate_label = "hit rate" if results["decode"][0]["hit_rate"] is not None else "decoded"
+    print(f"{'Decode':<10} {'frames':>7} {rate_label:>9} {'false':>6} {'p50 [ms]':>8} {'p90 [ms]':>8} {'max [ms]':>8}")
+    for r in results["decode"]:
+        rate = r["hit_rate"] if r["hit_rate"] is not None else r["decoded_share"]
+        print(f"{'scale ' + str(r['scale']):<10} {r['frames']:>7} {rate:>9.1%} {r['false_codes']:>6} {format_ms(r['decode_ms'])}")
+
+    for p in results["pipeline"]:
+        print()
+        mode = "motion gating" if p["motion_gating"] else "every frame decoded completely"
+        print(f"Pipeline with {mode} for {p['duration_s']:.1f} s, stream {p['stream_fps']:.1f} fps")
+        print(f"{'Stage':<10} {'fps':>7} {'skipped':>8} {'avg [ms]':>9} {'max [ms]':>9} {'latency [ms]':>13}")
+        for name in ["capture", "decode", "encode"]:
+            s = p["stages"][name]
+            print(f"{name:<10} {s['fps']:>7.1f} {s['skipped']:>8} {s['avg_ms']:>9.2f} {s['max_ms']:>9.2f} {s['latency_ms']:>13.2f}")
+        d = p["stages"]["decoder"]
+        decode = p["stages"]["decode"]
+        print(f"Decoded frames: {d['full']} complete, {d['regions']} regions, {d['settle']} settled, "
+              f"{d['tracked']} known codes moved, {d['still']} unchanged, "
+              f"{d['pixels_per_frame']:.0f} pixels per frame, {decode['avg_ms'] * decode['fps']:.0f} ms decoding per second")
+        b = p["stages"]["buffers"]
+        print(f"Frames captured into {b['buffers']} buffers of {b['buffer_kb']:.0f} kB, "
+              f"{b['encoded_kb_per_frame']:.0f} kB allocated per encoded frame")
+        if "codes" in p:
+            print(f"Detected {p['detected']} of {p['codes']} codes, time to detection [ms]: p50 p90 max {format_ms(p['time_to_detection_ms'])}")
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=4)
+
+if __name__ == "__main__":
+    main()